@@ -0,0 +1,23 @@
+"""Gunicorn profile serving the backend over ASGI with uvicorn workers.
+
+Use instead of the default WSGI command of prod.Dockerfile:
+    gunicorn -c gunicorn.asgi.conf.py p7.asgi:application
+
+Each worker runs an event loop, so requests to the async endpoints (search,
+find_service, sync_files) no longer hold a thread while they wait on the
+database. The remaining sync endpoints run in the worker's thread pool.
+"""
+# Gunicorn reads its settings from lowercase module variables
+# pylint: disable=invalid-name
+
+import multiprocessing
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.getenv("GUNICORN_WORKERS", str(multiprocessing.cpu_count())))
+worker_class = "uvicorn_worker.UvicornWorker"
+accesslog = "-"
+errorlog = "-"
+
+# Mount the async versions of the endpoints, see ASYNC_ENDPOINTS in p7/settings.py
+raw_env = ["ASYNC_ENDPOINTS=True"]
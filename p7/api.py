@@ -1,5 +1,6 @@
 """API routing for the P7 backend."""
 
+from django.conf import settings
 from ninja import NinjaAPI
 
 from p7.get_dropbox_files.api import fetch_dropbox_files_router
@@ -16,14 +17,15 @@ from p7.download_google_drive_files.api import download_google_drive_files_route
 from p7.download_local_files.api import download_local_files_router
 from p7.test_download_files.api import test_download_files_router
 
-from p7.sync_files.api import sync_files_router
+from p7.sync_files.api import async_sync_files_router, sync_files_router
 from p7.create_user.api import create_user_router
 from p7.delete_user.api import delete_user_router
-from p7.find_services.api import find_services_router
+from p7.find_services.api import async_find_services_router, find_services_router
 from p7.find_services_tokens.api import find_services_tokens_router
 from p7.create_service.api import create_service_router
 from p7.find_user_by_email.api import find_user_by_email_router
-from p7.search.api import search_router
+from p7.search.api import async_search_router, search_router
+from p7.metrics.api import metrics_router
 
 api = NinjaAPI()
 
@@ -40,12 +42,19 @@ api.add_router("/download_onedrive_files/", download_onedrive_files_router)
 api.add_router("/download_local_files/", download_local_files_router)
 api.add_router("/test_download_files/", test_download_files_router)
 
-api.add_router("/sync_files/", sync_files_router)
+api.add_router(
+    "/sync_files/",
+    async_sync_files_router if settings.ASYNC_ENDPOINTS else sync_files_router,
+)
 
 api.add_router("/find_user_by_email/", find_user_by_email_router)
 api.add_router("/delete_user/", delete_user_router)
 api.add_router("/create_user/", create_user_router)
 api.add_router("/create_service/", create_service_router)
-api.add_router("/find_service/", find_services_router)
+api.add_router(
+    "/find_service/",
+    async_find_services_router if settings.ASYNC_ENDPOINTS else find_services_router,
+)
 api.add_router("/find_services_tokens/", find_services_tokens_router)
-api.add_router("/search/", search_router)
+api.add_router("/search/", async_search_router if settings.ASYNC_ENDPOINTS else search_router)
+api.add_router("/metrics/", metrics_router)
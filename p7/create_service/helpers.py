@@ -1,8 +1,7 @@
 """Helper functions for create_service module."""
-from datetime import timedelta
 from django.db import IntegrityError
-from django.utils.timezone import now
-from django_q.tasks import async_task, schedule
+from repository.queue import submit_task
+from p7.sync_files.planner import schedule_service_sync
 from p7.get_google_drive_files.api import process_google_drive_files
 from p7.get_dropbox_files.api import process_dropbox_files
 from p7.get_onedrive_files.api import process_onedrive_files
@@ -19,23 +18,17 @@ def schedule_fetching_files(cleaned):
             try:
                 group = f"Google-Drive-{cleaned['userId']}"
                 # Could trigger Google Drive file fetch here if desired
-                async_task(
+                submit_task(
                     process_google_drive_files,
                     cleaned["userId"],
                     cluster="high",
                     group=group,
                 )
-                # Schedule daily sync of Google Drive files
-                # Pass the callable as a dotted path string and args as a list so django-q
-                # worker can import and resolve the function at runtime.
-                schedule(
-                    func="p7.sync_files.service_sync_functions.sync_google_drive_files",
-                    schedule_type="D",
-                    name=group,
-                    user_id=cleaned["userId"],
-                    priority="low",
-                    cluster="low",
-                    next_run=now() + timedelta(hours=24),
+                # Schedule periodic sync of Google Drive files, staggered per service
+                schedule_service_sync(
+                    "p7.sync_files.service_sync_functions.sync_google_drive_files",
+                    cleaned["userId"],
+                    group,
                 )
             except IntegrityError as e:
                 print(f"Error scheduling Google Drive tasks: {e}")
@@ -43,16 +36,12 @@ def schedule_fetching_files(cleaned):
             try:
                 group = f"Dropbox-{cleaned['userId']}"
                 # Could trigger Dropbox file fetch here if desired
-                async_task(process_dropbox_files, cleaned["userId"], cluster="high", group=group)
-                # Schedule daily sync of Dropbox files
-                schedule(
-                    func="p7.sync_files.service_sync_functions.sync_dropbox_files",
-                    schedule_type="D",
-                    name=group,
-                    user_id=cleaned["userId"],
-                    priority="low",
-                    cluster="low",
-                    next_run=now() + timedelta(hours=24),
+                submit_task(process_dropbox_files, cleaned["userId"], cluster="high", group=group)
+                # Schedule periodic sync of Dropbox files, staggered per service
+                schedule_service_sync(
+                    "p7.sync_files.service_sync_functions.sync_dropbox_files",
+                    cleaned["userId"],
+                    group,
                 )
             except IntegrityError as e:
                 print(f"Error scheduling Dropbox tasks: {e}")
@@ -60,16 +49,12 @@ def schedule_fetching_files(cleaned):
             try:
                 group = f"Onedrive-{cleaned['userId']}"
                 # Could trigger OneDrive file fetch here if desired
-                async_task(process_onedrive_files, cleaned["userId"], cluster="high", group=group)
-                # Schedule daily sync of OneDrive files
-                schedule(
-                    func="p7.sync_files.service_sync_functions.sync_onedrive_files",
-                    schedule_type="D",
-                    name=group,
-                    user_id=cleaned["userId"],
-                    priority="low",
-                    cluster="low",
-                    next_run=now() + timedelta(hours=24),
+                submit_task(process_onedrive_files, cleaned["userId"], cluster="high", group=group)
+                # Schedule periodic sync of OneDrive files, staggered per service
+                schedule_service_sync(
+                    "p7.sync_files.service_sync_functions.sync_onedrive_files",
+                    cleaned["userId"],
+                    group,
                 )
             except IntegrityError as e:
                 print(f"Error scheduling OneDrive tasks: {e}")
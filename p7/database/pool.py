@@ -0,0 +1,97 @@
+"""Connection reuse for the default database, per pooling mode and process role.
+
+The database driver is psycopg 3, which the pool and pgbouncer modes rely on.
+
+Modes (DATABASE_POOL_MODE):
+    none        a new connection per request or task, Django's default.
+    persistent  connections are kept for CONN_MAX_AGE seconds per thread.
+    pool        a psycopg 3 connection pool per process (Django 5.1+).
+    pgbouncer   persistent connections to a pgbouncer in transaction pooling mode.
+
+Roles size the pool to the concurrency of the process: a gunicorn worker runs up to
+one request per thread, an ASGI worker many requests per event loop, and a
+django-q worker one task at a time. Persistent connections are per thread, which
+under ASGI means per request, so ASGI workers default to the pool instead.
+"""
+
+import sys
+from collections.abc import Mapping
+
+POOL_MODES = ("none", "persistent", "pool", "pgbouncer")
+
+# Mode and (min_size, max_size) of the pool used when not configured, per role
+ROLE_DEFAULTS = {
+    "web": ("persistent", (2, 12)),
+    "asgi": ("pool", (2, 20)),
+    "worker": ("persistent", (1, 2)),
+}
+
+
+def process_role(environ: Mapping[str, str], argv: list[str] | None = None) -> str:
+    """
+    The role of the running process, from PROCESS_ROLE or how it was started.
+    """
+    argv = sys.argv if argv is None else argv
+    if environ.get("PROCESS_ROLE"):
+        return environ["PROCESS_ROLE"]
+    if "qcluster" in argv:
+        return "worker"
+    if environ.get("ASYNC_ENDPOINTS") == "True":
+        return "asgi"
+    return "web"
+
+
+def connection_settings(role: str, environ: Mapping[str, str]) -> dict:
+    """
+    Connection settings to merge into DATABASES["default"] for a process role.
+
+    params:
+        role: One of ROLE_DEFAULTS, see process_role.
+        environ: The environment, read for DATABASE_POOL_* overrides.
+    returns:
+        CONN_MAX_AGE, CONN_HEALTH_CHECKS, OPTIONS and DISABLE_SERVER_SIDE_CURSORS.
+    """
+    default_mode, (default_min, default_max) = ROLE_DEFAULTS[role]
+    mode = environ.get("DATABASE_POOL_MODE") or default_mode
+    if mode not in POOL_MODES:
+        raise ValueError(f"DATABASE_POOL_MODE must be one of {POOL_MODES}, got {mode!r}")
+
+    conn_max_age = int(environ.get("DATABASE_CONN_MAX_AGE", "60"))
+    options = {}
+    disable_server_side_cursors = False
+
+    if mode == "none":
+        conn_max_age = 0
+    elif mode == "pool":
+        # The pool does its own reuse, Django refuses pools with persistent connections
+        conn_max_age = 0
+        options["pool"] = {
+            "min_size": int(environ.get(f"DATABASE_POOL_MIN_SIZE_{role.upper()}", default_min)),
+            "max_size": int(environ.get(f"DATABASE_POOL_MAX_SIZE_{role.upper()}", default_max)),
+            # Seconds a request waits for a free connection before failing
+            "timeout": float(environ.get("DATABASE_POOL_TIMEOUT", "30")),
+            # Idle connections above min_size are closed after this many seconds
+            "max_idle": float(environ.get("DATABASE_POOL_MAX_IDLE", "600")),
+            "check": _pool_health_check(),
+        }
+    elif mode == "pgbouncer":
+        # Transaction pooling hands each transaction a different server connection,
+        # so nothing may outlive a transaction: no server-side cursors or prepared
+        # statements. The scheduler only takes transaction-level advisory locks.
+        disable_server_side_cursors = True
+        options["prepare_threshold"] = None
+
+    return {
+        "CONN_MAX_AGE": conn_max_age,
+        # Reused connections are checked before a request or task uses them
+        "CONN_HEALTH_CHECKS": conn_max_age > 0,
+        "OPTIONS": options,
+        "DISABLE_SERVER_SIDE_CURSORS": disable_server_side_cursors,
+    }
+
+
+def _pool_health_check():
+    """psycopg_pool's check run on a connection before it is handed out."""
+    from psycopg_pool import ConnectionPool  # pylint: disable=import-outside-toplevel
+
+    return ConnectionPool.check_connection
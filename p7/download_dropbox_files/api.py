@@ -5,10 +5,16 @@ import requests
 from ninja import Router, Header
 from django.http import JsonResponse
 from django.utils import timezone
-from django_q.tasks import async_task
-from p7.helpers import validate_internal_auth, parse_file_content
+from p7.helpers import (
+    validate_internal_auth,
+    parse_file_content,
+    spool_content,
+    READ_CHUNK_SIZE,
+)
 from p7.get_dropbox_files.helper import get_new_access_token
-from repository.file import update_tsvector_content, fetch_downloadable_files
+from p7.metrics.helpers import observe_download
+from repository.file import ContentIndexWriter
+from repository.queue import DownloadBatch, submit_task
 from repository.service import get_tokens, get_service
 from repository.user import get_user
 
@@ -33,7 +39,7 @@ def download_dropbox_files(
     if isinstance(user, JsonResponse):
         return user
 
-    task_id = async_task(
+    task_id = submit_task(
         process_download_dropbox_files,
         user_id, cluster="high",
         group=f"Dropbox-{user_id}"
@@ -41,11 +47,13 @@ def download_dropbox_files(
 
     return JsonResponse({"task_id": task_id, "status": "processing"}, status=202)
 
-def process_download_dropbox_files(user_id):
-    """Download Dropbox files for a given user.
+def process_download_dropbox_files(user_id, after_id=None):
+    """Download a batch of Dropbox files for a given user.
+    The remaining files are queued as a new task.
 
     params:
         user_id (str): The ID of the user whose Dropbox files are to be processed.
+        after_id (int): Continue after the file with this id.
     """
     access_token, access_token_expiration, refresh_token = get_tokens(
         user_id, "dropbox"
@@ -65,6 +73,7 @@ def process_download_dropbox_files(user_id):
             access_token,
             access_token_expiration,
             refresh_token,
+            after_id,
         )
 
         return files
@@ -78,10 +87,12 @@ def download_recursive_files(
     access_token,
     access_token_expiration,
     refresh_token,
+    after_id=None,
 ):
     """Download files recursively from a user's Dropbox account."""
 
-    dropbox_files = fetch_downloadable_files(service)
+    # A bounded batch, resumed from the service's checkpoint after a crash
+    dropbox_files = DownloadBatch(service, after_id)
     if not dropbox_files:
         print("No downloadable Dropbox files found for user.")
 
@@ -89,6 +100,8 @@ def download_recursive_files(
 
     files = []
     errors = []
+    # Content is written in batches, flushed after the loop
+    index_writer = ContentIndexWriter()
     for dropbox_file in dropbox_files:
         file_id = dropbox_file.serviceFileId
 
@@ -107,6 +120,7 @@ def download_recursive_files(
                     "Dropbox-API-Arg": json.dumps({"path": file_id}),
                 },
                 timeout=30,
+                stream=True,
             )
 
             dropbox_result = json.loads(response.headers.get("Dropbox-API-Result"))
@@ -118,14 +132,16 @@ def download_recursive_files(
             errors.append(f"Failed to download {file_id}: {e}")
             continue
 
-        dropbox_content = parse_file_content(
-            response.content,
-            dropbox_file,
-        )
+        with spool_content(response.iter_content(READ_CHUNK_SIZE)) as content_stream:
+            observe_download("dropbox", content_stream)
+            dropbox_content = parse_file_content(
+                content_stream,
+                dropbox_file,
+            )
 
         if dropbox_content:
             try:
-                update_tsvector_content(
+                index_writer.add(
                     dropbox_file,
                     dropbox_content,
                     timezone.now(),
@@ -138,6 +154,12 @@ def download_recursive_files(
             except RuntimeError as e:
                 errors.append(f"Error updating tsvector for file {file_id}: {str(e)}")
 
+    index_writer.flush()
+    dropbox_files.finish(
+        process_download_dropbox_files,
+        group=f"Dropbox-{service.userId_id}",
+    )
+
     if errors:
         print("Errors occurred during Dropbox file downloads:")
         for error in errors:
@@ -1,11 +1,10 @@
 """API for fetching and saving Google Drive files."""
 
-import io
 import os
+from tempfile import SpooledTemporaryFile
 from django.utils import timezone
 from django.http import JsonResponse
 from ninja import Router, Header
-from django_q.tasks import async_task
 
 # Google libs
 from google.oauth2.credentials import Credentials
@@ -13,9 +12,11 @@ from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseDownload
 from googleapiclient.errors import HttpError
 
-from p7.helpers import validate_internal_auth, parse_file_content
+from p7.helpers import validate_internal_auth, parse_file_content, SPOOL_MAX_SIZE
 from p7.get_google_drive_files.helper import get_new_access_token
-from repository.file import update_tsvector_content, fetch_downloadable_files
+from p7.metrics.helpers import observe_download
+from repository.file import ContentIndexWriter
+from repository.queue import DownloadBatch, submit_task
 from repository.service import get_tokens, get_service
 from repository.user import get_user
 
@@ -42,7 +43,7 @@ def download_google_drive_files(
     if isinstance(user, JsonResponse):
         return user
 
-    task_id = async_task(
+    task_id = submit_task(
         process_download_google_drive_files,
         user_id,
         cluster="high",
@@ -51,10 +52,12 @@ def download_google_drive_files(
     return JsonResponse({"task_id": task_id, "status": "processing"}, status=202)
 
 
-def process_download_google_drive_files(user_id):
-    """Download Google Drive files for a given user.
+def process_download_google_drive_files(user_id, after_id=None):
+    """Download a batch of Google Drive files for a given user.
+    The remaining files are queued as a new task.
     params:
         user_id: The ID of the user whose Google Drive files are to be downloaded.
+        after_id: Continue after the file with this id.
     """
     access_token, _, refresh_token = get_tokens(user_id, "google")
     service = get_service(user_id, "google")
@@ -84,6 +87,7 @@ def process_download_google_drive_files(user_id):
             creds,
             service,
             access_token,
+            after_id,
         )
 
         return files
@@ -104,10 +108,12 @@ def download_recursive_files(
     creds,
     service,
     access_token,
+    after_id=None,
 ):
     """Download files recursively from a user's Google Drive account."""
 
-    google_drive_files = fetch_downloadable_files(service)
+    # A bounded batch, resumed from the service's checkpoint after a crash
+    google_drive_files = DownloadBatch(service, after_id)
     if not google_drive_files:
         print("No downloadable Google Drive files found for user.")
 
@@ -115,6 +121,8 @@ def download_recursive_files(
 
     files = []
     errors = []
+    # Content is written in batches, flushed after the loop
+    index_writer = ContentIndexWriter()
     for google_drive_file in google_drive_files:
         file_id = google_drive_file.serviceFileId
 
@@ -138,7 +146,7 @@ def download_recursive_files(
                         mimeType="text/plain"
                     )
 
-                fh = io.BytesIO()
+                fh = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
                 downloader = MediaIoBaseDownload(fh, request)
                 done = False
                 while not done:
@@ -146,18 +154,21 @@ def download_recursive_files(
             except (HttpError, RuntimeError):
                 request = drive_api.files().get_media(fileId=file_id)
 
-                fh = io.BytesIO()
+                fh = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
                 downloader = MediaIoBaseDownload(fh, request)
                 done = False
                 while not done:
                     _, done = downloader.next_chunk()
 
-            google_drive_content = parse_file_content(
-                fh.getvalue(),
-                google_drive_file,
-            )
+            with fh:
+                fh.seek(0)
+                observe_download("google", fh)
+                google_drive_content = parse_file_content(
+                    fh,
+                    google_drive_file,
+                )
 
-            update_tsvector_content(
+            index_writer.add(
                 google_drive_file,
                 google_drive_content,
                 timezone.now(),
@@ -173,6 +184,12 @@ def download_recursive_files(
         except RuntimeError as e:
             errors.append(f"Error updating tsvector for file {file_id}: {str(e)}")
 
+    index_writer.flush()
+    google_drive_files.finish(
+        process_download_google_drive_files,
+        group=f"Google-Drive-{service.userId_id}",
+    )
+
     if errors:
         print("Errors occurred during Google Drive file downloads:")
         for error in errors:
@@ -2,11 +2,11 @@
 
 from ninja import Router, Header
 from django.http import JsonResponse
-from django_q.tasks import async_task
 from p7.helpers import validate_internal_auth
 from p7.download_local_files.helper import download_recursive_local_files
 from repository.service import get_service
 from repository.user import get_user
+from repository.queue import submit_task
 
 download_local_files_router = Router()
 
@@ -26,7 +26,7 @@ def download_local_files(
     if isinstance(user, JsonResponse):
         return user
 
-    task_id = async_task(
+    task_id = submit_task(
         process_download_local_files,
         user_id,
         cluster="high",
@@ -36,11 +36,12 @@ def download_local_files(
     return JsonResponse({"task_id": task_id, "status": "processing"}, status=202)
 
 
-def process_download_local_files(user_id):
-    """Read file content + update tsvector."""
+def process_download_local_files(user_id, after_id=None):
+    """Read file content + update tsvector for a batch of files.
+    The remaining files are queued as a new task."""
     try:
         service = get_service(user_id, "google")
-        processed, errors = download_recursive_local_files(service)
+        processed, errors = download_recursive_local_files(service, after_id)
 
         return {
             "files": processed,
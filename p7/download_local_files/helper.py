@@ -3,17 +3,22 @@
 from pathlib import Path
 from django.utils import timezone
 from p7.helpers import parse_file_content
-from repository.file import fetch_downloadable_files, update_tsvector_content
+from p7.metrics.helpers import observe_download
+from repository.file import ContentIndexWriter
+from repository.queue import DownloadBatch
 
 
-def download_recursive_local_files(service):
+def download_recursive_local_files(service, after_id=None):
     """
     Reads local files from app/data and updates tsvector
     exactly the same way as Dropbox would.
     """
     processed = []
     errors = []
-    db_files = fetch_downloadable_files(service)
+    # A bounded batch, resumed from the service's checkpoint after a crash
+    db_files = DownloadBatch(service, after_id)
+    # Content is written in batches, flushed after the loop
+    index_writer = ContentIndexWriter()
 
     for f in db_files:
         path = Path(f.path)
@@ -24,10 +29,11 @@ def download_recursive_local_files(service):
             continue
 
         try:
-            content = path.read_bytes()
-            parsed_text = parse_file_content(content, f)
+            with path.open("rb") as content:
+                observe_download("local", content)
+                parsed_text = parse_file_content(content, f)
             if parsed_text:
-                update_tsvector_content(
+                index_writer.add(
                     f,
                     parsed_text,
                     timezone.now(),
@@ -45,4 +51,10 @@ def download_recursive_local_files(service):
         except RuntimeError as e:
             errors.append(str(e))
 
+    index_writer.flush()
+    db_files.finish(
+        "p7.download_local_files.api.process_download_local_files",
+        group=f"Local-{service.userId_id}",
+    )
+
     return processed, errors
@@ -8,12 +8,18 @@ import requests
 from ninja import Router, Header
 from django.http import JsonResponse
 from django.utils import timezone
-from django_q.tasks import async_task
-from repository.file import update_tsvector_content, fetch_downloadable_files
+from repository.file import ContentIndexWriter
+from repository.queue import DownloadBatch, submit_task
 from repository.service import get_tokens, get_service
 from repository.user import get_user
-from p7.helpers import validate_internal_auth, parse_file_content
+from p7.helpers import (
+    validate_internal_auth,
+    parse_file_content,
+    spool_content,
+    READ_CHUNK_SIZE,
+)
 from p7.get_onedrive_files.helper import get_new_access_token
+from p7.metrics.helpers import observe_download
 
 download_onedrive_files_router = Router()
 @download_onedrive_files_router.get("/")
@@ -38,7 +44,7 @@ def download_onedrive_files(
     if isinstance(user, JsonResponse):
         return user
 
-    task_id = async_task(
+    task_id = submit_task(
         process_download_onedrive_files,
         user_id,
         cluster="high",
@@ -47,11 +53,13 @@ def download_onedrive_files(
     return JsonResponse({"task_id": task_id, "status": "processing"}, status=202)
 
 
-def process_download_onedrive_files(user_id):
-    """Download OneDrive files for a given user.
-    
+def process_download_onedrive_files(user_id, after_id=None):
+    """Download a batch of OneDrive files for a given user.
+    The remaining files are queued as a new task.
+
     params:
         user_id: The ID of the user whose OneDrive files are to be fetched.
+        after_id: Continue after the file with this id.
     """
     access_token, access_token_expiration, refresh_token = get_tokens(
         user_id, "onedrive"
@@ -79,6 +87,7 @@ def process_download_onedrive_files(user_id):
             access_token,
             access_token_expiration,
             refresh_token,
+            after_id,
         )
 
         return files
@@ -93,6 +102,7 @@ def download_recursive_files(
     access_token,
     access_token_expiration,
     refresh_token,
+    after_id=None,
 ):
     """Download files recursively from a user's OneDrive account.
 
@@ -101,7 +111,8 @@ def download_recursive_files(
     """
 
     # Tell static type checkers that we expect a list of File objects here.
-    onedrive_files = fetch_downloadable_files(service)
+    # A bounded batch, resumed from the service's checkpoint after a crash
+    onedrive_files = DownloadBatch(service, after_id)
     if not onedrive_files:
         print("No downloadable OneDrive files found for user.")
 
@@ -109,6 +120,8 @@ def download_recursive_files(
 
     files = []
     errors = []
+    # Content is written in batches, flushed after the loop
+    index_writer = ContentIndexWriter()
     for onedrive_file in onedrive_files:
         file_id = onedrive_file.serviceFileId
 
@@ -127,6 +140,7 @@ def download_recursive_files(
                     "Authorization": f"Bearer {access_token}",
                 },
                 timeout=30,
+                stream=True,
             )
 
             if response.status_code != 200:
@@ -138,14 +152,16 @@ def download_recursive_files(
             errors.append(f"Failed to download {file_id}: {e}")
             continue
 
-        onedrive_content = parse_file_content(
-            response.content,
-            onedrive_file,
-        )
+        with spool_content(response.iter_content(READ_CHUNK_SIZE)) as content_stream:
+            observe_download("onedrive", content_stream)
+            onedrive_content = parse_file_content(
+                content_stream,
+                onedrive_file,
+            )
 
         if onedrive_content:
             try:
-                update_tsvector_content(
+                index_writer.add(
                     onedrive_file,
                     onedrive_content,
                     timezone.now(),
@@ -158,6 +174,12 @@ def download_recursive_files(
             except RuntimeError as e:
                 errors.append(f"Error updating tsvector for file {file_id}: {str(e)}")
 
+    index_writer.flush()
+    onedrive_files.finish(
+        process_download_onedrive_files,
+        group=f"Onedrive-{service.userId_id}",
+    )
+
     if errors:
         print("Errors occurred during OneDrive file downloads:")
         for error in errors:
@@ -0,0 +1,319 @@
+"""
+Registry of text extractors keyed by file extension and MIME type.
+
+New formats plug in by decorating a function that takes a binary stream and
+yields text chunks (one per page, paragraph, slide run or row) with
+@register_extractor. Each extractor carries its own limits, which the
+extraction pool enforces when the extractor runs in a subprocess.
+"""
+
+import re
+import codecs
+import zipfile
+from html.parser import HTMLParser
+from typing import BinaryIO, Callable, Iterable, Iterator, Optional
+from xml.etree import ElementTree
+
+from pypdf import PdfReader
+from docx import Document
+from pptx import Presentation
+from openpyxl import load_workbook
+
+# Size of the chunks read when decoding plain text files
+TEXT_CHUNK_SIZE = 1024 * 1024
+
+# Limits applied when an extractor does not define its own
+# timeout: wall clock seconds, cpu_seconds: CPU time, memory_mb: address space
+DEFAULT_LIMITS = {
+    "timeout": 120,
+    "cpu_seconds": 90,
+    "memory_mb": 1024,
+}
+
+_extractors_by_extension: dict[str, dict] = {}
+_extractors_by_mime: dict[str, dict] = {}
+_default_extractor: dict = {}
+
+
+def register_extractor(
+    extensions: Iterable[str] = (),
+    mime_types: Iterable[str] = (),
+    separator: str = "\n",
+    default: bool = False,
+    **limits,
+) -> Callable:
+    """
+    Register a text extractor for the given extensions and MIME types.
+
+    params:
+        extensions: File extensions (with leading dot) handled by the extractor.
+        mime_types: MIME types handled by the extractor.
+        separator: String used to join the chunks yielded by the extractor.
+        default: Use the extractor for files no other extractor handles.
+        limits: Overrides for DEFAULT_LIMITS (timeout, cpu_seconds, memory_mb).
+    """
+    def decorator(func: Callable[[BinaryIO], Iterator[str]]):
+        extractor = {
+            "name": func.__name__,
+            "extract": func,
+            "separator": separator,
+            "limits": {**DEFAULT_LIMITS, **limits},
+        }
+        for extension in extensions:
+            _extractors_by_extension[extension.lower()] = extractor
+        for mime_type in mime_types:
+            _extractors_by_mime[mime_type] = extractor
+        if default:
+            _default_extractor.update(extractor)
+        return func
+
+    return decorator
+
+
+def get_extractor(extension: str, mime: Optional[str] = None) -> dict:
+    """
+    Find the extractor for a file, by extension first and MIME type second.
+    Falls back to the default (plain text) extractor.
+    """
+    return (
+        _extractors_by_extension.get((extension or "").lower())
+        or _extractors_by_mime.get(mime)
+        or _default_extractor
+    )
+
+
+def registered_extensions() -> set[str]:
+    """Return the extensions that have a dedicated extractor."""
+    return set(_extractors_by_extension)
+
+
+def extract_text(
+    stream: BinaryIO,
+    extension: str,
+    mime: Optional[str] = None,
+    max_chars: Optional[int] = None,
+) -> str:
+    """
+    Run the matching extractor over a stream and join its chunks.
+    Extraction stops once max_chars characters have been collected.
+    """
+    extractor = get_extractor(extension, mime)
+    separator = extractor["separator"]
+    parts = []
+    length = 0
+    chunks = extractor["extract"](stream)
+    try:
+        for chunk in chunks:
+            parts.append(chunk)
+            length += len(chunk) + len(separator)
+            if max_chars is not None and length >= max_chars:
+                break
+    finally:
+        chunks.close()
+
+    text = separator.join(parts)
+    return text[:max_chars] if max_chars is not None else text
+
+
+@register_extractor(separator="", default=True, timeout=60, cpu_seconds=30, memory_mb=512)
+def extract_plain_text(stream: BinaryIO) -> Iterator[str]:
+    """Decode the stream as UTF-8 text in chunks."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="ignore")
+    for chunk in iter(lambda: stream.read(TEXT_CHUNK_SIZE), b""):
+        yield decoder.decode(chunk)
+    yield decoder.decode(b"", final=True)
+
+
+@register_extractor(
+    extensions=[".pdf"],
+    mime_types=["application/pdf"],
+    timeout=300,
+    cpu_seconds=240,
+    memory_mb=2048,
+)
+def extract_pdf(stream: BinaryIO) -> Iterator[str]:
+    """Yield the text of each PDF page."""
+    reader = PdfReader(stream)
+    for page in reader.pages:
+        yield page.extract_text() or ""
+
+
+@register_extractor(
+    extensions=[".docx"],
+    mime_types=["application/vnd.openxmlformats-officedocument.wordprocessingml.document"],
+)
+def extract_docx(stream: BinaryIO) -> Iterator[str]:
+    """Yield the text of each Word paragraph."""
+    doc = Document(stream)
+    for paragraph in doc.paragraphs:
+        yield paragraph.text
+
+
+@register_extractor(
+    extensions=[".pptx"],
+    mime_types=["application/vnd.openxmlformats-officedocument.presentationml.presentation"],
+)
+def extract_pptx(stream: BinaryIO) -> Iterator[str]:
+    """Yield the text of each run on each PowerPoint slide."""
+    prs = Presentation(stream)
+    for slide in prs.slides:
+        for shape in slide.shapes:
+            if not shape.has_text_frame:
+                continue
+            for paragraph in shape.text_frame.paragraphs:
+                for run in paragraph.runs:
+                    yield run.text
+
+
+@register_extractor(
+    extensions=[".xlsx", ".gsheet"],
+    mime_types=["application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"],
+    timeout=300,
+    cpu_seconds=240,
+    memory_mb=2048,
+)
+def extract_xlsx(stream: BinaryIO) -> Iterator[str]:
+    """Yield each non-empty spreadsheet row as tab separated text."""
+    # Read-only mode streams rows instead of loading every cell up front
+    wb = load_workbook(stream, read_only=True, data_only=True)
+    try:
+        for ws in wb.worksheets:
+            yield ""  # Blank line between sheets
+            for row in ws.iter_rows(values_only=True):
+                row_text = "\t".join(
+                    str(cell) if cell is not None else "" for cell in row
+                )
+                if row_text.strip():
+                    yield row_text
+    finally:
+        wb.close()
+
+
+ODF_TEXT_NAMESPACE = "urn:oasis:names:tc:opendocument:xmlns:text:1.0"
+
+
+@register_extractor(
+    extensions=[".odt"],
+    mime_types=["application/vnd.oasis.opendocument.text"],
+)
+def extract_odt(stream: BinaryIO) -> Iterator[str]:
+    """Yield the text of each OpenDocument paragraph and heading."""
+    text_tags = {f"{{{ODF_TEXT_NAMESPACE}}}p", f"{{{ODF_TEXT_NAMESPACE}}}h"}
+    with zipfile.ZipFile(stream) as archive, archive.open("content.xml") as content:
+        for _, element in ElementTree.iterparse(content, events=("end",)):
+            if element.tag in text_tags:
+                yield "".join(element.itertext())
+                element.clear()
+
+
+class _HTMLTextParser(HTMLParser):
+    """Collects the visible text of an (X)HTML document."""
+
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("script", "style", "head"):
+            self._skip_depth += 1
+
+    def handle_endtag(self, tag):
+        if tag in ("script", "style", "head") and self._skip_depth:
+            self._skip_depth -= 1
+
+    def handle_data(self, data):
+        if not self._skip_depth and data.strip():
+            self.parts.append(data.strip())
+
+
+@register_extractor(
+    extensions=[".epub"],
+    mime_types=["application/epub+zip"],
+)
+def extract_epub(stream: BinaryIO) -> Iterator[str]:
+    """Yield the text of each (X)HTML document in an EPUB archive."""
+    with zipfile.ZipFile(stream) as archive:
+        for name in archive.namelist():
+            if not name.lower().endswith((".xhtml", ".html", ".htm")):
+                continue
+            parser = _HTMLTextParser()
+            parser.feed(archive.read(name).decode("utf-8", errors="ignore"))
+            parser.close()
+            yield "\n".join(parser.parts)
+
+
+# Groups whose content is formatting metadata rather than document text
+RTF_SKIPPED_DESTINATIONS = {
+    "fonttbl", "colortbl", "stylesheet", "info", "pict", "header", "footer",
+    "themedata", "colorschememapping", "latentstyles", "datastore",
+    "listtable", "listoverridetable", "rsidtbl", "generator", "xmlnstbl",
+}
+RTF_TOKEN = re.compile(
+    r"\\([a-z]{1,32})(-?\d{1,10})? ?|\\'([0-9a-f]{2})|\\([^a-z])|([{}])|[\r\n]+|(.)",
+    re.IGNORECASE,
+)
+
+
+@register_extractor(
+    extensions=[".rtf"],
+    mime_types=["application/rtf", "text/rtf"],
+    timeout=60,
+    cpu_seconds=45,
+)
+def extract_rtf(stream: BinaryIO) -> Iterator[str]:
+    """Yield the text of each RTF paragraph, dropping control words and metadata groups."""
+    raw = stream.read().decode("latin-1")
+    stack = []
+    ignorable = False
+    unicode_skip = 1  # characters to skip after a \\uN escape
+    skip = 0
+    paragraph = []
+
+    for match in RTF_TOKEN.finditer(raw):
+        word, arg, hex_code, symbol, brace, char = match.groups()
+        if brace:
+            skip = 0
+            if brace == "{":
+                stack.append((unicode_skip, ignorable))
+            elif stack:
+                unicode_skip, ignorable = stack.pop()
+        elif symbol:
+            skip = 0
+            if symbol == "*":
+                ignorable = True
+            elif not ignorable and symbol in "\\{}":
+                paragraph.append(symbol)
+            elif not ignorable and symbol == "~":
+                paragraph.append("\xa0")
+        elif word:
+            skip = 0
+            word = word.lower()
+            if word in RTF_SKIPPED_DESTINATIONS:
+                ignorable = True
+            elif ignorable:
+                continue
+            elif word in ("par", "line", "page", "sect"):
+                yield "".join(paragraph)
+                paragraph = []
+            elif word == "tab":
+                paragraph.append("\t")
+            elif word == "uc":
+                unicode_skip = int(arg or 1)
+            elif word == "u" and arg is not None:
+                code = int(arg)
+                paragraph.append(chr(code + 0x10000 if code < 0 else code))
+                skip = unicode_skip
+        elif hex_code:
+            if skip > 0:
+                skip -= 1
+            elif not ignorable:
+                paragraph.append(bytes.fromhex(hex_code).decode("cp1252", errors="ignore"))
+        elif char:
+            if skip > 0:
+                skip -= 1
+            elif not ignorable:
+                paragraph.append(char)
+
+    if paragraph:
+        yield "".join(paragraph)
@@ -0,0 +1,155 @@
+"""
+Recyclable subprocess pool for text extraction.
+
+django-q workers are daemonic and cannot fork multiprocessing children, so the
+extraction worker is started with subprocess and driven over its stdin/stdout.
+A worker that times out, crashes or exceeds its limits is killed and replaced,
+and healthy workers are recycled after a fixed number of tasks.
+"""
+
+import os
+import sys
+import select
+import shutil
+import subprocess
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from typing import BinaryIO, Iterator, Optional
+
+from p7.extract_file_content.extractors import get_extractor
+from p7.extract_file_content.worker import read_frame, write_frame
+
+# Directory containing the p7 package, so the worker can import it
+BACKEND_DIR = Path(__file__).resolve().parents[2]
+
+
+class ExtractionError(RuntimeError):
+    """Raised when a file could not be extracted in the worker."""
+
+
+class ExtractionTimeout(ExtractionError):
+    """Raised when a worker does not answer within the extractor's timeout."""
+
+
+@contextmanager
+def _as_path(stream: BinaryIO) -> Iterator[str]:
+    """Yield a path the worker can open, copying in-memory streams to a temp file."""
+    name = getattr(stream, "name", None)
+    if isinstance(name, str) and os.path.isfile(name):
+        yield name
+        return
+
+    with NamedTemporaryFile(prefix="p7-extract-", delete=False) as tmp:
+        shutil.copyfileobj(stream, tmp)
+    try:
+        yield tmp.name
+    finally:
+        os.unlink(tmp.name)
+
+
+class ExtractionPool:
+    """A single recyclable extraction worker owned by the current process.
+
+    params:
+        max_tasks_per_worker (int): Number of files a worker extracts before it is replaced.
+    """
+
+    def __init__(self, max_tasks_per_worker: int = 100):
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self._process: Optional[subprocess.Popen] = None
+        self._tasks = 0
+
+    def _worker(self) -> subprocess.Popen:
+        """Return a live worker, starting a new one if needed."""
+        if self._process is not None and (
+            self._process.poll() is not None or self._tasks >= self.max_tasks_per_worker
+        ):
+            self.recycle()
+
+        if self._process is not None:
+            return self._process
+
+        self._process = subprocess.Popen(  # pylint: disable=consider-using-with
+            [sys.executable, "-m", "p7.extract_file_content.worker"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            cwd=BACKEND_DIR,
+        )
+        self._tasks = 0
+        return self._process
+
+    def recycle(self) -> None:
+        """Stop the current worker, killing it if it does not exit by itself."""
+        process, self._process = self._process, None
+        if process is None:
+            return
+        try:
+            process.stdin.close()
+            process.wait(timeout=1)
+        except (OSError, subprocess.TimeoutExpired):
+            process.kill()
+            process.wait()
+        finally:
+            process.stdout.close()
+
+    def extract(
+        self,
+        stream: BinaryIO,
+        extension: str,
+        mime: Optional[str] = None,
+        max_chars: Optional[int] = None,
+    ) -> str:
+        """
+        Extract text from a stream in the worker subprocess.
+
+        params:
+            stream (BinaryIO): The raw file content.
+            extension (str): The file extension used to pick the extractor.
+            mime (str): Optional MIME type used when the extension is unknown.
+            max_chars (int): Stop extracting after this many characters.
+        returns:
+            str: The extracted text.
+        raises:
+            ExtractionError: If the worker fails, crashes or exceeds its limits.
+        """
+        limits = get_extractor(extension, mime)["limits"]
+
+        with _as_path(stream) as path:
+            process = self._worker()
+            self._tasks += 1
+            try:
+                write_frame(process.stdin, {
+                    "path": path,
+                    "extension": extension,
+                    "mime": mime,
+                    "max_chars": max_chars,
+                    "limits": limits,
+                })
+                ready, _, _ = select.select([process.stdout], [], [], limits["timeout"])
+                if not ready:
+                    self.recycle()
+                    raise ExtractionTimeout(
+                        f"Extraction of {extension} timed out after {limits['timeout']}s"
+                    )
+                response = read_frame(process.stdout)
+            except (OSError, EOFError, ValueError) as e:
+                self.recycle()
+                raise ExtractionError(f"Extraction worker failed: {e}") from e
+
+        if response is None:
+            # Worker died, e.g. killed for exceeding its CPU limit
+            self.recycle()
+            raise ExtractionError(f"Extraction worker exited while parsing {extension}")
+        if response.get("recycle"):
+            self.recycle()
+        if "error" in response:
+            raise ExtractionError(response["error"])
+        return response["text"]
+
+
+@lru_cache(maxsize=None)
+def get_extraction_pool(max_tasks_per_worker: int = 100) -> ExtractionPool:
+    """Return the extraction pool of the current process, creating it on first use."""
+    return ExtractionPool(max_tasks_per_worker)
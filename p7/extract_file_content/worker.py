@@ -0,0 +1,86 @@
+"""
+Subprocess entry point used by the extraction pool.
+
+Reads extraction requests from stdin and writes the extracted text to stdout,
+one length prefixed pickle frame per message. Resource limits from the
+extractor are applied before each request so a pathological file only
+takes down this process, never the django-q worker that spawned it.
+"""
+
+import sys
+import pickle
+import struct
+import resource
+from typing import BinaryIO
+
+from p7.extract_file_content.extractors import extract_text
+
+FRAME_HEADER = struct.Struct(">Q")
+
+
+def read_frame(stream: BinaryIO):
+    """Read a single frame, returns None once the other end has closed the pipe."""
+    header = stream.read(FRAME_HEADER.size)
+    if len(header) < FRAME_HEADER.size:
+        return None
+    (size,) = FRAME_HEADER.unpack(header)
+    return pickle.loads(stream.read(size))
+
+
+def write_frame(stream: BinaryIO, message) -> None:
+    """Write a single frame and flush it."""
+    payload = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+    stream.write(FRAME_HEADER.pack(len(payload)))
+    stream.write(payload)
+    stream.flush()
+
+
+def _set_soft_limit(limit: int, value: int) -> None:
+    """Set a soft resource limit, never above the hard limit."""
+    _, hard = resource.getrlimit(limit)
+    if hard != resource.RLIM_INFINITY:
+        value = min(value, hard)
+    resource.setrlimit(limit, (value, hard))
+
+
+def apply_limits(limits: dict) -> None:
+    """
+    Apply CPU and memory limits for the next request.
+    CPU time is cumulative for the process, so the limit is relative to the time used so far.
+    """
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    cpu_used = int(usage.ru_utime + usage.ru_stime) + 1
+    _set_soft_limit(resource.RLIMIT_CPU, cpu_used + limits["cpu_seconds"])
+    _set_soft_limit(resource.RLIMIT_AS, limits["memory_mb"] * 1024 * 1024)
+
+
+def main() -> None:
+    """Serve extraction requests until stdin is closed."""
+    requests_in = sys.stdin.buffer
+    responses_out = sys.stdout.buffer
+    # Keep prints from third party parsers out of the protocol stream
+    sys.stdout = sys.stderr
+
+    while (request := read_frame(requests_in)) is not None:
+        apply_limits(request["limits"])
+        try:
+            with open(request["path"], "rb") as stream:
+                text = extract_text(
+                    stream,
+                    request["extension"],
+                    request["mime"],
+                    request["max_chars"],
+                )
+            response = {"text": text}
+        except MemoryError:
+            # The heap may be fragmented after hitting the limit, ask to be recycled
+            response = {"error": "Memory limit exceeded", "recycle": True}
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            # Parsers raise all kinds of errors on malformed files,
+            # report them instead of dying so the worker can be reused
+            response = {"error": f"{type(e).__name__}: {e}"}
+        write_frame(responses_out, response)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,11 +4,30 @@ from typing import Any
 
 from ninja import Router, Header
 from django.http import JsonResponse
-from repository.service import get_all_user_services, serialize_service
-from repository.user import get_user
+from repository.service import aget_all_user_services, get_all_user_services, serialize_service
+from repository.user import aget_user, get_user
 from p7.helpers import validate_internal_auth
 
 find_services_router = Router()
+async_find_services_router = Router()
+
+
+def summarize_services(services) -> list[dict[str, Any]]:
+    """
+    Serializes services to the fields returned by find_services.
+    """
+    summaries = []
+    for s in services:
+        ser = serialize_service(s)
+        summaries.append(
+            {
+                "id": ser.get("id"),
+                "userId": ser.get("userId"),
+                "name": ser.get("name"),
+                "email": ser.get("email"),
+            }
+        )
+    return summaries
 
 
 @find_services_router.get("/")
@@ -36,16 +55,31 @@ def find_services(
     if isinstance(qs, JsonResponse):
         return qs
 
-    serialized_services = []
-    for s in qs:
-        ser = serialize_service(s)
-        serialized_services.append(
-            {
-                "id": ser.get("id"),
-                "userId": ser.get("userId"),
-                "name": ser.get("name"),
-                "email": ser.get("email"),
-            }
-        )
+    return summarize_services(qs)
+
+
+@async_find_services_router.get("/")
+async def find_services_async(
+    request,
+    user_id: str,
+    x_internal_auth: str = Header(..., alias="x-internal-auth"),
+) -> JsonResponse | list[dict[str, Any]]:
+    """
+    Async version of find_services, served when ASYNC_ENDPOINTS is set.
+
+    Returns a JsonResponse on error, otherwise a list of serialized service dicts.
+    """
+    # Validate internal auth header
+    auth_resp = validate_internal_auth(x_internal_auth)
+    if auth_resp:
+        return auth_resp
+
+    user = await aget_user(user_id)
+    if isinstance(user, JsonResponse):
+        return user
+
+    services = await aget_all_user_services(user_id)
+    if isinstance(services, JsonResponse):
+        return services
 
-    return serialized_services
+    return summarize_services(services)
@@ -2,10 +2,11 @@
 
 from ninja import Router, Header
 from django.http import JsonResponse
-from django_q.tasks import async_task
+from repository.queue import submit_task
 from repository.service import get_tokens, get_service
 from repository.user import get_user
 from p7.helpers import validate_internal_auth
+from p7.metrics.helpers import FILES_LISTED
 from p7.get_dropbox_files.helper import (
     update_or_create_file,
     fetch_recursive_files,
@@ -35,7 +36,9 @@ def fetch_dropbox_files(
     user = get_user(user_id)
     if isinstance(user, JsonResponse):
         return user
-    task_id = async_task(process_dropbox_files, user_id, cluster="high", group=f"Dropbox-{user_id}")
+    task_id = submit_task(
+        process_dropbox_files, user_id, cluster="high", group=f"Dropbox-{user_id}"
+    )
 
     return JsonResponse({"task_id": task_id, "status": "processing"}, status=202)
 
@@ -66,6 +69,7 @@ def process_dropbox_files(user_id):
             access_token_expiration,
             refresh_token,
         )
+        FILES_LISTED.labels("dropbox").inc(len(files))
 
         for file in files:
             if file[".tag"] != "file":
@@ -73,7 +77,7 @@ def process_dropbox_files(user_id):
 
             update_or_create_file(file, service)
 
-        async_task(
+        submit_task(
             process_download_dropbox_files,
             user_id, cluster="high",
             group=f"Dropbox-{user_id}"
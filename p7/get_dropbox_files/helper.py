@@ -5,6 +5,7 @@ import os
 import requests
 from repository.file import save_file
 from p7.helpers import fetch_api, smart_extension
+from p7.metrics.helpers import TOKEN_REFRESHES
 
 
 def update_or_create_file(file, service):
@@ -30,6 +31,7 @@ def update_or_create_file(file, service):
         modified_at=file["server_modified"],
         indexed_at=None,
         snippet=None,
+        content_hash=file.get("content_hash"),
     )
 
 
@@ -120,6 +122,7 @@ def get_new_access_token(
 
     if access_token_expiration <= now:
         print("Refreshing Dropbox access token...")
+        TOKEN_REFRESHES.labels("dropbox").inc()
         try:
             token_resp = requests.post(
                 "https://api.dropbox.com/oauth2/token",
@@ -3,13 +3,14 @@
 import os
 from ninja import Router, Header
 from django.http import JsonResponse
-from django_q.tasks import async_task
 # Google libs
 from google.oauth2.credentials import Credentials
 from googleapiclient.discovery import build
 from repository.service import get_tokens, get_service
 from repository.user import get_user
+from repository.queue import submit_task
 from p7.helpers import validate_internal_auth
+from p7.metrics.helpers import FILES_LISTED
 from p7.get_google_drive_files.helper import (
     update_or_create_file,
     fetch_recursive_files,
@@ -40,7 +41,7 @@ def fetch_google_drive_files(
     if isinstance(user, JsonResponse):
         return user
 
-    task_id = async_task(
+    task_id = submit_task(
         process_google_drive_files,
         user_id,
         cluster="high",
@@ -83,6 +84,7 @@ def process_google_drive_files(user_id):
             creds,
             refresh_token,
         )
+        FILES_LISTED.labels("google").inc(len(files))
 
         # Build a fast lookup for any item (files + folders)
         file_by_id = {file["id"]: file for file in files}
@@ -100,7 +102,7 @@ def process_google_drive_files(user_id):
 
             update_or_create_file(file, service, file_by_id)
 
-        async_task(
+        submit_task(
             process_download_google_drive_files,
             user_id,
             cluster="high",
@@ -8,6 +8,7 @@ from google.auth.transport.requests import Request
 
 from repository.file import save_file
 from p7.helpers import smart_extension
+from p7.metrics.helpers import TOKEN_REFRESHES
 
 
 def update_or_create_file(file, service, file_by_id: Dict[str, dict]):
@@ -34,6 +35,7 @@ def update_or_create_file(file, service, file_by_id: Dict[str, dict]):
         modified_at=file["modifiedTime"],
         indexed_at=None,
         snippet=None,
+        content_hash=file.get("md5Checksum"), # Missing for native Google files
     )
 
 
@@ -65,7 +67,7 @@ def fetch_recursive_files(
                 "trashed, webContentLink, webViewLink, "
                 "iconLink, hasThumbnail, viewedByMeTime, "
                 "createdTime, modifiedTime, shared, "
-                "ownedByMe, originalFilename, size)",
+                "ownedByMe, originalFilename, size, md5Checksum)",
                 pageToken=page_token,
                 supportsAllDrives=True,
                 includeItemsFromAllDrives=True,
@@ -96,6 +98,7 @@ def get_new_access_token(
     # Refresh if needed (this will update creds.token)
     if not creds.valid:
         print("Refreshing Google Drive access token...")
+        TOKEN_REFRESHES.labels("google").inc()
         creds.refresh(Request())
 
         # Optionally persist the new access_token back to DB so next calls use it
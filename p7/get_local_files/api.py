@@ -2,10 +2,11 @@
 
 from ninja import Router, Header
 from django.http import JsonResponse
-from django_q.tasks import async_task
+from repository.queue import submit_task
 from repository.service import get_service
 from repository.user import get_user
 from p7.helpers import validate_internal_auth
+from p7.metrics.helpers import FILES_LISTED
 from p7.get_local_files.helper import fetch_recursive_local_files, update_or_create_local_file
 from p7.download_local_files.api import process_download_local_files
 
@@ -27,7 +28,7 @@ def fetch_local_files(
     if isinstance(user, JsonResponse):
         return user
 
-    task_id = async_task(
+    task_id = submit_task(
         process_local_files,
         user_id,
         cluster="high",
@@ -41,6 +42,7 @@ def process_local_files(user_id):
     """Read metadata + create/update DB rows."""
     try:
         files = fetch_recursive_local_files(user_id)
+        FILES_LISTED.labels("local").inc(len(files))
         service = get_service(user_id, "google")
         for _, file in enumerate(files, start=1):
             if file[".tag"] != "file":
@@ -48,7 +50,7 @@ def process_local_files(user_id):
 
             update_or_create_local_file(file, service)
 
-        async_task(
+        submit_task(
             process_download_local_files,
             user_id,
             cluster="high",
@@ -1,6 +1,7 @@
 """ Helper functions for local file handling. """
 
 import os
+import hashlib
 from pathlib import Path
 from datetime import datetime, timezone
 from django.conf import settings
@@ -44,9 +45,22 @@ def update_or_create_local_file(file: dict, service):
         modified_at=modified_at,
         indexed_at=None,
         snippet=None,
+        content_hash=compute_sha256(full_path),
     )
 
 
+def compute_sha256(path: Path, chunk_size: int = 1024 * 1024) -> str:
+    """
+    Compute the sha256 fingerprint of a local file, reading it in chunks
+    so large files are never loaded into memory at once.
+    """
+    digest = hashlib.sha256()
+    with path.open("rb") as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
 def fetch_recursive_local_files(user_id=None) -> list[dict]:
     """
     Returns a list of file metadata objects for files in app/data,
@@ -3,12 +3,13 @@ import os
 
 from ninja import Router, Header
 from django.http import JsonResponse
-from django_q.tasks import async_task
 # Microsoft libs
 import msal
 from repository.service import get_tokens, get_service
 from repository.user import get_user
+from repository.queue import submit_task
 from p7.helpers import validate_internal_auth
+from p7.metrics.helpers import FILES_LISTED
 from p7.get_onedrive_files.helper import (
     update_or_create_file, fetch_recursive_files
     )
@@ -36,7 +37,7 @@ def fetch_onedrive_files(
     if isinstance(user, JsonResponse):
         return user
 
-    task_id = async_task(
+    task_id = submit_task(
         process_onedrive_files,
         user_id,
         cluster="high",
@@ -63,6 +64,7 @@ def process_onedrive_files(user_id):
             access_token_expiration,
             refresh_token,
         )
+        FILES_LISTED.labels("onedrive").inc(len(files))
 
         for file in files:
             if not file.get("file"):
@@ -70,7 +72,7 @@ def process_onedrive_files(user_id):
 
             update_or_create_file(file, service)
 
-        async_task(
+        submit_task(
             process_download_onedrive_files,
             user_id,
             cluster="high",
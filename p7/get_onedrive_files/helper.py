@@ -4,6 +4,7 @@ from datetime import datetime, timezone
 import requests
 from repository.file import save_file
 from p7.helpers import smart_extension
+from p7.metrics.helpers import TOKEN_REFRESHES
 
 
 def update_or_create_file(file, service):
@@ -36,6 +37,7 @@ def update_or_create_file(file, service):
         modified_at=file["lastModifiedDateTime"],
         indexed_at=None,
         snippet=None,
+        content_hash=file.get("file", {}).get("hashes", {}).get("quickXorHash"),
     )
 
 
@@ -131,6 +133,7 @@ def get_new_access_token(
 
     if access_token_expiration <= now:
         print("Refreshing OneDrive access token...")
+        TOKEN_REFRESHES.labels("onedrive").inc()
         # Refresh token
         result = app.acquire_token_by_refresh_token(
             refresh_token,
@@ -3,16 +3,24 @@
 import os
 import json
 import mimetypes
+from functools import lru_cache
 from pathlib import Path
-from typing import Optional
+from types import MappingProxyType
+from typing import BinaryIO, Iterable, Optional
 from io import BytesIO
+from tempfile import SpooledTemporaryFile
 import requests
+from django.conf import settings
 from django.http import JsonResponse
-from pypdf import PdfReader
-from docx import Document
-from pptx import Presentation
-from openpyxl import load_workbook
+from p7.extract_file_content.extractors import extract_text, registered_extensions
+from p7.extract_file_content.pool import get_extraction_pool
 
+# Hard cap on extracted characters, anything beyond is never indexed
+MAX_CONTENT_CHARS = 20_000_000
+# Downloads larger than this are spooled to disk instead of memory
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+# Size of the chunks read when streaming downloads and plain text files
+READ_CHUNK_SIZE = 1024 * 1024
 
 def validate_internal_auth(x_internal_auth: str) -> JsonResponse | None:
     """
@@ -45,9 +53,68 @@ def fetch_api(url, headers, data):
         )
     return response
 
+def _load_downloadable_file_extensions() -> frozenset[str]:
+    """Build the set of downloadable file extensions, called once at import time."""
+
+    file_extensions_path = Path(__file__).resolve().parent / "json/downloadable_txt_extensions.json"
+
+    with file_extensions_path.open("r", encoding="utf-8") as fh:
+        downloadable_text_extensions = set(json.load(fh))
+
+    google_file_extensions = {
+        ".gdoc",
+        ".gsheet",
+        ".gslides",
+    }
+
+    # Formats with a dedicated extractor (pdf, docx, pptx, xlsx, odt, rtf, epub, ...)
+    # Legacy .doc, .ppt and .xls are unsupported
+    other_file_extensions = registered_extensions()
+
+    return frozenset(
+        downloadable_text_extensions | google_file_extensions | other_file_extensions
+    )
+
+
+# Lookup tables for extension detection, built once per process
+DOWNLOADABLE_FILE_EXTENSIONS = _load_downloadable_file_extensions()
+
+# known compression endings
+COMPRESSED_FILE_EXTENSIONS = frozenset({'.gz', '.bz2', '.xz', '.zst', '.lz', '.lzma', '.br'})
+
+# some common modern extensions aren't in Python's built-in mimetypes table
+EXTRA_KNOWN_EXTENSIONS = frozenset({
+    '.docx', '.xlsx', '.pptx', '.webp', '.md', '.json', '.yaml', '.yml', '.toml',
+    '.7z', '.rar', '.heic', '.heif', '.svg', '.ts', '.tsx', '.jsx', '.ipynb',
+    '.csv', '.tsv', '.parquet', '.rtf', '.odt', '.ods', '.odp', '.epub',
+    '.ttf', '.otf', '.woff', '.woff2'
+})
+
+KNOWN_FILE_EXTENSIONS = frozenset(mimetypes.types_map) \
+                        | COMPRESSED_FILE_EXTENSIONS \
+                        | EXTRA_KNOWN_EXTENSIONS \
+                        | DOWNLOADABLE_FILE_EXTENSIONS
+
+# Google Drive pseudo-MIME types
+GOOGLE_FILE_EXTENSIONS = MappingProxyType({
+    "application/vnd.google-apps.document": ".gdoc",
+    "application/vnd.google-apps.spreadsheet": ".gsheet",
+    "application/vnd.google-apps.presentation": ".gslides",
+    "application/vnd.google-apps.drawing": ".gdraw",
+    "application/vnd.google-apps.form": ".gform",
+    "application/vnd.google-apps.fusiontable": ".gtable",
+    "application/vnd.google-apps.map": ".gmap",
+    "application/vnd.google-apps.script": ".gscript",
+    "application/vnd.google-apps.site": ".gsite",
+    "application/vnd.google-apps.jam": ".gjam",
+})
+
+
+@lru_cache(maxsize=65536)
 def smart_extension(provider: str, name: str, mime: Optional[str] = None) -> str:
     """
     Determine the file extension based on provider, filename, and MIME type.
+    Results are cached per (provider, name, mime), as a sync classifies every file.
 
     Rules:
     - Dotfiles like ".gitignore" => no extension
@@ -55,37 +122,6 @@ def smart_extension(provider: str, name: str, mime: Optional[str] = None) -> str
     - Preserve compression combos like ".tar.gz"
     - Fallback to MIME (and Google Drive pseudo-types) when needed
     """
-    # known compression endings
-    compressed_file_extensions = {'.gz', '.bz2', '.xz', '.zst', '.lz', '.lzma', '.br'}
-
-    # some common modern extensions aren't in Python's built-in mimetypes table
-    extra_known_extensions = {
-        '.docx', '.xlsx', '.pptx', '.webp', '.md', '.json', '.yaml', '.yml', '.toml',
-        '.7z', '.rar', '.heic', '.heif', '.svg', '.ts', '.tsx', '.jsx', '.ipynb',
-        '.csv', '.tsv', '.parquet', '.rtf', '.odt', '.ods', '.odp', '.epub',
-        '.ttf', '.otf', '.woff', '.woff2'
-    }
-
-    known_file_extensions = set(mimetypes.types_map) \
-                            | compressed_file_extensions \
-                            | extra_known_extensions \
-                            | downloadable_file_extensions()
-
-    google_file_extensions = {}
-    if provider == "google":
-        google_file_extensions = {
-            "application/vnd.google-apps.document": ".gdoc",
-            "application/vnd.google-apps.spreadsheet": ".gsheet",
-            "application/vnd.google-apps.presentation": ".gslides",
-            "application/vnd.google-apps.drawing": ".gdraw",
-            "application/vnd.google-apps.form": ".gform",
-            "application/vnd.google-apps.fusiontable": ".gtable",
-            "application/vnd.google-apps.map": ".gmap",
-            "application/vnd.google-apps.script": ".gscript",
-            "application/vnd.google-apps.site": ".gsite",
-            "application/vnd.google-apps.jam": ".gjam",
-        }
-
     filename = (name or "").strip()
     core = filename.lstrip(".")  # ignore any number of leading dots for extension detection
 
@@ -96,7 +132,7 @@ def smart_extension(provider: str, name: str, mime: Optional[str] = None) -> str
         # Handle names like "..docx" / "...pdf":
         # if the remaining token itself is a known ext, use it.
         candidate = f".{core.lower()}"
-        if candidate in known_file_extensions:
+        if candidate in KNOWN_FILE_EXTENSIONS:
             return candidate
         # otherwise fall through to MIME fallback
     else:
@@ -105,13 +141,13 @@ def smart_extension(provider: str, name: str, mime: Optional[str] = None) -> str
         last = f".{parts[-1]}"
 
         # Preserve combos like ".tar.gz" or ".csv.gz"
-        if last in compressed_file_extensions and len(parts) >= 2:
+        if last in COMPRESSED_FILE_EXTENSIONS and len(parts) >= 2:
             penult = f".{parts[-2]}"
-            if penult in known_file_extensions:
+            if penult in KNOWN_FILE_EXTENSIONS:
                 return f"{penult}{last}"
 
         # Single extension case
-        if last in known_file_extensions:
+        if last in KNOWN_FILE_EXTENSIONS:
             return last
 
     # Fallback to MIME type
@@ -121,100 +157,74 @@ def smart_extension(provider: str, name: str, mime: Optional[str] = None) -> str
             return ext.lower()
         # Google Drive pseudo-MIME types
         if provider == "google":
-            return google_file_extensions.get(mime, "")
+            return GOOGLE_FILE_EXTENSIONS.get(mime, "")
 
     return ""
 
 
-def downloadable_file_extensions() -> set[str]:
-    """Return a set of file extensions considered downloadable."""
+def downloadable_file_extensions() -> frozenset[str]:
+    """Return the (immutable) set of file extensions considered downloadable."""
+    return DOWNLOADABLE_FILE_EXTENSIONS
 
-    file_extensions_path = Path(__file__).resolve().parent / "json/downloadable_txt_extensions.json"
 
-    with file_extensions_path.open("r", encoding="utf-8") as fh:
-        downloadable_text_extensions = set(json.load(fh))
-
-    google_file_extensions = {
-        ".gdoc",
-        ".gsheet",
-        ".gslides",
-    }
+def spool_content(chunks: Iterable[bytes]) -> SpooledTemporaryFile:
+    """
+    Write a stream of byte chunks into a spooled temporary file.
+    Small files stay in memory, larger ones roll over to disk.
 
-    other_file_extensions = {
-        ".pdf",
-    #   ".doc", # legacy Word format (unsupported)
-    #   ".ppt",  # legacy PowerPoint format (unsupported)
-    #   ".xls",  # legacy Excel format (unsupported)
-        ".docx",
-        ".pptx",
-        ".xlsx",
-    }
+    params:
+        chunks (Iterable[bytes]): The raw file content, e.g. response.iter_content().
+    returns:
+        SpooledTemporaryFile: The spooled content, rewound to the start.
+    """
+    # Returned open, the caller owns closing it
+    spooled = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)  # pylint: disable=consider-using-with
+    for chunk in chunks:
+        if chunk:
+            spooled.write(chunk)
+    spooled.seek(0)
+    return spooled
 
-    return downloadable_text_extensions | google_file_extensions | other_file_extensions
 
-def parse_file_content(content_bytes: bytes, file) -> str | None:
+def parse_file_content(content: bytes | BinaryIO, file) -> str | None:
     """
     Parse file content to extract text from different file types.
+    Extraction stops once MAX_CONTENT_CHARS characters have been collected.
+    Unless disabled in settings.FILE_EXTRACTION, the parser runs in an isolated
+    subprocess with the time, CPU and memory limits of its extractor.
 
     params:
-        content (bytes): The raw file content in bytes.
+        content (bytes | BinaryIO): The raw file content in bytes or as a binary stream.
+        file: The File instance the content belongs to.
     """
-
-    content_bytes_decoded = content_bytes.decode("utf-8-sig", errors="ignore")
-    content_bytes = BytesIO(content_bytes)
-
-    if content_bytes_decoded:
-        match file.extension:
-            case ".pdf":
-                try:
-                    reader = PdfReader(content_bytes)
-                    return "\n".join(page.extract_text() or "" for page in reader.pages)
-                except RuntimeError as e:
-                    print(f"Failed to parse pdf: {e}")
-                    return None
-            case ".docx":
-                try:
-                    doc = Document(content_bytes)
-                    return "\n".join(p.text for p in doc.paragraphs)
-                except RuntimeError as e:
-                    print(f"Failed to parse docx: {e}")
-                    return None
-            case ".pptx":
-                try:
-                    prs = Presentation(content_bytes)
-                    slide_text = []
-                    for slide in prs.slides:
-                        for shape in slide.shapes:
-                            if not shape.has_text_frame:
-                                continue
-                            for paragraph in shape.text_frame.paragraphs:
-                                for run in paragraph.runs:
-                                    slide_text.append(run.text)
-                    return "\n".join(slide_text)
-                except RuntimeError as e:
-                    print(f"Failed to parse pptx: {e}")
-                    return None
-            case ".xlsx" | ".gsheet":
-                try:
-                    wb = load_workbook(content_bytes, data_only=True)
-                    all_sheets_text = []
-                    for ws in wb.worksheets:
-                        rows = [list(row) for row in ws.iter_rows(values_only=True)]
-                        sheet_text = "\n".join(
-                            "\t".join(str(cell) if cell is not None else "" for cell in row)
-                            for row in rows
-                        )
-                        if sheet_text.strip():  # Only include non-empty sheets
-                            all_sheets_text.append(f"\n{sheet_text}")
-                    return "\n\n".join(all_sheets_text)
-                except RuntimeError as e:
-                    print(f"Failed to parse xlsx: {e}")
-                    return None
-            case _: # Default: try to decode as UTF-8 text
-                try:
-                    return content_bytes_decoded
-                except RuntimeError as e:
-                    print(f"Failed to decode: {e}")
-                    return None
-
-    return None
+    # Imported here, the metrics import the models and this module is used before
+    # Django is set up (see test/benchmark/file_extension_benchmark.py)
+    from p7.metrics.helpers import (  # pylint: disable=import-outside-toplevel
+        FILES_PARSED,
+        PARSE_SECONDS,
+        provider_label,
+    )
+
+    stream = BytesIO(content) if isinstance(content, (bytes, bytearray)) else content
+    provider = provider_label(file)
+
+    # Empty content -> nothing to parse
+    if not stream.read(1):
+        FILES_PARSED.labels(provider, "empty").inc()
+        return None
+    stream.seek(0)
+
+    try:
+        with PARSE_SECONDS.labels(file.extension).time():
+            if settings.FILE_EXTRACTION["isolated"]:
+                pool = get_extraction_pool(settings.FILE_EXTRACTION["max_tasks_per_worker"])
+                text = pool.extract(stream, file.extension, max_chars=MAX_CONTENT_CHARS)
+            else:
+                text = extract_text(stream, file.extension, max_chars=MAX_CONTENT_CHARS)
+    except RuntimeError as e:
+        FILES_PARSED.labels(provider, "error").inc()
+        print(f"Failed to parse {file.extension}: {e}")
+        return None
+
+    FILES_PARSED.labels(provider, "ok").inc()
+    return text
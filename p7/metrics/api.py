@@ -0,0 +1,100 @@
+"""API endpoint exposing Prometheus metrics."""
+
+import os
+from functools import lru_cache
+from time import monotonic
+
+from ninja import Router, Header
+from django.http import HttpResponse
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    generate_latest,
+    multiprocess,
+)
+from prometheus_client.core import GaugeMetricFamily
+
+from p7.helpers import validate_internal_auth
+from repository.file import Backlog, count_backlog
+from repository.queue import queue_depth_per_cluster
+
+metrics_router = Router()
+
+# Seconds a backlog count, a scan of the file table, is reused across scrapes
+BACKLOG_CACHE_SECONDS = 60
+
+
+@lru_cache(maxsize=1)
+def _cached_backlog(period: int) -> Backlog:
+    """The backlog, counted at most once per period of BACKLOG_CACHE_SECONDS."""
+    del period  # Only part of the cache key
+    return count_backlog()
+
+
+class DatabaseCollector:
+    """Gauges read from the database when scraped."""
+
+    def collect(self):
+        """Queue depth per cluster and the download backlog across users."""
+        queue_depth = GaugeMetricFamily(
+            "p7_queue_depth", "Tasks waiting in django-q per cluster", labels=["cluster"]
+        )
+        scheduled_jobs = GaugeMetricFamily(
+            "p7_scheduled_jobs",
+            "Jobs held by the fair scheduler per cluster and status",
+            labels=["cluster", "status"],
+        )
+        depth = queue_depth_per_cluster()
+        for cluster, count in depth["queued"].items():
+            queue_depth.add_metric([cluster], count)
+        for (cluster, status), count in depth["scheduled"].items():
+            scheduled_jobs.add_metric([cluster, status], count)
+
+        backlog = _cached_backlog(int(monotonic() // BACKLOG_CACHE_SECONDS))
+        backlog_files = GaugeMetricFamily(
+            "p7_backlog_files",
+            "Files not yet indexed or modified since indexing",
+            value=backlog.files,
+        )
+        backlog_users = GaugeMetricFamily(
+            "p7_backlog_users", "Users with files waiting to be indexed", value=backlog.users
+        )
+        backlog_max = GaugeMetricFamily(
+            "p7_backlog_max_user_files",
+            "Files waiting to be indexed of the user with the most of them",
+            value=backlog.max_user_files,
+        )
+
+        return [queue_depth, scheduled_jobs, backlog_files, backlog_users, backlog_max]
+
+
+database_registry = CollectorRegistry(auto_describe=False)
+database_registry.register(DatabaseCollector())
+
+
+def render_metrics() -> bytes:
+    """All metrics in the Prometheus text format."""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry) + generate_latest(database_registry)
+
+
+@metrics_router.get("/")
+def metrics(
+    request,
+    x_internal_auth: str = Header(..., alias="x-internal-auth"),
+):
+    """Metrics in the Prometheus text format, for scraping.
+
+    params:
+        x_internal_auth (str): The internal auth header for validating the request.
+    """
+    auth_resp = validate_internal_auth(x_internal_auth)
+    if auth_resp:
+        return auth_resp
+
+    return HttpResponse(render_metrics(), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,59 @@
+"""Prometheus metrics for the indexing pipeline and task queues.
+
+Counters and histograms are updated where the work happens, in the web process as
+well as in the qcluster workers. With PROMETHEUS_MULTIPROC_DIR set (shared by the
+web server and both qclusters) prometheus_client aggregates the values of all
+processes when scraped. Queue depth and backlog are read from the database at
+scrape time, see api.py.
+"""
+
+import os
+from typing import BinaryIO
+
+from prometheus_client import Counter, Histogram
+
+from repository.models import File
+
+FILES_LISTED = Counter(
+    "p7_files_listed_total", "Files listed from a provider", ["provider"]
+)
+FILES_UPSERTED = Counter(
+    "p7_files_upserted_total", "File rows inserted or updated", ["provider"]
+)
+FILES_DOWNLOADED = Counter(
+    "p7_files_downloaded_total", "Files downloaded for indexing", ["provider"]
+)
+BYTES_DOWNLOADED = Counter(
+    "p7_bytes_downloaded_total", "Bytes downloaded for indexing", ["provider"]
+)
+FILES_PARSED = Counter(
+    "p7_files_parsed_total", "Files run through text extraction", ["provider", "outcome"]
+)
+PARSE_SECONDS = Histogram(
+    "p7_parse_seconds",
+    "Time spent extracting text from a file",
+    ["extension"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+)
+FILES_INDEXED = Counter(
+    "p7_files_indexed_total", "Files whose tsContent was written", ["provider"]
+)
+TOKEN_REFRESHES = Counter(
+    "p7_token_refreshes_total", "Provider access token refreshes", ["provider"]
+)
+
+
+def provider_label(file) -> str:
+    """The provider of a file if its service is already loaded, without a query."""
+    if isinstance(file, File) and File.serviceId.is_cached(file):
+        return file.serviceId.name
+    return "unknown"
+
+
+def observe_download(provider: str, stream: BinaryIO) -> None:
+    """Count a downloaded file and its size, leaving the stream position unchanged."""
+    position = stream.tell()
+    size = stream.seek(0, os.SEEK_END)
+    stream.seek(position)
+    FILES_DOWNLOADED.labels(provider).inc()
+    BYTES_DOWNLOADED.labels(provider).inc(size)
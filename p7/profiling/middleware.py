@@ -0,0 +1,120 @@
+"""Opt-in request profiling middleware.
+
+Enabled with PROFILING["enabled"]. For requests under one of PROFILING["paths"] it
+records query count, SQL time, Python time and stage spans (see spans.py), returns
+them in a Server-Timing header and writes one JSON log line per request on the
+"p7.profiling" logger. A PROFILING["cprofile_sample_rate"] share of the profiled
+requests is also run under cProfile; the stats are dumped to
+PROFILING["cprofile_dir"] when set, otherwise the top functions are logged.
+
+The middleware runs natively under both WSGI and ASGI, so async endpoints are not
+passed through a thread adapter. In async requests cProfile only sees the event loop
+thread, work run with sync_to_async is covered by the SQL and stage timings.
+"""
+
+import cProfile
+import io
+import json
+import logging
+import pstats
+import random
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils import timezone
+
+from p7.profiling.spans import profile_request
+
+logger = logging.getLogger("p7.profiling")
+
+# Functions listed when cProfile output is logged instead of dumped
+CPROFILE_LOG_LIMIT = 30
+
+
+class ProfilingMiddleware:
+    """Records per-request SQL and stage timings for the configured paths."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.PROFILING["enabled"]:
+            raise MiddlewareNotUsed("Request profiling is disabled")
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        self.paths = tuple(settings.PROFILING["paths"])
+        self.sample_rate = settings.PROFILING["cprofile_sample_rate"]
+        self.cprofile_dir = settings.PROFILING["cprofile_dir"]
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not request.path.startswith(self.paths):
+            return self.get_response(request)
+
+        profiler = self.sampled_profiler()
+        with profile_request() as profile:
+            if profiler:
+                profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                if profiler:
+                    profiler.disable()
+
+        return self.record(request, response, profile, profiler)
+
+    async def __acall__(self, request):
+        if not request.path.startswith(self.paths):
+            return await self.get_response(request)
+
+        profiler = self.sampled_profiler()
+        with profile_request() as profile:
+            if profiler:
+                profiler.enable()
+            try:
+                response = await self.get_response(request)
+            finally:
+                if profiler:
+                    profiler.disable()
+
+        return self.record(request, response, profile, profiler)
+
+    def sampled_profiler(self) -> cProfile.Profile | None:
+        """A cProfile profiler for a sample_rate share of the requests, otherwise None."""
+        return cProfile.Profile() if random.random() < self.sample_rate else None
+
+    def record(self, request, response, profile, profiler: cProfile.Profile | None):
+        """Add the Server-Timing header to the response and log the profile."""
+        response["Server-Timing"] = profile.server_timing()
+        log_line = {
+            "event": "request_profile",
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            **profile.summary(),
+        }
+        if profiler:
+            log_line["cprofile"] = self.save_cprofile(profiler, request)
+        logger.info(json.dumps(log_line))
+
+        return response
+
+    def save_cprofile(self, profiler: cProfile.Profile, request) -> str:
+        """Dump the stats to the cProfile directory, or return the top functions."""
+        if self.cprofile_dir:
+            directory = Path(self.cprofile_dir)
+            directory.mkdir(parents=True, exist_ok=True)
+            name = request.path.strip("/").replace("/", "_") or "root"
+            path = directory / f"{timezone.now():%Y%m%dT%H%M%S%f}-{name}.prof"
+            profiler.dump_stats(path)
+            return str(path)
+
+        output = io.StringIO()
+        stats = pstats.Stats(profiler, stream=output)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(CPROFILE_LOG_LIMIT)
+        return output.getvalue()
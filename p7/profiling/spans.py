@@ -0,0 +1,118 @@
+"""Per-request timing of SQL and named stages.
+
+A RequestProfile is active for the duration of a profiled request. While active,
+every SQL statement run through django.db is counted and timed, and code can mark
+stages with `span("name")`. Outside a profiled request span() does nothing, so the
+search code can stay instrumented at no cost.
+"""
+
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+
+from django.db import connections
+
+_current_profile = ContextVar("request_profile", default=None)
+
+# Stages of a search, in the order they are reported
+SEARCH_STAGES = (
+    "tokenize",
+    "df_lookup",
+    "candidate_fetch",
+    "scoring",
+    "fusion",
+    "highlight",
+    "serialize",
+)
+
+
+class RequestProfile:
+    """Query count, SQL time and stage durations of one request."""
+
+    def __init__(self):
+        self.started = perf_counter()
+        self.finished = None
+        self.query_count = 0
+        self.sql_time = 0.0
+        self.spans = {}
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        """django.db execute wrapper timing every statement."""
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += perf_counter() - start
+            self.query_count += 1
+
+    def record_span(self, name: str, duration: float) -> None:
+        """Add the duration of a stage, stages entered repeatedly are summed."""
+        self.spans[name] = self.spans.get(name, 0.0) + duration
+
+    @property
+    def total_time(self) -> float:
+        """Wall time of the request so far, or of the whole request once finished."""
+        return (self.finished or perf_counter()) - self.started
+
+    def summary(self) -> dict:
+        """Durations in milliseconds, suitable for a structured log line."""
+        total = self.total_time
+        return {
+            "total_ms": round(total * 1000, 3),
+            "sql_ms": round(self.sql_time * 1000, 3),
+            "python_ms": round((total - self.sql_time) * 1000, 3),
+            "query_count": self.query_count,
+            "spans_ms": {name: round(duration * 1000, 3) for name, duration in self.spans.items()},
+        }
+
+    def server_timing(self) -> str:
+        """The profile as a Server-Timing header value."""
+        total = self.total_time
+        metrics = [
+            f'sql;dur={self.sql_time * 1000:.3f};desc="{self.query_count} queries"',
+            f"python;dur={(total - self.sql_time) * 1000:.3f}",
+        ]
+        ordered = sorted(
+            self.spans.items(),
+            key=lambda item: (
+                SEARCH_STAGES.index(item[0]) if item[0] in SEARCH_STAGES else len(SEARCH_STAGES)
+            ),
+        )
+        metrics.extend(f"{name};dur={duration * 1000:.3f}" for name, duration in ordered)
+        metrics.append(f"total;dur={total * 1000:.3f}")
+        return ", ".join(metrics)
+
+
+def current_profile() -> RequestProfile | None:
+    """The profile of the request being handled, if it is profiled."""
+    return _current_profile.get()
+
+
+@contextmanager
+def span(name: str):
+    """Time a named stage of the current request, if it is profiled."""
+    profile = _current_profile.get()
+    if profile is None:
+        yield
+        return
+
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        profile.record_span(name, perf_counter() - start)
+
+
+@contextmanager
+def profile_request():
+    """Activate a RequestProfile and time all SQL run on any database connection."""
+    profile = RequestProfile()
+    token = _current_profile.set(profile)
+    try:
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(profile.execute_wrapper))
+            yield profile
+    finally:
+        profile.finished = perf_counter()
+        _current_profile.reset(token)
@@ -1,14 +1,21 @@
 """API endpoint to search files by filename."""
 
+import json
 import re
+from asgiref.sync import sync_to_async
 from ninja import Router, Header
-from django.http import JsonResponse
-from repository.file import query_files
-from repository.user import get_user
-from repository.service import get_service_name
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, StreamingHttpResponse
+from repository.file import query_files, query_files_in_phases
+from repository.passage import highlight_best_passages
+from repository.user import aget_user, get_user
+from repository.service import aget_user_service_names, get_service_name
 from p7.helpers import validate_internal_auth
+from p7.profiling.spans import span
+from p7.search.content_ranking import RANKING_MODES
 
 search_router = Router()
+async_search_router = Router()
 
 
 def sanitize_user_search(text: str) -> str:
@@ -45,11 +52,115 @@ def tokenize(input_str: str) -> list[str]:
     return list(input_str.split())
 
 
+def serialize_file(file, service_name: str | None) -> dict:
+    """
+    Serializes a search result for the response.
+    Args:
+        file: A File returned by query_files.
+        service_name (str | None): Name of the service the file belongs to.
+    Returns:
+        dict: The fields returned to the client.
+    """
+    data = {
+        "id": file.id,
+        "name": file.name,
+        "extension": file.extension,
+        "path": file.path,
+        "link": file.link,
+        "size": file.size,
+        "createdAt": file.createdAt,
+        "modifiedAt": file.modifiedAt,
+        "snippet": file.snippet,
+        # (start, end) offsets of the query terms in the snippet
+        "highlights": getattr(file, "highlights", []),
+        "serviceName": service_name,
+    }
+    if hasattr(file, "explanation"):
+        # Only set on the top results of explain requests
+        data["explanation"] = file.explanation
+    return data
+
+
+def serialize_results(results, user_id: str) -> list[dict]:
+    """
+    Serializes the results of a search, looking up each service name once.
+    Args:
+        results: Files returned by query_files.
+        user_id (str): The user searching.
+    Returns:
+        list[dict]: The serialized files, in result order.
+    """
+    # Cache service lookups to avoid repeated DB calls
+    service_name_cache: dict = {}
+
+    files_data = []
+
+    for file in results:
+        # Extract id as file.serviceId is a service object
+        service_ref = file.serviceId
+        service_id = getattr(service_ref, "id", service_ref)
+
+        if service_id not in service_name_cache:
+            service_name = get_service_name(user_id, service_id)
+            # get_service_name may return a JsonResponse on error — handle that safely
+            if isinstance(service_name, JsonResponse):
+                service_name_cache[service_id] = None
+            else:
+                service_name_cache[service_id] = service_name
+
+        files_data.append(serialize_file(file, service_name_cache.get(service_id)))
+    return files_data
+
+
+def server_sent_event(event: str, data: dict) -> str:
+    """
+    Formats one Server-Sent Event.
+    Args:
+        event (str): The event name, the phase of a progressive search.
+        data (dict): The payload, sent as a single line of JSON.
+    Returns:
+        str: The event, terminated by a blank line.
+    """
+    return f"event: {event}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n"
+
+
+def event_stream(events) -> StreamingHttpResponse:
+    """
+    Wraps server-sent events in an unbuffered text/event-stream response.
+    Args:
+        events: Iterator or async iterator of formatted events.
+    Returns:
+        StreamingHttpResponse: The response sending each event as it is produced.
+    """
+    response = StreamingHttpResponse(events, content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # Keep reverse proxies from holding the first phase back
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+def invalid_ranking(ranking: str | None) -> JsonResponse | None:
+    """
+    Validates the content ranking chosen for a search.
+    Args:
+        ranking (str | None): The ranking query parameter.
+    Returns:
+        JsonResponse | None: A 400 response for an unknown ranking, otherwise None.
+    """
+    if ranking is not None and ranking not in RANKING_MODES:
+        return JsonResponse(
+            {"error": f"ranking must be one of {', '.join(RANKING_MODES)}"}, status=400
+        )
+    return None
+
+
 @search_router.get("/")
 def search_files_by_filename(
     request,
     user_id: str,
     search_string: str,
+    ranking: str | None = None,
+    explain: bool = False,
     x_internal_auth: str = Header(..., alias="x-internal-auth"),
 ):
     """Search files in the database by filename.
@@ -57,6 +168,8 @@ def search_files_by_filename(
     params:
         x_internal_auth (str): The internal auth header for validating the request.
         filename (str): The filename or substring to search for.
+        ranking (str): Content ranking, "tfidf" or "bm25". Defaults to SEARCH_RANKING.
+        explain (bool): Add a breakdown of the rank to the top results.
     """
 
     auth_resp = validate_internal_auth(x_internal_auth)
@@ -70,40 +183,180 @@ def search_files_by_filename(
     if not search_string:
         return JsonResponse({"error": "search_string required"}, status=400)
 
+    ranking_resp = invalid_ranking(ranking)
+    if ranking_resp:
+        return ranking_resp
+
+    with span("tokenize"):
+        sanitized_input = sanitize_user_search(search_string)
+        tokens = tokenize(sanitized_input)
+    results = query_files(tokens, user_id, ranking=ranking, explain=explain)
+    with span("highlight"):
+        highlight_best_passages(results, sanitized_input)
+    with span("serialize"):
+        files_data = serialize_results(results, user_id)
+
+        return JsonResponse({"files": files_data}, status=200)
+
+
+@search_router.get("/stream")
+def stream_search_files_by_filename(
+    request,
+    user_id: str,
+    search_string: str,
+    ranking: str | None = None,
+    x_internal_auth: str = Header(..., alias="x-internal-auth"),
+):
+    """Progressive version of search_files_by_filename, as Server-Sent Events.
+
+    A "names" event with the files ranked by name only is sent as soon as the cheap
+    file name ranking is done, then a "results" event with the files
+    search_files_by_filename returns once the content ranking is fused in. Both
+    carry {"files": [...]}, only the results are highlighted.
+
+    params:
+        x_internal_auth (str): The internal auth header for validating the request.
+        filename (str): The filename or substring to search for.
+        ranking (str): Content ranking, "tfidf" or "bm25". Defaults to SEARCH_RANKING.
+    """
+    auth_resp = validate_internal_auth(x_internal_auth)
+    if auth_resp:
+        return auth_resp
+
+    user = get_user(user_id)
+    if isinstance(user, JsonResponse):
+        return user
+
+    if not search_string:
+        return JsonResponse({"error": "search_string required"}, status=400)
+
+    ranking_resp = invalid_ranking(ranking)
+    if ranking_resp:
+        return ranking_resp
+
     sanitized_input = sanitize_user_search(search_string)
-    tokens = tokenize(sanitized_input)
-    results = query_files(tokens, user_id)
-    # Cache service lookups to avoid repeated DB calls
-    service_name_cache: dict = {}
+    phases = query_files_in_phases(tokenize(sanitized_input), user_id, ranking=ranking)
+    if isinstance(phases, JsonResponse):
+        return phases
 
-    files_data = []
+    def events():
+        for phase, files in phases:
+            if phase == "results":
+                highlight_best_passages(files, sanitized_input)
+            yield server_sent_event(phase, {"files": serialize_results(files, user_id)})
 
-    for file in results:
-        # Extract id as file.serviceId is a service object
-        service_ref = file.serviceId
-        service_id = getattr(service_ref, "id", service_ref)
+    return event_stream(events())
 
-        if service_id not in service_name_cache:
-            service_name = get_service_name(user_id, service_id)
-            # get_service_name may return a JsonResponse on error — handle that safely
-            if isinstance(service_name, JsonResponse):
-                service_name_cache[service_id] = None
-            else:
-                service_name_cache[service_id] = service_name
 
-        files_data.append(
-            {
-                "id": file.id,
-                "name": file.name,
-                "extension": file.extension,
-                "path": file.path,
-                "link": file.link,
-                "size": file.size,
-                "createdAt": file.createdAt,
-                "modifiedAt": file.modifiedAt,
-                "snippet": file.snippet,
-                "serviceName": service_name_cache.get(service_id),
-            }
+@async_search_router.get("/")
+async def search_files_by_filename_async(
+    request,
+    user_id: str,
+    search_string: str,
+    ranking: str | None = None,
+    explain: bool = False,
+    x_internal_auth: str = Header(..., alias="x-internal-auth"),
+):
+    """Async version of search_files_by_filename, served when ASYNC_ENDPOINTS is set.
+
+    The lookups around the search use the async ORM, query_files runs in a thread
+    so the event loop is free for other requests while it waits on the database.
+
+    params:
+        x_internal_auth (str): The internal auth header for validating the request.
+        filename (str): The filename or substring to search for.
+        ranking (str): Content ranking, "tfidf" or "bm25". Defaults to SEARCH_RANKING.
+        explain (bool): Add a breakdown of the rank to the top results.
+    """
+    auth_resp = validate_internal_auth(x_internal_auth)
+    if auth_resp:
+        return auth_resp
+
+    user = await aget_user(user_id)
+    if isinstance(user, JsonResponse):
+        return user
+
+    if not search_string:
+        return JsonResponse({"error": "search_string required"}, status=400)
+
+    ranking_resp = invalid_ranking(ranking)
+    if ranking_resp:
+        return ranking_resp
+
+    with span("tokenize"):
+        sanitized_input = sanitize_user_search(search_string)
+        tokens = tokenize(sanitized_input)
+    results = await sync_to_async(query_files)(
+        tokens, user_id, ranking=ranking, explain=explain
+    )
+    if isinstance(results, JsonResponse):
+        return results
+
+    with span("highlight"):
+        await sync_to_async(highlight_best_passages)(results, sanitized_input)
+    with span("serialize"):
+        # One query for the names of all services in the results
+        service_names = await aget_user_service_names(
+            user_id, {file.serviceId_id for file in results}
         )
+        files_data = [
+            serialize_file(file, service_names.get(file.serviceId_id)) for file in results
+        ]
+
+        return JsonResponse({"files": files_data}, status=200)
+
+
+@async_search_router.get("/stream")
+async def stream_search_files_by_filename_async(
+    request,
+    user_id: str,
+    search_string: str,
+    ranking: str | None = None,
+    x_internal_auth: str = Header(..., alias="x-internal-auth"),
+):
+    """Async version of stream_search_files_by_filename, served when ASYNC_ENDPOINTS is set.
+
+    Each phase of the search runs in a thread, the event loop sends the events.
+
+    params:
+        x_internal_auth (str): The internal auth header for validating the request.
+        filename (str): The filename or substring to search for.
+        ranking (str): Content ranking, "tfidf" or "bm25". Defaults to SEARCH_RANKING.
+    """
+    auth_resp = validate_internal_auth(x_internal_auth)
+    if auth_resp:
+        return auth_resp
+
+    user = await aget_user(user_id)
+    if isinstance(user, JsonResponse):
+        return user
+
+    if not search_string:
+        return JsonResponse({"error": "search_string required"}, status=400)
+
+    ranking_resp = invalid_ranking(ranking)
+    if ranking_resp:
+        return ranking_resp
+
+    sanitized_input = sanitize_user_search(search_string)
+    phases = await sync_to_async(query_files_in_phases)(
+        tokenize(sanitized_input), user_id, ranking=ranking
+    )
+    if isinstance(phases, JsonResponse):
+        return phases
+
+    async def events():
+        while (phase := await sync_to_async(next)(phases, None)) is not None:
+            name, files = phase
+            if name == "results":
+                await sync_to_async(highlight_best_passages)(files, sanitized_input)
+            # One query for the names of all services in the phase
+            service_names = await aget_user_service_names(
+                user_id, {file.serviceId_id for file in files}
+            )
+            files_data = [
+                serialize_file(file, service_names.get(file.serviceId_id)) for file in files
+            ]
+            yield server_sent_event(name, {"files": files_data})
 
-    return JsonResponse({"files": files_data}, status=200)
+    return event_stream(events())
@@ -1,56 +1,55 @@
 """
 The code used to rank files based on content
-Calculates ltc for queries and lnc for files
+Calculates ltc for queries and lnc for files, or BM25
 """
 
-from math import log10, sqrt
+from math import log, log10, sqrt
 from collections import Counter
-from typing import Callable, Dict, Mapping, Sequence, Union, List
+from typing import Callable, Dict, Mapping, Sequence
 
-TermStats = Dict[str, Union[float, int]]
-DocumentStats = Dict[str, TermStats]
+# Content ranking modes selectable per query
+RANKING_MODES = ("tfidf", "bm25")
 
+# BM25 term frequency saturation and document length normalization
+BM25_K1 = 1.2
+BM25_B = 0.75
 
-def build_weighted_vector(
-    freq_map: Dict[str, int], idf_lookup: Callable[[str], float]
-) -> DocumentStats:
+
+def _ltc_idf_lookup(
+    user_documents: int, document_frequencies: Mapping[str, int]
+) -> Callable[[str], float]:
+    """The inverted document frequency of a term, 0 for terms no file contains."""
+    # Dictionary holding term: document_frequency mapping
+    df_lookup = dict(document_frequencies)
+    return lambda term: (
+        log10(user_documents / df_lookup[term]) if df_lookup.get(term) else 0
+    )
+
+
+def build_norms(
+    freq_map: Mapping[str, int], idf_lookup: Callable[[str], float]
+) -> Dict[str, float]:
     """
-    Build a normalized tf-idf vector from term frequencies.
+    Build a cosine normalized tf-idf vector from term frequencies,
+    weighting each term (1 + log10(tf)) * idf.
 
     Args:
         freq_map: Mapping of term to its raw frequency within a document or query.
         idf_lookup: Function returning the inverse document frequency for a term.
 
     Returns:
-        DocumentStats: 
-            Per-term statistics including tf, idf, tf-idf, and normalized weights.
+        Dict[str, float]: The normalized tf-idf weight of each term.
     """
-    term_stats, squared_sum = {}, 0.0
-
-    for term, tf_raw in freq_map.items():
-        tf_wt = 1 + log10(tf_raw)
-        idf = idf_lookup(term)
-        tf_idf = tf_wt * idf
-        term_stats[term] = {
-            "tf-raw": tf_raw,
-            "tf-wt": tf_wt,
-            "idf": idf,
-            "tf-idf": tf_idf,
-        }
-        squared_sum += tf_idf**2
-
-    length = sqrt(squared_sum)
+    weights = {term: (1 + log10(tf_raw)) * idf_lookup(term) for term, tf_raw in freq_map.items()}
+    length = sqrt(sum(weight * weight for weight in weights.values()))
+    return {term: weight / length if length else 0 for term, weight in weights.items()}
 
-    for stats in term_stats.values():
-        stats["norm"] = stats["tf-idf"] / length if length else 0
-    return term_stats
 
-
-def get_query_ltc(
+def get_query_ltc_norms(
     user_documents: int,
     query_tokens: Sequence[str],
     document_frequencies: Mapping[str, int],
-):
+) -> Dict[str, float]:
     """
     Compute the ltc-weighted vector for a query.
 
@@ -60,61 +59,100 @@ def get_query_ltc(
         document_frequencies: Frequency of term accross all user files
 
     Returns:
-        DocumentStats: LTC-normalized statistics for the query terms.
+        Dict[str, float]: The ltc weight of each query term.
     """
-    # Guard if there are no user documents or no query tokens
     if user_documents <= 0 or not query_tokens:
         return {}
-
-    # Dictionary holding term: document_frequency mapping
-    df_lookup = dict(document_frequencies)
-    # Term frequency of each token in the query
-    freq_map = Counter(query_tokens)
-    return build_weighted_vector(
-        # The lambda function calculates the inverted document frequency for a term
-        freq_map,
-        lambda term: (
-            log10(user_documents / df_lookup[term]) if df_lookup.get(term) else 0
-        ),
+    return build_norms(
+        Counter(query_tokens), _ltc_idf_lookup(user_documents, document_frequencies)
     )
 
 
-def get_document_lnc(term_frequencies: Mapping[str, int]):
+def get_document_lnc_norms(term_frequencies: Mapping[str, int]) -> Dict[str, float]:
     """
-    Compute the lnc-weighted vector for a document.
+    Compute the lnc-weighted vector for a document, the df is not used.
 
     Args:
         term_frequencies: Term frequency data for the document
 
     Returns:
-        DocumentStats: LNC-normalized statistics for the document terms
+        Dict[str, float]: The lnc weight of each document term.
     """
-    # Dictionary holding term: term_frequency mapping
-    freq_map = dict(term_frequencies)
-
-    # When computing lnc the df is 1
-    return build_weighted_vector(freq_map, lambda _term: 1.0)
+    return build_norms(dict(term_frequencies), lambda _term: 1.0)
 
 
-def compute_score_for_files(
-    query_term_stats: DocumentStats, file_stats_list: List[Dict[int, DocumentStats]]
-):
+def compute_score_from_norms(
+    query_norms: Mapping[str, float], document_norms: Mapping[int, Mapping[str, float]]
+) -> Dict[int, float]:
     """
-    Calculate cosine similarity scores between a query vector and document vectors.
+    Cosine similarity scores between a query vector and document vectors.
 
     Args:
-        query_term_stats: Normalized statistics for query terms.
-        file_stats_list: List of document stats keyed by file identifier.
+        query_norms: ltc weight of each query term.
+        document_norms: lnc weights of each document keyed by file identifier.
 
     Returns:
         Dict[int, float]: Mapping from file identifier to similarity score.
     """
-    file_scores = {}
-    for file_stat in file_stats_list:
-        (file_id, doc_stats), prod = next(iter(file_stat.items())), 0.0
-        for term, stats in query_term_stats.items():
-            doc_term = doc_stats.get(term)
-            if doc_term:
-                prod += stats["norm"] * doc_term["norm"]
-        file_scores[file_id] = prod
-    return file_scores
+    return {
+        file_id: sum(
+            weight * norms[term] for term, weight in query_norms.items() if term in norms
+        )
+        for file_id, norms in document_norms.items()
+    }
+
+
+def bm25_impact(
+    tf: int, document_length: int | None, average_length: float | None
+) -> float:
+    """
+    The BM25 weight of a term in a document, without idf.
+    Depends only on the document and the average length, so it can be stored.
+
+    Args:
+        tf: Frequency of the term in the document.
+        document_length: Words in the document, None when unknown.
+        average_length: Average words per document of the user.
+
+    Returns:
+        float: Between 0 and BM25_K1 + 1.
+    """
+    if not tf:
+        return 0.0
+    length_ratio = (
+        document_length / average_length if document_length and average_length else 1.0
+    )
+    return tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * length_ratio))
+
+
+def get_query_bm25(
+    user_documents: int,
+    query_tokens: Sequence[str],
+    document_frequencies: Mapping[str, int],
+) -> Dict[str, float]:
+    """
+    Compute the weight of each query term under BM25, its idf times its count in the query.
+    Weights are scaled so that a file can score at most 1, like the cosine of tf-idf,
+    since content scores are fused with name ranks by fixed weights.
+
+    Args:
+        user_documents: Total number of user documents.
+        query_tokens: Tokenized query terms.
+        document_frequencies: Frequency of term accross all user files
+
+    Returns:
+        Dict[str, float]: Weight per query term found in the user's files.
+    """
+    if user_documents <= 0 or not query_tokens:
+        return {}
+
+    df_lookup = dict(document_frequencies)
+    weights = {
+        # The +1 keeps idf positive for terms found in most documents
+        term: count * log(1 + (user_documents - df_lookup[term] + 0.5) / (df_lookup[term] + 0.5))
+        for term, count in Counter(query_tokens).items()
+        if df_lookup.get(term)
+    }
+    # A file with every term at saturated frequency scores the sum of weights * (k1 + 1)
+    max_score = sum(weights.values()) * (BM25_K1 + 1)
+    return {term: weight / max_score for term, weight in weights.items()}
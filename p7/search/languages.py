@@ -0,0 +1,73 @@
+"""
+Language detection of extracted content, choosing the text search configuration
+tsContent is built with.
+
+A language is recognised by the share of its function words, which make up a large
+part of any running text. Text with enough words but few function words of either
+language, such as spreadsheets or lists of names, is indexed with the "simple"
+configuration, so it is neither stemmed nor stripped of stop words.
+"""
+
+import re
+
+# The configuration of files indexed before languages were detected, and of text too
+# short to tell
+DEFAULT_LANGUAGE = "english"
+FALLBACK_LANGUAGE = "simple"
+
+# Words of a text looked at, from its start
+SAMPLE_WORDS = 2000
+# Share of function words, and count of them, a language needs to be recognised
+MIN_STOPWORD_SHARE = 0.05
+MIN_STOPWORDS = 2
+# Words a text needs before it is indexed with FALLBACK_LANGUAGE
+MIN_FALLBACK_WORDS = 20
+
+STOPWORDS = {
+    "danish": frozenset(
+        """
+        af alle andet andre at blev bliver da de dem den denne der deres det dette dig
+        din dog du efter eller en end er et for fra ham han hans har havde have hende
+        hendes her hos hun hvad hvis hvor ikke ind jeg jer jo kunne man mange med meget
+        men mig min mine mit mod også og op os over på selv sig sin sine sit skal skulle
+        som sådan thi til ud under var vi vil ville vor være været
+        """.split()
+    ),
+    "english": frozenset(
+        """
+        a about after all also an and any are as at be because been but by can could
+        did do does for from had has have he her his how i if in into is it its just
+        more my no not of on or our out she so some than that the their them then there
+        these they this to up was we were what when which who will with would you your
+        """.split()
+    ),
+}
+
+_WORD = re.compile(r"[^\W\d_]+")
+
+
+def detect_language(text: str | None) -> str:
+    """
+    The text search configuration to index a text with.
+
+    returns:
+        A key of STOPWORDS, FALLBACK_LANGUAGE for text without enough function words,
+        or DEFAULT_LANGUAGE for text too short to tell.
+    """
+    words = []
+    for match in _WORD.finditer(text or ""):
+        words.append(match.group().lower())
+        if len(words) >= SAMPLE_WORDS:
+            break
+
+    counts = {
+        language: sum(1 for word in words if word in stopwords)
+        for language, stopwords in STOPWORDS.items()
+    }
+    best = max(counts, key=counts.get)
+    needed = max(MIN_STOPWORDS, MIN_STOPWORD_SHARE * len(words))
+    if counts[best] >= needed and list(counts.values()).count(counts[best]) == 1:
+        return best
+    if len(words) >= MIN_FALLBACK_WORDS:
+        return FALLBACK_LANGUAGE
+    return DEFAULT_LANGUAGE
@@ -0,0 +1,384 @@
+"""
+Optional in-process search index per user, enabled with MEMORY_INDEX["enabled"].
+
+A UserIndex holds a user's files, the lexemes and positions of their tsFilename,
+the postings of their tsContent and the lnc length of every document. It ranks
+files the same way as FileQuerySet.ranking_based_on_file_name and
+ranking_based_on_content, without querying the files.
+
+Indexes are built lazily the first time a user searches, in a background thread
+while that search is answered by SQL, and kept in an LRU cache bounded by an
+estimated memory budget. Every index records the user's indexVersion it was
+built from; once the version moves on the index is stale, dropped and rebuilt.
+"""
+
+import copy
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from math import exp, log, log10, sqrt
+
+from django.conf import settings
+from django.db import connection, connections
+
+from repository.helpers import ts_tokenize_languages
+from repository.models import File, User
+from p7.search.content_ranking import bm25_impact, get_query_bm25, get_query_ltc_norms
+from p7.search.languages import DEFAULT_LANGUAGE
+
+# Rough CPython sizes used to estimate the memory held by an index
+POSTING_BYTES = 120
+FILE_BYTES = 1200
+
+# Rows fetched per round trip while loading an index
+LOAD_CHUNK_SIZE = 10_000
+
+# ts_rank constants, see src/backend/utils/adt/tsrank.c in PostgreSQL
+_SUM_INVERSE_SQUARES = 1.64493406685
+
+
+def _word_distance(distance: int) -> float:
+    """Weight of two query words `distance` positions apart, as in ts_rank."""
+    if distance > 100:
+        return 1e-30
+    return 1.0 / (1.005 + 0.05 * exp(distance / 1.5 - 2))
+
+
+def _rank_or(positions: dict[str, list[int]], lexemes: list[str]) -> float:
+    """ts_rank of an OR (or single word) query, every position weighted A (1.0)."""
+    rank = 0.0
+    for lexeme in lexemes:
+        if lexeme not in positions:
+            continue
+        # With equal weights ts_rank's max weight term cancels out
+        weighted = sum(1.0 / ((j + 1) * (j + 1)) for j in range(len(positions[lexeme])))
+        rank += weighted / _SUM_INVERSE_SQUARES
+    return rank / len(lexemes) if lexemes else 0.0
+
+
+def _rank_and(positions: dict[str, list[int]], lexemes: list[str]) -> float:
+    """ts_rank of an AND query, combining the distances between query words."""
+    if len(lexemes) < 2:
+        return _rank_or(positions, lexemes)
+
+    rank = -1.0
+    found = []
+    for lexeme in lexemes:
+        current = positions.get(lexeme)
+        if current is None:
+            continue
+        for previous in found:
+            for position in current:
+                for other in previous:
+                    distance = abs(position - other)
+                    if not distance:
+                        continue
+                    weight = sqrt(_word_distance(distance))
+                    rank = weight if rank < 0 else 1.0 - (1.0 - rank) * (1.0 - weight)
+        found.append(current)
+    return rank
+
+
+def ts_rank_simple(positions: dict[str, list[int]], lexemes: list[str]) -> float:
+    """
+    ts_rank(vector, plainto_tsquery('simple', query), 16) for a vector weighted A.
+
+    Args:
+        positions: Positions of each lexeme in the vector.
+        lexemes: Lexemes of the query in order.
+    Returns:
+        float: The rank, divided by log2(1 + unique lexemes in the vector).
+    """
+    if not positions or not lexemes:
+        return 0.0
+    unique = sorted(set(lexemes))
+    rank = _rank_and(positions, unique) if len(lexemes) > 1 else _rank_or(positions, unique)
+    if rank < 0:
+        rank = 1e-20
+    return rank / (log(len(positions) + 1) / log(2.0))
+
+
+@lru_cache(maxsize=1024)
+def content_lexemes(
+    query_text: str, languages: tuple[str, ...] = (DEFAULT_LANGUAGE,)
+) -> tuple[str, ...]:
+    """Lexemes of a query in the given languages, stemmed by PostgreSQL once per query."""
+    return tuple(ts_tokenize_languages(query_text, languages))
+
+
+class UserIndex:
+    """The searchable state of one user's files at one indexVersion."""
+
+    def __init__(self, user_id: int, version: int):
+        self.user_id = user_id
+        self.version = version
+        self.files: dict[int, File] = {}
+        # file id -> lexeme -> positions in tsFilename
+        self.filename_positions: dict[int, dict[str, list[int]]] = {}
+        # lexeme -> file id -> term frequency in tsContent
+        self.postings: dict[str, dict[int, int]] = {}
+        # file id -> length of the file's lnc vector
+        self.lengths: dict[int, float] = {}
+        self.estimated_bytes = 0
+
+    def filter_files(
+        self,
+        provider=None,
+        modified_after_date=None,
+        modified_before_date=None,
+        extension=None,
+    ) -> set[int]:
+        """Ids of the files passing the filters of query_files."""
+        file_ids = set()
+        for file_id, file in self.files.items():
+            # Like the SQL filters every provider and extension must match
+            if provider and any(file.serviceId.name.lower() != p.lower() for p in provider):
+                continue
+            if extension and any(file.extension.lower() != e.lower() for e in extension):
+                continue
+            if modified_after_date and file.modifiedAt < modified_after_date:
+                continue
+            if modified_before_date and file.modifiedAt > modified_before_date:
+                continue
+            file_ids.add(file_id)
+        return file_ids
+
+    def ranking_based_on_file_name(self, query_text: str, file_ids: set[int]) -> list[File]:
+        """Files ranked like FileQuerySet.ranking_based_on_file_name."""
+        tokens = [t for t in (query_text or "").split() if t]
+        if not tokens:
+            return []
+
+        ranked = []
+        lowered_query = query_text.lower()
+        for file_id in file_ids:
+            positions = self.filename_positions.get(file_id)
+            if not positions:
+                continue
+            matched_tokens = sum(1 for t in tokens if t in positions)
+            if not matched_tokens:
+                continue
+            file = copy.copy(self.files[file_id])
+            # The components are kept like the annotations of the SQL ranking
+            file.plain_rank = ts_rank_simple(positions, tokens)
+            file.token_ratio = matched_tokens / len(tokens)
+            file.ordered_bonus = 0.1 if lowered_query in file.name.lower() else 0.0
+            file.rank = file.plain_rank * file.token_ratio + file.ordered_bonus
+            ranked.append(file)
+        return ranked
+
+    def ranking_based_on_content(
+        self,
+        query_text: str,
+        file_ids: set[int],
+        ranking: str = "tfidf",
+        languages: tuple[str, ...] = (DEFAULT_LANGUAGE,),
+    ) -> list[File]:
+        """Files ranked like FileQuerySet.ranking_based_on_content, tf-idf ltc.lnc or BM25."""
+        tokens = list(content_lexemes(query_text, languages))
+        if not tokens:
+            return []
+
+        document_frequencies = []
+        candidates = set()
+        for token in tokens:
+            matching = file_ids.intersection(self.postings.get(token, ()))
+            if matching:
+                document_frequencies.append((token, len(matching)))
+                candidates.update(matching)
+
+        if ranking == "bm25":
+            query_weights = get_query_bm25(len(file_ids), tokens, document_frequencies)
+            lengths = [
+                self.files[file_id].contentLength
+                for file_id in file_ids
+                if self.files[file_id].contentLength is not None
+            ]
+            average_length = sum(lengths) / len(lengths) if lengths else None
+        else:
+            query_weights = get_query_ltc_norms(len(file_ids), tokens, document_frequencies)
+
+        ranked = []
+        for file_id in candidates:
+            file = copy.copy(self.files[file_id])
+            file.rank = 0.0
+            for token, weight in query_weights.items():
+                tf = self.postings.get(token, {}).get(file_id)
+                if not tf:
+                    continue
+                if ranking == "bm25":
+                    file.rank += weight * bm25_impact(tf, file.contentLength, average_length)
+                else:
+                    file.rank += weight * (1 + log10(tf)) / self.lengths[file_id]
+            ranked.append(file)
+        return ranked
+
+
+def build_user_index(user_id: int) -> UserIndex:
+    """
+    Load a user's files and search vectors into a UserIndex.
+
+    The version is read first, so changes made while loading leave the index stale.
+    """
+    version = User.objects.values_list("indexVersion", flat=True).get(pk=user_id)
+    index = UserIndex(user_id, version)
+
+    files = (
+        File.objects.filter(serviceId__userId=user_id)
+        .select_related("serviceId")
+        .only(
+            "id", "name", "extension", "path", "link", "size", "createdAt",
+            "modifiedAt", "indexedAt", "snippet", "contentLength", "serviceId__id",
+            "serviceId__name",
+        )
+    )
+    size = 0
+    for file in files.iterator(chunk_size=LOAD_CHUNK_SIZE):
+        index.files[file.id] = file
+        size += FILE_BYTES + sum(
+            len(value or "") for value in (file.name, file.path, file.link, file.snippet)
+        )
+
+    file_table = connection.ops.quote_name(File._meta.db_table)
+    service_filter = 'f."serviceId" IN (SELECT id FROM "service" WHERE "userId" = %s)'
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT f.id, t.lexeme, t.positions
+            FROM {file_table} AS f, unnest(f."tsFilename") AS t
+            WHERE {service_filter}
+            """,
+            [user_id],
+        )
+        while rows := cursor.fetchmany(LOAD_CHUNK_SIZE):
+            for file_id, lexeme, positions in rows:
+                index.filename_positions.setdefault(file_id, {})[lexeme] = sorted(
+                    positions or [1]
+                )
+                size += POSTING_BYTES
+
+        # Term frequency as counted by ts_stat: positions, or 1 for stripped lexemes
+        cursor.execute(
+            f"""
+            SELECT f.id, t.lexeme, coalesce(array_length(t.positions, 1), 1)
+            FROM {file_table} AS f, unnest(f."tsContent") AS t
+            WHERE {service_filter}
+            """,
+            [user_id],
+        )
+        squared_sums: dict[int, float] = {}
+        while rows := cursor.fetchmany(LOAD_CHUNK_SIZE):
+            for file_id, lexeme, tf in rows:
+                index.postings.setdefault(lexeme, {})[file_id] = tf
+                squared_sums[file_id] = squared_sums.get(file_id, 0.0) + (1 + log10(tf)) ** 2
+                size += POSTING_BYTES
+
+    index.lengths = {file_id: sqrt(total) for file_id, total in squared_sums.items()}
+    index.estimated_bytes = size
+    return index
+
+
+class MemoryIndexCache:
+    """User indexes kept in least recently used order within a memory budget."""
+
+    def __init__(self, budget_bytes: int):
+        self.budget_bytes = budget_bytes
+        self.used_bytes = 0
+        self._indexes: OrderedDict[int, UserIndex] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int, version: int) -> UserIndex | None:
+        """The user's index if it is loaded and built at the given version."""
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is None:
+                return None
+            if index.version != version:
+                self._remove(user_id)
+                return None
+            self._indexes.move_to_end(user_id)
+            return index
+
+    def put(self, index: UserIndex) -> bool:
+        """Cache an index, evicting the least recently used ones to make room."""
+        if index.estimated_bytes > self.budget_bytes:
+            return False
+        with self._lock:
+            self._remove(index.user_id)
+            while self._indexes and self.used_bytes + index.estimated_bytes > self.budget_bytes:
+                self._remove(next(iter(self._indexes)))
+            self._indexes[index.user_id] = index
+            self.used_bytes += index.estimated_bytes
+        return True
+
+    def invalidate(self, user_id: int) -> None:
+        """Drop the user's index, if loaded."""
+        with self._lock:
+            self._remove(user_id)
+
+    def _remove(self, user_id: int) -> None:
+        index = self._indexes.pop(user_id, None)
+        if index is not None:
+            self.used_bytes -= index.estimated_bytes
+
+
+_building: set[int] = set()
+_building_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def get_memory_index_cache(budget_mb: int) -> MemoryIndexCache:
+    """Return the index cache of the current process, creating it on first use."""
+    return MemoryIndexCache(budget_mb * 1024 * 1024)
+
+
+@lru_cache(maxsize=None)
+def _get_builder() -> ThreadPoolExecutor:
+    """The thread building indexes in the background, one build at a time."""
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory-index-builder")
+
+
+def _load_into_cache(user_id: int) -> None:
+    """Build a user's index and cache it."""
+    try:
+        get_memory_index_cache(settings.MEMORY_INDEX["budget_mb"]).put(
+            build_user_index(user_id)
+        )
+    except User.DoesNotExist:
+        pass
+    finally:
+        with _building_lock:
+            _building.discard(user_id)
+
+
+def _load_in_background(user_id: int) -> None:
+    """_load_into_cache in the builder thread, which owns its own connection."""
+    try:
+        _load_into_cache(user_id)
+    finally:
+        connections.close_all()
+
+
+def cached_user_index(user_id: int, version: int) -> UserIndex | None:
+    """
+    The user's index if it is warm and current, otherwise None after starting a build.
+
+    With MEMORY_INDEX["build_in_background"] unset the index is built in the calling
+    thread and returned right away.
+    """
+    cache = get_memory_index_cache(settings.MEMORY_INDEX["budget_mb"])
+    index = cache.get(user_id, version)
+    if index is not None:
+        return index
+
+    if not settings.MEMORY_INDEX["build_in_background"]:
+        _load_into_cache(user_id)
+        return cache.get(user_id, version)
+
+    with _building_lock:
+        if user_id in _building:
+            return None
+        _building.add(user_id)
+    _get_builder().submit(_load_in_background, user_id)
+    return None
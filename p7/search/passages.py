@@ -0,0 +1,85 @@
+"""
+Passages stored per file at index time, and the highlighted snippets built from them.
+Search results show the passage best matching the query instead of re-reading content.
+"""
+
+import re
+
+# Characters per passage, cut back to a word boundary
+PASSAGE_CHARS = 300
+# Passages kept per file
+MAX_PASSAGES = 32
+
+# Marks ts_headline puts around matches. Control characters are removed from content
+# before indexing (see sanitize_for_postgres), so they cannot occur in a passage.
+HIGHLIGHT_START = "\x02"
+HIGHLIGHT_STOP = "\x03"
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def split_passages(
+    content: str, passage_chars: int = PASSAGE_CHARS, max_passages: int = MAX_PASSAGES
+) -> list[str]:
+    """
+    Split content into at most max_passages passages of about passage_chars characters.
+
+    Short content is covered completely. Longer content is sampled at evenly spaced
+    offsets, so the work and the stored size do not grow with the document.
+
+    Args:
+        content: Cleaned content of a file.
+        passage_chars: Maximum characters per passage.
+        max_passages: Maximum number of passages.
+    Returns:
+        list[str]: Passages in document order, whitespace collapsed.
+    """
+    if not content:
+        return []
+
+    stride = max(passage_chars, len(content) // max_passages)
+    passages = []
+    for offset in range(0, len(content), stride):
+        passage = _passage_at(content, offset, passage_chars)
+        if passage:
+            passages.append(passage)
+        if len(passages) == max_passages:
+            break
+    return passages
+
+
+def _passage_at(content: str, offset: int, passage_chars: int) -> str:
+    """The passage starting at the first word boundary at or after offset."""
+    if offset and not content[offset - 1].isspace():
+        # Skip the rest of a word cut by the offset
+        boundary = _WHITESPACE.search(content, offset, offset + passage_chars)
+        if not boundary:
+            return ""
+        offset = boundary.end()
+
+    window = content[offset:offset + passage_chars + 1]
+    if len(window) > passage_chars:
+        # Drop the word cut by the end of the window
+        cut = max(window.rfind(" "), window.rfind("\n"), window.rfind("\t"))
+        window = window[:cut] if cut > 0 else window[:passage_chars]
+    return _WHITESPACE.sub(" ", window).strip()
+
+
+def parse_highlights(headline: str) -> tuple[str, list[tuple[int, int]]]:
+    """
+    Split a ts_headline result into plain text and the spans of the matched words.
+
+    Args:
+        headline: Passage with matches between HIGHLIGHT_START and HIGHLIGHT_STOP.
+    Returns:
+        tuple: The passage without marks, and (start, end) character offsets of matches.
+    """
+    text_parts, highlights = [], []
+    length = 0
+    for i, part in enumerate(re.split(f"[{HIGHLIGHT_START}{HIGHLIGHT_STOP}]", headline)):
+        # Parts alternate between unmatched and matched text
+        if i % 2 and part:
+            highlights.append((length, length + len(part)))
+        text_parts.append(part)
+        length += len(part)
+    return "".join(text_parts), highlights
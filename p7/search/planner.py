@@ -0,0 +1,204 @@
+"""
+Query planning for query_files, configured with SEARCH_PLANNER.
+
+Each query token gets a selectivity, the share of files containing it, from stored
+document frequencies: the user's postings segments for content when there are any,
+otherwise the most common lexemes PostgreSQL's ANALYZE keeps for tsFilename and
+tsContent. Those statistics cover the whole file table, not one user: a token is taken
+to be as common among the user's files as among all files, and is applied to the
+user's file count from repository/statistics.py. The plan
+- leaves tokens in more than SEARCH_PLANNER["drop_selectivity"] of the files out of
+  candidate matching, they are still scored on the files the other tokens find,
+- matches candidates with all remaining tokens first, and with any of them when that
+  finds fewer than SEARCH_PLANNER["min_results"] files,
+- only scores from the in-memory index when enough candidates are expected to pay for
+  a pass over all of the user's files.
+"""
+
+import time
+from functools import lru_cache
+from math import prod
+from typing import NamedTuple, Sequence
+
+from django.conf import settings
+from django.db import connection
+
+from repository.models import File, User
+from repository.statistics import user_corpus_statistics
+from p7.search import segment_index
+from p7.search.languages import DEFAULT_LANGUAGE
+from p7.search.memory_index import (
+    UserIndex,
+    cached_user_index,
+    content_lexemes,
+    get_memory_index_cache,
+)
+
+
+class TokenPlan(NamedTuple):
+    """How the candidates of one ranking are matched."""
+
+    # Tokens candidates are matched with
+    match: tuple[str, ...]
+    # Tokens too common to match candidates with
+    dropped: tuple[str, ...]
+    # Match all tokens first, any of them when that finds fewer than min_results files
+    require_all: bool
+    min_results: int
+
+    def tsquery(self, require_all: bool) -> str:
+        """Raw tsquery text matching all or any of the tokens."""
+        return (" & " if require_all else " | ").join(self.match)
+
+
+class QueryPlan(NamedTuple):
+    """Candidate matching for the file name and content rankings of a query."""
+
+    name: TokenPlan
+    content: TokenPlan
+    # Expected share of files matched by either ranking, None without statistics
+    selectivity: float | None
+    # Files of the user the selectivity applies to
+    documents: int
+
+
+def plan_tokens(
+    tokens: Sequence[str],
+    selectivities: dict[str, float | None],
+    document_count: int,
+) -> TokenPlan:
+    """
+    Split tokens into the ones candidates are matched with and the ultra-common ones.
+
+    Tokens are only dropped from corpora of at least SEARCH_PLANNER["min_documents"]
+    files, and the least common token is kept when all of them are common.
+    """
+    config = settings.SEARCH_PLANNER
+    unique = list(dict.fromkeys(tokens))
+
+    def selectivity(token):
+        return selectivities.get(token) or 0.0
+
+    match = unique
+    if document_count >= config["min_documents"]:
+        match = [t for t in unique if selectivity(t) <= config["drop_selectivity"]]
+        if not match and unique:
+            match = [min(unique, key=selectivity)]
+    return TokenPlan(
+        match=tuple(match),
+        dropped=tuple(t for t in unique if t not in match),
+        require_all=len(match) > 1,
+        min_results=config["min_results"],
+    )
+
+
+def combined_selectivity(selectivities: Sequence[float | None]) -> float | None:
+    """Share of files containing any of the tokens, taken to occur independently."""
+    if any(s is None for s in selectivities):
+        return None
+    return 1.0 - prod(1.0 - s for s in selectivities)
+
+
+@lru_cache(maxsize=1)
+def _table_statistics(period: int) -> dict[str, tuple[dict[str, float], float]]:
+    """
+    Per tsvector column the frequencies of the most common lexemes and of any other
+    lexeme over all files, as of the last ANALYZE. Cached per period of
+    SEARCH_PLANNER["statistics_ttl"].
+    """
+    del period  # Only part of the cache key
+    frequencies = {}
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT attname, most_common_elems::text::text[], most_common_elem_freqs
+            FROM pg_stats
+            WHERE schemaname = current_schema() AND tablename = %s
+                AND attname IN ('tsFilename', 'tsContent')
+            """,
+            [File._meta.db_table],
+        )
+        rows = cursor.fetchall()
+
+    for column, elements, freqs in rows:
+        if elements:
+            # The element frequencies are followed by their minimum, maximum and nulls,
+            # lexemes missing from the list are rarer than the least common listed one
+            frequencies[column] = (dict(zip(elements, freqs)), freqs[len(elements)] / 2)
+    return frequencies
+
+
+def _column_selectivities(column: str, tokens: Sequence[str]) -> dict[str, float | None]:
+    """Selectivity of each token in a tsvector column, over the whole table."""
+    period = int(time.monotonic() // settings.SEARCH_PLANNER["statistics_ttl"])
+    frequencies = _table_statistics(period)
+    if column not in frequencies:
+        return dict.fromkeys(tokens)
+    common, rare = frequencies[column]
+    return {t: common.get(t, rare) for t in tokens}
+
+
+def _segment_selectivities(
+    user_id: int, lexemes: Sequence[str]
+) -> tuple[dict[str, float | None], int] | None:
+    """Selectivity of each lexeme in the user's segments, None without segments."""
+    segments = segment_index.get_segment_cache().open_user_segments(user_id)
+    if not segments or not segments[0].file_count:
+        return None
+    # Files reindexed since an older segment are counted twice, fine for an estimate
+    file_count = segments[0].file_count
+    return {
+        lexeme: min(
+            1.0, sum(s.document_frequency(lexeme) for s in segments) / file_count
+        )
+        for lexeme in lexemes
+    }, file_count
+
+
+def plan_query(
+    query_text: str, user: User, languages: tuple[str, ...] = (DEFAULT_LANGUAGE,)
+) -> QueryPlan:
+    """Plan candidate matching for a query of one user, analyzed in their languages."""
+    name_tokens = [t.lower() for t in (query_text or "").split() if t]
+    lexemes = list(content_lexemes(query_text, languages))
+    documents = user_corpus_statistics(user).documents
+
+    name_selectivities = _column_selectivities("tsFilename", name_tokens)
+    content_statistics = None
+    if settings.SEARCH_SEGMENTS["enabled"]:
+        content_statistics = _segment_selectivities(user.pk, lexemes)
+    if content_statistics is None:
+        content_statistics = _column_selectivities("tsContent", lexemes), documents
+    content_selectivities, content_documents = content_statistics
+
+    name = plan_tokens(name_tokens, name_selectivities, documents)
+    content = plan_tokens(lexemes, content_selectivities, content_documents)
+    return QueryPlan(
+        name=name,
+        content=content,
+        selectivity=combined_selectivity(
+            [name_selectivities[t] for t in name.match]
+            + [content_selectivities[t] for t in content.match]
+        ),
+        documents=documents,
+    )
+
+
+def planned_user_index(
+    plan: QueryPlan | None, user_id: int, version: int
+) -> UserIndex | None:
+    """
+    The user's in-memory index when the plan expects enough candidates to score from
+    it, like cached_user_index. Queries expected to match few files are left to the
+    database indexes, and do not start a build of a cold index.
+    """
+    if plan is not None and plan.selectivity is not None:
+        expected = plan.documents * plan.selectivity
+        if expected < settings.SEARCH_PLANNER["memory_min_candidates"]:
+            return None
+        index = get_memory_index_cache(settings.MEMORY_INDEX["budget_mb"]).get(
+            user_id, version
+        )
+        if index is not None:
+            return index
+    return cached_user_index(user_id, version)
@@ -0,0 +1,239 @@
+"""
+Per-user postings segments, enabled with SEARCH_SEGMENTS["enabled"].
+
+When a download pass finishes, DownloadBatch queues write_user_segment on the low
+cluster. It appends a segment with the files indexed since the user's newest segment
+and the files deleted since, and once the user has more than
+SEARCH_SEGMENTS["max_segments"] segments it compacts them into one.
+
+Content search reads the segments through per-process read-only maps instead of
+querying tsContent. Segments lag behind the database until the next pass finishes,
+files deleted in the meantime are dropped when the results are loaded.
+"""
+
+import os
+import shutil
+import threading
+from collections import defaultdict
+from functools import lru_cache
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Avg
+
+from repository.models import File
+from p7.search.content_ranking import get_query_bm25, get_query_ltc_norms
+from p7.search.languages import DEFAULT_LANGUAGE
+from p7.search.memory_index import content_lexemes
+from p7.search.segments import (
+    Segment,
+    dequantize_impact,
+    dequantize_weight,
+    live_doc_ids,
+    live_postings,
+    merge_segments,
+    quantized_postings,
+    segment_path,
+    segment_paths,
+    write_segment,
+)
+
+# Rows fetched per round trip while reading term frequencies
+READ_CHUNK_SIZE = 10_000
+
+
+def user_segment_directory(user_id: int) -> Path:
+    """Directory holding a user's segments."""
+    return Path(settings.SEARCH_SEGMENTS["directory"]) / str(user_id)
+
+
+class SegmentCache:
+    """
+    Open segments of the current process, keyed by path and inode.
+
+    A merge replaces a segment file under the same name, the inode tells the
+    versions apart. Maps of files that are no longer listed are closed.
+    """
+
+    def __init__(self):
+        self._segments: dict[tuple[Path, int], Segment] = {}
+        self._lock = threading.Lock()
+
+    def open_user_segments(self, user_id: int) -> list[Segment]:
+        """The user's segments, newest first."""
+        directory = user_segment_directory(user_id)
+        opened = []
+        with self._lock:
+            listed = set()
+            for path in segment_paths(directory):
+                try:
+                    key = (path, os.stat(path).st_ino)
+                    if key not in self._segments:
+                        self._segments[key] = Segment(path)
+                except FileNotFoundError:
+                    continue  # Removed by a merge since it was listed
+                except ValueError:
+                    continue  # Of an older format, replaced by the next write
+                listed.add(key)
+                opened.append(self._segments[key])
+
+            for key in [k for k in self._segments if k[0].parent == directory]:
+                if key not in listed:
+                    self._segments.pop(key).close()
+        return opened
+
+
+@lru_cache(maxsize=None)
+def get_segment_cache() -> SegmentCache:
+    """Return the segment cache of the current process, creating it on first use."""
+    return SegmentCache()
+
+
+def _term_frequencies(file_ids: list[int]) -> dict[int, dict[str, int]]:
+    """Term frequency of each content lexeme, as counted by ts_stat."""
+    frequencies: dict[int, dict[str, int]] = defaultdict(dict)
+    file_table = connection.ops.quote_name(File._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT f.id, t.lexeme, coalesce(array_length(t.positions, 1), 1)
+            FROM {file_table} AS f, unnest(f."tsContent") AS t
+            WHERE f.id = ANY(%s)
+            """,
+            [file_ids],
+        )
+        while rows := cursor.fetchmany(READ_CHUNK_SIZE):
+            for file_id, lexeme, tf in rows:
+                frequencies[file_id][lexeme] = tf
+    return frequencies
+
+
+def write_user_segment(user_id: int) -> int:
+    """
+    Write a segment with the user's files indexed or deleted since the newest segment,
+    then merge the user's segments if there are too many.
+
+    Files are picked by their contentVersion, which increases in commit order per
+    user. A file whose content is committed after the segment's files were read has a
+    higher contentVersion than all of them, and is picked by the next segment.
+
+    returns:
+        The number of files the new segment covers, 0 when nothing changed.
+    """
+    directory = user_segment_directory(user_id)
+    segments = get_segment_cache().open_user_segments(user_id)
+    if not segments:
+        # Leftovers that could not be read, e.g. of an older format, are replaced
+        shutil.rmtree(directory, ignore_errors=True)
+
+    user_files = File.objects.filter(serviceId__userId=user_id)
+    if segments:
+        indexed = user_files.filter(contentVersion__gt=segments[0].watermark)
+    else:
+        # Files indexed before contentVersion existed have none
+        indexed = user_files.filter(indexedAt__isnull=False)
+    file_ids = set(user_files.values_list("id", flat=True))
+    deleted_ids = live_doc_ids(segments) - file_ids
+    changed = {
+        file_id: (content_version, content_length)
+        for file_id, content_version, content_length in indexed.values_list(
+            "id", "contentVersion", "contentLength"
+        )
+    }
+    if not changed and not deleted_ids:
+        return 0
+
+    watermark = segments[0].watermark if segments else 0.0
+    postings = {}
+    if changed:
+        watermark = max(
+            [watermark] + [version for version, _ in changed.values() if version is not None]
+        )
+        postings = quantized_postings(
+            _term_frequencies(list(changed)),
+            {file_id: length for file_id, (_, length) in changed.items()},
+            user_files.aggregate(average=Avg("contentLength"))["average"],
+        )
+    directory.mkdir(parents=True, exist_ok=True)
+    generation = segments[0].generation + 1 if segments else 1
+    write_segment(
+        segment_path(directory, generation),
+        postings,
+        changed,
+        deleted_ids,
+        file_count=len(file_ids),
+        watermark=watermark,
+    )
+
+    if len(segments) + 1 > settings.SEARCH_SEGMENTS["max_segments"]:
+        merge_user_segments(user_id)
+    return len(changed) + len(deleted_ids)
+
+
+def merge_user_segments(user_id: int) -> int:
+    """
+    Compact all of a user's segments into one, named after the newest of them.
+
+    returns:
+        The number of segments merged.
+    """
+    segments = get_segment_cache().open_user_segments(user_id)
+    if len(segments) < 2:
+        return 0
+
+    # Replacing the newest segment keeps generations increasing for later writes
+    merge_segments(segments, segments[0].path)
+    for segment in segments[1:]:
+        segment.path.unlink(missing_ok=True)
+    get_segment_cache().open_user_segments(user_id)  # Close the merged inputs
+    return len(segments)
+
+
+def remove_user_segments(user_id: int) -> None:
+    """Delete a user's segments, e.g. when the user is deleted."""
+    shutil.rmtree(user_segment_directory(user_id), ignore_errors=True)
+    get_segment_cache().open_user_segments(user_id)
+
+
+def ranking_based_on_content(
+    user_id: int,
+    query_text: str,
+    ranking: str = "tfidf",
+    languages: tuple[str, ...] = (DEFAULT_LANGUAGE,),
+) -> list[File] | None:
+    """
+    Files ranked like FileQuerySet.ranking_based_on_content, scored from segments.
+
+    Weights are quantized to a byte, so tf-idf scores match SQL to about 0.2%. BM25
+    impacts also keep the average length from when their segment was written.
+
+    returns:
+        The ranked files, or None when the user has no segments yet.
+    """
+    segments = get_segment_cache().open_user_segments(user_id)
+    if not segments:
+        return None
+
+    tokens = list(content_lexemes(query_text, languages))
+    if not tokens:
+        return []
+
+    postings = live_postings(segments, tokens)
+    document_frequencies = [(token, len(files)) for token, files in postings.items() if files]
+    scores: dict[int, float] = defaultdict(float)
+    if ranking == "bm25":
+        query_bm25 = get_query_bm25(segments[0].file_count, tokens, document_frequencies)
+        for token, weight in query_bm25.items():
+            for file_id, (_, impact) in postings[token].items():
+                scores[file_id] += weight * dequantize_impact(impact)
+    else:
+        query_ltc = get_query_ltc_norms(segments[0].file_count, tokens, document_frequencies)
+        for token, norm in query_ltc.items():
+            for file_id, (weight, _) in postings[token].items():
+                scores[file_id] += norm * dequantize_weight(weight)
+
+    files = list(File.objects.filter(pk__in=list(scores), serviceId__userId=user_id))
+    for file in files:
+        file.rank = scores[file.id]
+    return files
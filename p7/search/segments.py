@@ -0,0 +1,391 @@
+"""
+Immutable on-disk postings of a user's file contents, see p7/search/segment_index.py.
+
+A segment covers a set of files. For each of them it stores the lnc weight and the
+BM25 impact of every content lexeme, each quantized to a byte, so scoring a file is a
+sum of stored weights and needs no document lengths.
+Segments are read through a read-only mmap: gunicorn workers mapping the same file
+share one copy in the page cache, and postings are decoded straight from the map.
+
+Layout, little endian:
+
+    header      magic, version, counts, user file count, watermark, section offsets
+    docs        ids of the files the segment covers, varint deltas
+    deletes     ids of files deleted since the previous segment, varint deltas
+    terms       one fixed size entry per term, sorted by term
+    term pool   the terms, utf-8
+    postings    per term: (file id varint delta, lnc byte, BM25 byte), ascending ids
+
+A file is described by the newest segment covering it (in docs or deletes),
+older segments are shadowed for it until a merge drops them. BM25 impacts use the
+user's average document length when their segment was written, a merge keeps them.
+"""
+
+from math import log10
+import mmap
+import os
+from pathlib import Path
+import struct
+from typing import Iterable, Iterator, NamedTuple
+
+from p7.search.content_ranking import BM25_K1, bm25_impact
+
+MAGIC = b"P7SG"
+FORMAT_VERSION = 3
+SEGMENT_SUFFIX = ".seg"
+
+# Weights are in (0, 1], stored as 1..WEIGHT_LEVELS
+WEIGHT_LEVELS = 255
+
+# magic, version, reserved, docs, deletes, terms, user files, watermark, 5 offsets
+_HEADER = struct.Struct("<4sHHIIIId5Q")
+# term offset, term length, document frequency, postings offset, postings length
+_TERM = struct.Struct("<5I")
+
+# term -> file id -> (quantized lnc weight, quantized BM25 impact)
+Postings = dict[str, dict[int, tuple[int, int]]]
+
+
+class SegmentHeader(NamedTuple):
+    """The fields of _HEADER."""
+
+    magic: bytes
+    version: int
+    reserved: int
+    doc_count: int
+    delete_count: int
+    term_count: int
+    file_count: int
+    watermark: float
+    docs_offset: int
+    deletes_offset: int
+    terms_offset: int
+    pool_offset: int
+    postings_offset: int
+
+
+def quantize_weight(weight: float) -> int:
+    """A weight in (0, 1] as a byte, never 0 so every posting keeps a score."""
+    return min(WEIGHT_LEVELS, max(1, round(weight * WEIGHT_LEVELS)))
+
+
+def dequantize_weight(level: int) -> float:
+    """The weight a stored byte stands for."""
+    return level / WEIGHT_LEVELS
+
+
+def dequantize_impact(level: int) -> float:
+    """The BM25 impact a stored byte stands for, impacts are below BM25_K1 + 1."""
+    return level / WEIGHT_LEVELS * (BM25_K1 + 1)
+
+
+def encode_varint(value: int, out: bytearray) -> None:
+    """Append an unsigned integer, 7 bits per byte, high bit set on all but the last."""
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def decode_varint(buffer, offset: int) -> tuple[int, int]:
+    """The integer at offset and the offset after it."""
+    value = shift = 0
+    while True:
+        byte = buffer[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def encode_ids(ids: Iterable[int]) -> bytes:
+    """Sorted ids as varint deltas."""
+    out = bytearray()
+    previous = 0
+    for file_id in sorted(ids):
+        encode_varint(file_id - previous, out)
+        previous = file_id
+    return bytes(out)
+
+
+def decode_ids(buffer) -> Iterator[int]:
+    """The ids of encode_ids, read from any buffer without copying it."""
+    offset = file_id = 0
+    while offset < len(buffer):
+        delta, offset = decode_varint(buffer, offset)
+        file_id += delta
+        yield file_id
+
+
+def quantized_postings(
+    term_frequencies: dict[int, dict[str, int]],
+    document_lengths: dict[int, int | None] | None = None,
+    average_length: float | None = None,
+) -> Postings:
+    """
+    Quantized lnc weights, like get_document_lnc_norms, and BM25 impacts from term frequencies.
+
+    Args:
+        term_frequencies: file id -> lexeme -> term frequency.
+        document_lengths: file id -> contentLength, for BM25.
+        average_length: The user's average contentLength, for BM25.
+    Returns:
+        Postings: lexeme -> file id -> (quantized weight, quantized impact).
+    """
+    document_lengths = document_lengths or {}
+    postings: Postings = {}
+    for file_id, frequencies in term_frequencies.items():
+        weights = {term: 1 + log10(tf) for term, tf in frequencies.items() if tf > 0}
+        length = sum(w * w for w in weights.values()) ** 0.5
+        for term, weight in weights.items():
+            impact = bm25_impact(
+                frequencies[term], document_lengths.get(file_id), average_length
+            )
+            postings.setdefault(term, {})[file_id] = (
+                quantize_weight(weight / length),
+                quantize_weight(impact / (BM25_K1 + 1)),
+            )
+    return postings
+
+
+def write_segment(
+    path: Path,
+    postings: Postings,
+    doc_ids: Iterable[int],
+    deleted_ids: Iterable[int] = (),
+    file_count: int = 0,
+    watermark: float = 0.0,
+) -> None:
+    """
+    Write a segment file atomically, readers see either no file or the whole segment.
+
+    Args:
+        path: Destination of the segment.
+        postings: lexeme -> file id -> quantized weights, for files in doc_ids.
+        doc_ids: Files the segment covers, including files without content.
+        deleted_ids: Files deleted since the previous segment.
+        file_count: Number of files of the user when the segment was written.
+        watermark: Highest contentVersion of the files the segment covers.
+    """
+    doc_ids = set(doc_ids)
+    deleted_ids = set(deleted_ids) - doc_ids
+    docs = encode_ids(doc_ids)
+    deletes = encode_ids(deleted_ids)
+
+    entries = bytearray()
+    pool = bytearray()
+    blocks = bytearray()
+    terms = sorted(term for term, files in postings.items() if files)
+    for term in terms:
+        encoded_term = term.encode("utf-8")
+        block_start = len(blocks)
+        previous = 0
+        for file_id in sorted(postings[term]):
+            encode_varint(file_id - previous, blocks)
+            blocks.extend(postings[term][file_id])
+            previous = file_id
+        entries += _TERM.pack(
+            len(pool), len(encoded_term), len(postings[term]),
+            block_start, len(blocks) - block_start,
+        )
+        pool += encoded_term
+
+    docs_offset = _HEADER.size
+    deletes_offset = docs_offset + len(docs)
+    terms_offset = deletes_offset + len(deletes)
+    pool_offset = terms_offset + len(entries)
+    postings_offset = pool_offset + len(pool)
+    header = _HEADER.pack(
+        MAGIC, FORMAT_VERSION, 0, len(doc_ids), len(deleted_ids), len(terms),
+        file_count, watermark,
+        docs_offset, deletes_offset, terms_offset, pool_offset, postings_offset,
+    )
+
+    path = Path(path)
+    temporary = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(temporary, "wb") as handle:
+        for part in (header, docs, deletes, entries, pool, blocks):
+            handle.write(part)
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(temporary, path)
+
+
+class Segment:
+    """A segment file mapped read-only."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with open(self.path, "rb") as handle:
+            self._map = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+
+        if len(self._view) < _HEADER.size:
+            self.close()
+            raise ValueError(f"Not a segment: {self.path}")
+        self.header = SegmentHeader(*_HEADER.unpack_from(self._view))
+        if self.header.magic != MAGIC or self.header.version != FORMAT_VERSION:
+            self.close()
+            raise ValueError(f"Not a version {FORMAT_VERSION} segment: {self.path}")
+
+        self._docs = self._view[self.header.docs_offset:self.header.deletes_offset]
+        self._deletes = self._view[self.header.deletes_offset:self.header.terms_offset]
+
+    @property
+    def file_count(self) -> int:
+        """Number of files of the user when the segment was written."""
+        return self.header.file_count
+
+    @property
+    def watermark(self) -> float:
+        """Highest contentVersion of the files the segment covers."""
+        return self.header.watermark
+
+    @property
+    def generation(self) -> int:
+        """Segments are named after their generation, newer segments are higher."""
+        return int(self.path.stem)
+
+    def doc_ids(self) -> Iterator[int]:
+        """Ids of the files the segment covers."""
+        return decode_ids(self._docs)
+
+    def deleted_ids(self) -> Iterator[int]:
+        """Ids of the files the segment marks as deleted."""
+        return decode_ids(self._deletes)
+
+    def _entry(self, index: int) -> tuple[int, int, int, int, int]:
+        return _TERM.unpack_from(self._view, self.header.terms_offset + index * _TERM.size)
+
+    def _term(self, entry: tuple[int, int, int, int, int]) -> bytes:
+        start = self.header.pool_offset + entry[0]
+        return self._map[start:start + entry[1]]
+
+    def _find(self, term: bytes) -> tuple[int, int, int, int, int] | None:
+        """Binary search of the term dictionary."""
+        low, high = 0, self.header.term_count
+        while low < high:
+            middle = (low + high) // 2
+            entry = self._entry(middle)
+            found = self._term(entry)
+            if found == term:
+                return entry
+            if found < term:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def document_frequency(self, term: str) -> int:
+        """Number of postings of a term in this segment, shadowed ones included."""
+        entry = self._find(term.encode("utf-8"))
+        return entry[2] if entry else 0
+
+    def postings(self, term: str) -> Iterator[tuple[int, tuple[int, int]]]:
+        """(file id, (quantized weight, quantized impact)) of a term, in ascending file id."""
+        entry = self._find(term.encode("utf-8"))
+        if entry is None:
+            return iter(())
+        return self._decode_postings(entry)
+
+    def _decode_postings(self, entry) -> Iterator[tuple[int, tuple[int, int]]]:
+        start = self.header.postings_offset + entry[3]
+        block = self._view[start:start + entry[4]]
+        offset = file_id = 0
+        while offset < len(block):
+            delta, offset = decode_varint(block, offset)
+            file_id += delta
+            yield file_id, (block[offset], block[offset + 1])
+            offset += 2
+
+    def terms(self) -> Iterator[str]:
+        """All terms of the segment in sorted order."""
+        for index in range(self.header.term_count):
+            yield self._term(self._entry(index)).decode("utf-8")
+
+    def close(self) -> None:
+        """Unmap the file. Postings still being iterated keep the map alive instead."""
+        for view in (getattr(self, "_docs", None), getattr(self, "_deletes", None), self._view):
+            if view is not None:
+                view.release()
+        try:
+            self._map.close()
+        except BufferError:
+            pass
+
+
+def _shadowing(segments: list[Segment]) -> Iterator[tuple[Segment, set[int]]]:
+    """
+    Each segment, newest first, with the ids described by newer segments.
+    The oldest segment's own ids are never decoded.
+    """
+    shadowed: set[int] = set()
+    for position, segment in enumerate(segments):
+        yield segment, shadowed
+        if position + 1 < len(segments):
+            shadowed = shadowed | set(segment.doc_ids()) | set(segment.deleted_ids())
+
+
+def live_doc_ids(segments: list[Segment]) -> set[int]:
+    """Ids of the files covered by segments (newest first) and not deleted since."""
+    live: set[int] = set()
+    deleted: set[int] = set()
+    for segment in segments:
+        live.update(file_id for file_id in segment.doc_ids() if file_id not in deleted)
+        deleted.update(segment.deleted_ids())
+        deleted.update(live)
+    return live
+
+
+def live_postings(segments: list[Segment], terms: Iterable[str]) -> Postings:
+    """
+    Postings of the given terms across segments (newest first), older entries of a
+    file replaced by its newest segment.
+    """
+    terms = set(terms)
+    postings: Postings = {term: {} for term in terms}
+    for segment, shadowed in _shadowing(segments):
+        for term in terms:
+            matching = postings[term]
+            for file_id, levels in segment.postings(term):
+                if file_id not in shadowed:
+                    matching[file_id] = levels
+    return postings
+
+
+def merge_segments(segments: list[Segment], path: Path) -> None:
+    """
+    Compact segments (newest first) into one segment at path.
+
+    Only live postings are kept and deletions are dropped, the merged segment replaces
+    all its inputs. It keeps the user file count and watermark of the newest input.
+    """
+    terms = set()
+    for segment in segments:
+        terms.update(segment.terms())
+    postings = live_postings(segments, terms)
+    write_segment(
+        path,
+        postings,
+        live_doc_ids(segments),
+        file_count=segments[0].file_count,
+        watermark=segments[0].watermark,
+    )
+
+
+def segment_paths(directory: Path) -> list[Path]:
+    """Segment files of a directory, newest generation first."""
+    if not os.path.isdir(directory):
+        return []
+    paths = [
+        Path(directory) / name
+        for name in os.listdir(directory)
+        if name.endswith(SEGMENT_SUFFIX) and name[:-len(SEGMENT_SUFFIX)].isdigit()
+    ]
+    return sorted(paths, key=lambda path: int(path.stem), reverse=True)
+
+
+def segment_path(directory: Path, generation: int) -> Path:
+    """Path of the segment of a generation."""
+    return Path(directory) / f"{generation:010d}{SEGMENT_SUFFIX}"
@@ -15,6 +15,8 @@ import multiprocessing
 import os
 from pathlib import Path
 
+from p7.database.pool import connection_settings, process_role
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -76,8 +78,21 @@ MIDDLEWARE = [
     #'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     "corsheaders.middleware.CorsMiddleware",
+    # Removes itself unless PROFILING["enabled"]
+    "p7.profiling.middleware.ProfilingMiddleware",
 ]
 
+# Request profiling, see p7/profiling
+# enabled: add Server-Timing headers and a JSON log line per request under paths
+# cprofile_sample_rate: share of profiled requests also run under cProfile
+# cprofile_dir: where cProfile stats are dumped, logged instead when unset
+PROFILING = {
+    'enabled': os.getenv("PROFILING_ENABLED") == 'True',
+    'paths': ["/api/search/"],
+    'cprofile_sample_rate': float(os.getenv("PROFILING_CPROFILE_SAMPLE_RATE", "0")),
+    'cprofile_dir': os.getenv("PROFILING_CPROFILE_DIR"),
+}
+
 # CORS: allow Next.js origins
 ALLOWED_HOSTS = [
     "localhost", 
@@ -140,6 +155,12 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'p7.wsgi.application'
+ASGI_APPLICATION = 'p7.asgi.application'
+
+# Serve the async versions of the search, find_service and sync_files endpoints.
+# Set when running under ASGI (gunicorn.asgi.conf.py), under WSGI every async view
+# would need its own event loop.
+ASYNC_ENDPOINTS = os.getenv("ASYNC_ENDPOINTS") == 'True'
 
 
 # Database
@@ -153,6 +174,9 @@ DATABASES = {
         "PASSWORD": os.getenv("DATABASE_PASSWORD"),
         "HOST": os.getenv("DATABASE_HOST"),
         "PORT": os.getenv("DATABASE_PORT"),
+        # Connection reuse per process role, see p7/database/pool.py
+        # DATABASE_POOL_MODE: none, persistent, pool (psycopg 3) or pgbouncer
+        **connection_settings(process_role(os.environ), os.environ),
     }
 }
 # DJANGO_Q database config. Docs: https://django-q2.readthedocs.io/en/master/configure.html
@@ -178,6 +202,78 @@ Q_CLUSTER = {
    }
 }
 
+# Fair-share scheduling of provider tasks on top of django-q, see repository/queue.py
+# max_running_per_user: jobs one user may run at once across all clusters
+# download_batch_size: files downloaded per task before the rest is re-queued
+# download_batch_seconds: time budget per download task before the rest is re-queued
+# job_lease_seconds: a running job whose lease is not renewed for this long is released,
+#   download_batch_seconds plus a margin. A heartbeat renews it while the job runs.
+TASK_SCHEDULER = {
+    'max_running_per_user': int(os.getenv("TASK_MAX_RUNNING_PER_USER", "2")),
+    'download_batch_size': int(os.getenv("DOWNLOAD_BATCH_SIZE", "200")),
+    'download_batch_seconds': int(os.getenv("DOWNLOAD_BATCH_SECONDS", "600")),
+    'job_lease_seconds': int(os.getenv("JOB_LEASE_SECONDS", "900")),
+    # Jobs running at once per cluster, on top of its worker count
+    'max_running_per_cluster': {
+        'low': int(os.getenv("LOW_CLUSTER_MAX_RUNNING", "2")),
+    },
+}
+
+# Periodic service syncs, see p7/sync_files/planner.py
+# Intervals in seconds: shortened while syncs find changes, lengthened while they do not
+SYNC_PLANNER = {
+    'min_interval': int(os.getenv("SYNC_MIN_INTERVAL", str(60 * 60))),
+    'default_interval': int(os.getenv("SYNC_DEFAULT_INTERVAL", str(24 * 60 * 60))),
+    'max_interval': int(os.getenv("SYNC_MAX_INTERVAL", str(7 * 24 * 60 * 60))),
+}
+
+# Content ranking of searches that do not choose one, "tfidf" or "bm25"
+SEARCH_RANKING = os.getenv("SEARCH_RANKING", "tfidf")
+
+# In-process search index per user, see p7/search/memory_index.py
+# enabled: let query_files answer from memory for users whose index is warm
+# budget_mb: estimated memory all indexes of a process may use, LRU evicted
+# build_in_background: build cold indexes in a thread while SQL answers the search
+MEMORY_INDEX = {
+    'enabled': os.getenv("MEMORY_INDEX_ENABLED") == 'True',
+    'budget_mb': int(os.getenv("MEMORY_INDEX_BUDGET_MB", "256")),
+    'build_in_background': True,
+}
+
+# On-disk postings segments per user, see p7/search/segment_index.py
+# enabled: write segments after download passes and score content search from them
+# directory: where segments are stored, shared by all workers of a host
+# max_segments: segments a user may have before they are merged into one
+SEARCH_SEGMENTS = {
+    'enabled': os.getenv("SEARCH_SEGMENTS_ENABLED") == 'True',
+    'directory': os.getenv("SEARCH_SEGMENTS_DIR", str(BASE_DIR / "segments")),
+    'max_segments': int(os.getenv("SEARCH_SEGMENTS_MAX", "8")),
+}
+
+# Query planning of query_files, see p7/search/planner.py
+# enabled: plan candidate matching from stored document frequencies
+# drop_selectivity: share of files above which a token no longer matches candidates
+# min_documents: files a user needs before any token is dropped as too common
+# min_results: files matching all tokens below which any token matches
+# memory_min_candidates: expected candidates below which the in-memory index is skipped
+# statistics_ttl: seconds the column statistics of PostgreSQL are cached
+SEARCH_PLANNER = {
+    'enabled': os.getenv("SEARCH_PLANNER_ENABLED", "True") == 'True',
+    'drop_selectivity': float(os.getenv("SEARCH_PLANNER_DROP_SELECTIVITY", "0.5")),
+    'min_documents': 1000,
+    'min_results': int(os.getenv("SEARCH_PLANNER_MIN_RESULTS", "10")),
+    'memory_min_candidates': int(os.getenv("SEARCH_PLANNER_MEMORY_MIN_CANDIDATES", "500")),
+    'statistics_ttl': 300,
+}
+
+# Text extraction of downloaded files, see p7/extract_file_content
+# isolated: run parsers in a subprocess with per-format time, CPU and memory limits
+# max_tasks_per_worker: files extracted before the subprocess is replaced
+FILE_EXTRACTION = {
+    'isolated': os.getenv("FILE_EXTRACTION_ISOLATED", "True") == 'True',
+    'max_tasks_per_worker': int(os.getenv("FILE_EXTRACTION_MAX_TASKS", "100")),
+}
+
 
 
 
@@ -225,6 +321,11 @@ MEDIA_ROOT = BASE_DIR / "media"
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 PGCRYPTO_KEY = "your-very-secret-key"
+# Secret of the blind indexes stored next to encrypted values that are looked up,
+# such as File.serviceFileIdHash. Their HMAC key is derived from it with HKDF, so
+# falling back to SECRET_KEY does not reuse that key. Changing it is safe: the
+# hashes of a service are recomputed on its next sync, see hash_service_file_ids.
+BLIND_INDEX_KEY = os.getenv("BLIND_INDEX_KEY") or SECRET_KEY
 # https://docs.djangoproject.com/en/5.2/ref/settings/#std-setting-MIGRATION_MODULES
 """ MIGRATION_MODULES = {
     "repository": None,             # <- Name for repo we should not create migrations for
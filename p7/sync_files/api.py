@@ -1,10 +1,11 @@
 """API for syncing files from all services for a user."""
 
+from asgiref.sync import sync_to_async
 from ninja import Router, Header
 from django.http import JsonResponse
-from django_q.tasks import async_task
-from repository.service import get_service
-from repository.user import get_user
+from repository.queue import submit_task
+from repository.service import aget_user_service_names, get_service
+from repository.user import aget_user, get_user
 from p7.helpers import validate_internal_auth
 from p7.sync_files.service_sync_functions import (
     sync_dropbox_files,
@@ -13,6 +14,14 @@ from p7.sync_files.service_sync_functions import (
 )
 
 sync_files_router = Router()
+async_sync_files_router = Router()
+
+# Service name, sync task and django-q group prefix of each provider
+SYNC_TASKS = (
+    ("dropbox", sync_dropbox_files, "Dropbox"),
+    ("google", sync_google_drive_files, "Google-Drive"),
+    ("onedrive", sync_onedrive_files, "Onedrive"),
+)
 
 
 @sync_files_router.get("/")
@@ -34,34 +43,52 @@ def sync_files(
     if isinstance(user, JsonResponse):
         return user
 
-    dropbox_service = get_service(user_id, "dropbox")
-    google_drive_service = get_service(user_id, "google")
-    onedrive_service = get_service(user_id, "onedrive")
+    for service_name, sync_task, group_prefix in SYNC_TASKS:
+        service = get_service(user_id, service_name)
+        # Check if services exist before syncing
+        if service and not isinstance(service, JsonResponse):
+            submit_task(
+                sync_task,
+                user_id,
+                priority="high",
+                cluster="high",
+                group=f"{group_prefix}-{user_id}"
+            )
+
+    return JsonResponse({"Status": "Processing"}, status=202)
+
+
+@async_sync_files_router.get("/")
+async def sync_files_async(
+    request,
+    user_id: str,
+    x_internal_auth: str = Header(..., alias="x-internal-auth"),
+):
+    """Async version of sync_files, served when ASYNC_ENDPOINTS is set.
+    params:
+        x_internal_auth (str): The internal auth header for validating the request.
+        user_id (str): The ID of the user whose files are to be synced.
+    """
+    auth_resp = validate_internal_auth(x_internal_auth)
+    if auth_resp:
+        return auth_resp
+
+    user = await aget_user(user_id)
+    if isinstance(user, JsonResponse):
+        return user
+
+    # One query for all of the user's services instead of one per provider
+    service_names = set((await aget_user_service_names(user_id)).values())
 
-    # Check if services exist before syncing
-    if dropbox_service and not isinstance(dropbox_service, JsonResponse):
-        async_task(
-            sync_dropbox_files,
-            user_id,
-            priority="high",
-            cluster="high",
-            group=f"Dropbox-{user_id}"
-        )
-    if google_drive_service and not isinstance(google_drive_service, JsonResponse):
-        async_task(
-            sync_google_drive_files,
-            user_id,
-            priority="high",
-            cluster="high",
-            group=f"Google-Drive-{user_id}"
+    for service_name, sync_task, group_prefix in SYNC_TASKS:
+        if service_name in service_names:
+            # Queueing takes the scheduler lock in a transaction, so it runs in a thread
+            await sync_to_async(submit_task)(
+                sync_task,
+                user_id,
+                priority="high",
+                cluster="high",
+                group=f"{group_prefix}-{user_id}"
             )
-    if onedrive_service and not isinstance(onedrive_service, JsonResponse):
-        async_task(
-            sync_onedrive_files,
-            user_id,
-            priority="high",
-            cluster="high",
-            group=f"Onedrive-{user_id}"
-        )
 
     return JsonResponse({"Status": "Processing"}, status=202)
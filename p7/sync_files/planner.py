@@ -0,0 +1,144 @@
+"""Planning of periodic service syncs.
+
+Every service gets a django-q schedule that queues its sync through the fair
+scheduler. Instead of firing exactly 24 hours after the service was created, runs
+are placed on a per-service slot derived from a hash of the schedule name, so
+services created in the same minute are spread over the whole interval. The
+interval itself adapts to how often the service changes: it shrinks while syncs
+find changes and grows while they find none.
+
+One more schedule dispatches the pending jobs of the fair scheduler every minute,
+so jobs queued behind ones left running by a killed worker start once their lease
+runs out, instead of waiting for the next submit.
+"""
+
+import hashlib
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.utils import timezone
+from django_q.models import Schedule
+from django_q.tasks import schedule
+
+from repository.models import Service
+
+# Name of the schedule created by schedule_task_dispatch
+DISPATCH_SCHEDULE = "dispatch-tasks"
+
+
+def sync_slot_offset(group: str, interval: int) -> int:
+    """
+    A stable offset in seconds within the interval for a schedule.
+
+    params:
+        group: The schedule name, e.g. "Dropbox-{user_id}".
+        interval: The sync interval in seconds.
+    """
+    digest = hashlib.sha1(group.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % interval
+
+
+def next_sync_time(group: str, interval: int, now: datetime | None = None) -> datetime:
+    """
+    The first slot of the schedule at least half an interval from now.
+    Slots are aligned to the epoch, so each service keeps its own time of day.
+
+    params:
+        group: The schedule name.
+        interval: The sync interval in seconds.
+        now: The current time, defaults to timezone.now().
+    """
+    now = now or timezone.now()
+    offset = sync_slot_offset(group, interval)
+    earliest = int(now.timestamp()) + interval // 2
+    slot = earliest - (earliest - offset) % interval
+    if slot < earliest:
+        slot += interval
+    return datetime.fromtimestamp(slot, tz=now.tzinfo or dt_timezone.utc)
+
+
+def adapt_sync_interval(interval: int, changed_files: int) -> int:
+    """
+    The next sync interval given the number of files the last sync found changed.
+    Halved while changes are found, doubled while none are, within the configured bounds.
+    """
+    if changed_files:
+        interval //= 2
+    else:
+        interval *= 2
+    return max(
+        settings.SYNC_PLANNER["min_interval"],
+        min(settings.SYNC_PLANNER["max_interval"], interval),
+    )
+
+
+def schedule_service_sync(func: str, user_id, group: str) -> Schedule:
+    """
+    Create the periodic sync schedule for a new service.
+    Raises IntegrityError if the service is already scheduled.
+
+    params:
+        func: Dotted path of the sync function.
+        user_id: The ID of the user who owns the service.
+        group: The task group of the service, also used as the schedule name.
+    """
+    interval = settings.SYNC_PLANNER["default_interval"]
+    # Pass the callable as a dotted path string so the django-q worker can resolve it.
+    # The schedule queues the sync through submit_task, so it is coalesced with
+    # syncs already queued for this service.
+    return schedule(
+        "repository.queue.submit_scheduled_task",
+        func,
+        schedule_type=Schedule.MINUTES,
+        minutes=interval // 60,
+        name=group,
+        group=group,
+        user_id=user_id,
+        priority="low",
+        cluster="low",
+        next_run=next_sync_time(group, interval),
+    )
+
+
+def schedule_task_dispatch() -> Schedule:
+    """
+    Create or update the schedule running repository.queue.dispatch_all_clusters
+    every minute. Called after migrations, so every deployment has it.
+    """
+    dispatch, _ = Schedule.objects.update_or_create(
+        name=DISPATCH_SCHEDULE,
+        defaults={
+            "func": "repository.queue.dispatch_all_clusters",
+            "schedule_type": Schedule.MINUTES,
+            "minutes": 1,
+            "repeats": -1,
+        },
+    )
+    return dispatch
+
+
+def plan_next_sync(service: Service, changed_files: int, group: str) -> int:
+    """
+    Adapt a service's sync interval to the changes found by a sync and move its
+    schedule to the next slot.
+
+    params:
+        service: The synced service.
+        changed_files: Number of new or modified files found by the sync.
+        group: The task group of the service, also the schedule name.
+    returns:
+        The new interval in seconds.
+    """
+    interval = adapt_sync_interval(
+        service.syncInterval or settings.SYNC_PLANNER["default_interval"],
+        changed_files,
+    )
+    service.syncInterval = interval
+    Service.objects.filter(pk=service.pk).update(syncInterval=interval)
+
+    Schedule.objects.filter(name=group).update(
+        schedule_type=Schedule.MINUTES,
+        minutes=interval // 60,
+        next_run=next_sync_time(group, interval),
+    )
+    return interval
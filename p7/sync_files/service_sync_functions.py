@@ -4,7 +4,6 @@ import os
 from datetime import datetime, timezone
 
 from django.http import JsonResponse
-from django_q.tasks import async_task
 
 # Google libs
 from google.oauth2.credentials import Credentials
@@ -13,8 +12,11 @@ from googleapiclient.discovery import build
 # Microsoft libs
 import msal
 from repository.service import get_tokens, get_service
-from repository.file import get_files_by_service
+from repository.file import delete_file, get_files_missing_from_service
 from repository.user import get_user
+from repository.queue import submit_task
+from p7.metrics.helpers import FILES_LISTED
+from p7.sync_files.planner import plan_next_sync
 
 from p7.get_dropbox_files.helper import (
     update_or_create_file as update_or_create_file_dropbox,
@@ -67,6 +69,7 @@ def sync_dropbox_files(
             access_token_expiration,
             refresh_token,
         )
+        FILES_LISTED.labels("dropbox").inc(len(files))
         updated_files = []
         for file in files:
             if file[".tag"] != "file":
@@ -91,15 +94,16 @@ def sync_dropbox_files(
         service.indexedAt = indexing_time
         service.save(update_fields=["indexedAt"])
 
-        dropbox_files = get_files_by_service(service)
+        # Stored files missing from the fetched files have been deleted in Dropbox
+        for dropbox_file in get_files_missing_from_service(
+            service, (file["id"] for file in files)
+        ):
+            delete_file(dropbox_file)
 
-        for dropbox_file in dropbox_files:
-            # Checks if any of the fetched files match the serviceFileId of the stored file
-            # If not, it means the file has been deleted in Dropbox
-            if not any(file["id"] == dropbox_file.serviceFileId for file in files):
-                dropbox_file.delete()
+        # Sync sooner or later next time, depending on how much changed
+        plan_next_sync(service, len(updated_files), f"Dropbox-{user_id}")
 
-        async_task(
+        submit_task(
             process_download_dropbox_files,
             user_id,
             cluster=priority,
@@ -162,6 +166,7 @@ def sync_google_drive_files(
             creds,
             refresh_token,
         )
+        FILES_LISTED.labels("google").inc(len(files))
 
         # Build a fast lookup for any item (files + folders)
         file_by_id = {file["id"]: file for file in files}
@@ -201,20 +206,17 @@ def sync_google_drive_files(
         service.indexedAt = indexing_time
         service.save(update_fields=["indexedAt"])
 
-        google_drive_files = get_files_by_service(service)
-
-        for google_drive_file in google_drive_files:
-            # Checks if any of the fetched files match the serviceFileId of the stored file
-            # If not, it means the file has been deleted in Google Drive
-            if not any(file["id"] == google_drive_file.serviceFileId for file in files):
-                google_drive_file.delete()
-                continue
-            if any(
-                file["id"] == google_drive_file.serviceFileId for file in trashed_files
-            ):
-                google_drive_file.delete()
-                continue
-        async_task(
+        # Stored files missing from the fetched files, or trashed, have been deleted
+        # in Google Drive
+        trashed_ids = {file["id"] for file in trashed_files}
+        for google_drive_file in get_files_missing_from_service(
+            service, (file["id"] for file in files if file["id"] not in trashed_ids)
+        ):
+            delete_file(google_drive_file)
+        # Sync sooner or later next time, depending on how much changed
+        plan_next_sync(service, len(updated_files), f"Google-Drive-{user_id}")
+
+        submit_task(
             process_download_google_drive_files,
             user_id,
             cluster=priority,
@@ -260,6 +262,7 @@ def sync_onedrive_files(
             access_token_expiration,
             refresh_token,
         )
+        FILES_LISTED.labels("onedrive").inc(len(files))
 
         updated_files = []
         for file in files:
@@ -281,15 +284,16 @@ def sync_onedrive_files(
         service.indexedAt = indexing_time
         service.save(update_fields=["indexedAt"])
 
-        onedrive_files = get_files_by_service(service)
+        # Stored files missing from the fetched files have been deleted in Onedrive
+        for onedrive_file in get_files_missing_from_service(
+            service, (file["id"] for file in files)
+        ):
+            delete_file(onedrive_file)
 
-        for onedrive_file in onedrive_files:
-            # Checks if any of the fetched files match the serviceFileId of the stored file
-            # If not, it means the file has been deleted in Onedrive
-            if not any(file["id"] == onedrive_file.serviceFileId for file in files):
-                onedrive_file.delete()
+        # Sync sooner or later next time, depending on how much changed
+        plan_next_sync(service, len(updated_files), f"Onedrive-{user_id}")
 
-        async_task(
+        submit_task(
             process_download_onedrive_files,
             user_id,
             cluster=priority,
@@ -15,6 +15,12 @@ python manage.py migrate repository --noinput
 python manage.py makemigrations
 python manage.py migrate --noinput
 
+# Metrics of gunicorn workers and both qclusters are aggregated through a shared
+# directory, cleared on start so values from the previous run are not reported
+export PROMETHEUS_MULTIPROC_DIR="${PROMETHEUS_MULTIPROC_DIR:-/tmp/p7-metrics}"
+rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
 # Start any background workers (django-q qcluster for example)
 # These will be terminated via trap when the container gets a TERM signal
 Q_CLUSTER_NAME=high python manage.py qcluster & Q1_PID=$!
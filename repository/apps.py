@@ -3,6 +3,17 @@ import os
 import sys
 from django.apps import AppConfig
 from django.db import connection, OperationalError
+from django.db.models.signals import post_migrate
+
+
+def schedule_task_dispatch(**kwargs):
+    """Create the dispatch schedule once migrations have created the django-q tables."""
+    # Imported here, the planner imports the models of this app
+    from p7.sync_files.planner import (  # pylint: disable=import-outside-toplevel
+        schedule_task_dispatch as create_schedule,
+    )
+
+    create_schedule()
 
 
 class RepositoryConfig(AppConfig):
@@ -14,6 +25,7 @@ class RepositoryConfig(AppConfig):
     name = "repository"
 
     def ready(self):
+        post_migrate.connect(schedule_task_dispatch, sender=self)
 
          # Skip if no DB (e.g., during pylint or migrations)
         if os.environ.get("RUN_MAIN") != "true" or not connection.settings_dict.get("ENGINE"):
@@ -1,45 +1,129 @@
 """Repository functions for handling File model operations."""
 
+import re
 from datetime import datetime
 from collections import defaultdict
-from typing import Iterable
-from django.db import transaction
+from typing import Iterable, NamedTuple
+from django.db import DataError, OperationalError, connection, transaction
+from django.conf import settings
+from django.utils import timezone
 from django.db.models import (
+    Count,
     Value,
     Q,
     F,
 )
 from django.contrib.postgres.search import SearchVector
 from django.http import JsonResponse
-from repository.helpers import sanitize_for_postgres
+from repository.helpers import (
+    blind_index_key_id,
+    sanitize_for_postgres,
+    service_file_id_hash,
+)
 from repository.models import File, Service, User
-from p7.helpers import downloadable_file_extensions, smart_extension
+from repository.passage import replace_file_passages
+from repository.statistics import (
+    add_file_statistics,
+    remove_file_statistics,
+    user_corpus_statistics,
+)
+from p7.profiling.spans import span
+from p7.search import segment_index
+from p7.search.languages import detect_language
+from p7.search.planner import plan_query, planned_user_index
+from p7.metrics.helpers import FILES_INDEXED, FILES_UPSERTED, provider_label
+from p7.helpers import (
+    downloadable_file_extensions,
+    smart_extension,
+    MAX_CONTENT_CHARS,
+)
 
 NAME_RANK_WEIGHT = 0.7
 CONTENT_RANK_WEIGHT = 0.3
+# Results explained by explain requests
+EXPLAIN_TOP = 10
+# Characters of content ContentIndexWriter buffers before writing a batch
+INDEX_BATCH_CHARS = 4_000_000
+
+_WORD = re.compile(r"\S+")
 
 
-def fetch_downloadable_files(service):
-    """Fetches all downloadable files for a given service.
+def fetch_downloadable_files(service, after_id=None, limit=None):
+    """Fetches downloadable files for a given service, in id order.
 
     params:
         service: The service object for which to fetch downloadable files.
+        after_id: Only return files with a larger id, used to continue a chunked download.
+        limit: Maximum number of files to return.
     returns:
         A list of downloadable File objects associated with the service.
     """
     if isinstance(service, Service):
-        return list(
-            File.objects.filter(
-                Q(modifiedAt__gt=F("indexedAt")) | Q(indexedAt__isnull=True),
-                serviceId=service,
-                extension__in=downloadable_file_extensions(),
-                downloadable=True,
-            )
+        pending_files = File.objects.filter(
+            Q(modifiedAt__gt=F("indexedAt")) | Q(indexedAt__isnull=True),
+            serviceId=service,
+            extension__in=downloadable_file_extensions(),
+            downloadable=True,
+        )
+        if after_id is not None:
+            pending_files = pending_files.filter(pk__gt=after_id)
+        unchanged_content = Q(contentHash__isnull=False) & Q(
+            contentHash=F("indexedContentHash")
         )
 
+        # Renames, moves and sharing bump modifiedAt without touching the content.
+        # When the fingerprint matches the indexed one we only mark the file as indexed.
+        pending_files.filter(unchanged_content).update(indexedAt=timezone.now())
+
+        files = list(pending_files.exclude(unchanged_content).order_by("pk")[:limit])
+        for file in files:
+            file.serviceId = service  # Already loaded, spares a query per file later on
+        return files
+
     return JsonResponse({"error": "Invalid service parameter"}, status=400)
 
 
+def bump_index_version(user_ids) -> None:
+    """
+    Mark the search index of users as changed, in-memory indexes of theirs go stale.
+
+    params:
+        user_ids: User ids, or a queryset of them.
+    """
+    User.objects.filter(pk__in=user_ids).update(indexVersion=F("indexVersion") + 1)
+
+
+def delete_file(file: File) -> None:
+    """Delete a file, removing it from its owner's statistics and search index."""
+    with transaction.atomic():
+        remove_file_statistics([file.pk])
+        file.delete()
+        bump_index_version(Service.objects.filter(pk=file.serviceId_id).values("userId"))
+
+
+def hash_service_file_ids(service: Service) -> int:
+    """
+    Set serviceFileIdHash of all files of a service not hashed under the current
+    BLIND_INDEX_KEY yet: services stored before the hash existed, or hashed under
+    another key. A key change is then not taken for files deleted from the service
+    and stored again. Returns at once for services hashed under the current key,
+    File.save hashes every file stored after that.
+
+    returns:
+        The number of files hashed, 0 once the service is up to date.
+    """
+    key_id = blind_index_key_id()
+    if service.fileIdHashKeyId == key_id:
+        return 0
+    files = list(File.objects.filter(serviceId=service).only("serviceFileId"))
+    for file in files:
+        file.serviceFileIdHash = service_file_id_hash(file.serviceFileId)
+    File.objects.bulk_update(files, ["serviceFileIdHash"], batch_size=1000)
+    Service.objects.filter(pk=service.pk).update(fileIdHashKeyId=key_id)
+    service.fileIdHashKeyId = key_id
+    return len(files)
+
+
 def save_file(
     service_id,  # may be an int (Service.pk) or a Service instance
     service_file_id,
@@ -53,6 +137,7 @@ def save_file(
     modified_at,
     indexed_at,
     snippet,
+    content_hash=None,
 ):
     """Saves or updates file metadata and content to the database.
 
@@ -69,10 +154,15 @@ def save_file(
         modifiedAt: Timestamp when the file was last modified.
         indexedAt: Timestamp when the file was last indexed.
         snippet: Text snippet or preview of the file content.
+        content_hash: Provider fingerprint of the file content, if available.
     """
 
+    service = service_id
+    if not isinstance(service, Service):
+        service = Service.objects.only("name", "fileIdHashKeyId").get(pk=service_id)
+
     with transaction.atomic():
-        # Insert the file
+        # Insert the file, building tsFilename in the same statement
         defaults = {
             "name": name,
             "extension": extension,
@@ -84,69 +174,254 @@ def save_file(
             "modifiedAt": modified_at,
             "indexedAt": indexed_at,
             "snippet": snippet,
+            "contentHash": content_hash,
+            "tsFilename": filename_search_vector(service.name, name),
         }
-        file, _ = File.objects.update_or_create(
-            serviceId=service_id,
-            serviceFileId=service_file_id,
-            defaults=defaults,
+        # Looked up by the blind index, the encrypted id cannot use an index
+        lookup = File.objects.select_for_update().filter(
+            serviceId=service, serviceFileIdHash=service_file_id_hash(service_file_id)
         )
-
-        update_tsvector_filename(file, indexed_at)
+        file = lookup.first()
+        if file is None and hash_service_file_ids(service):
+            file = lookup.first()
+        if file is None:
+            file = File.objects.create(
+                serviceId=service, serviceFileId=service_file_id, **defaults
+            )
+            add_file_statistics([file.pk])
+        else:
+            # A rename may change the extension, and so the statistics row of the file
+            moved = file.extension != extension
+            if moved:
+                remove_file_statistics([file.pk])
+            for field, value in defaults.items():
+                setattr(file, field, value)
+            file.save(update_fields=list(defaults))
+            if moved:
+                add_file_statistics([file.pk])
+        bump_index_version([service.userId_id])
+    FILES_UPSERTED.labels(service.name).inc()
 
     return file
 
 
-def remove_extension_from_ts_vector_smart(file: File) -> str:
+def remove_extension_from_ts_vector_smart(file: File, service: Service | None = None) -> str:
     """Removes the file extension from the file name for tsvector indexing.
 
     params:
         file: File instance whose name is to be processed.
+        service: The file's service if already loaded, avoids lazily loading file.serviceId.
     returns:
         The file name without its extension.
     """
-    extension = smart_extension(file.serviceId.name, file.name)
-    if extension and file.name.lower().endswith(extension.lower()):
-        return file.name[: -len(extension)]
-    return file.name
+    provider = (service or file.serviceId).name
+    return remove_extension_from_name(provider, file.name)
 
 
-def update_tsvector_content(file, content: str | None, indexed_at: datetime | None) -> None:
-    """Update the tsContent field for full-text search on the given file instance."""
+def remove_extension_from_name(provider: str, name: str) -> str:
+    """Removes the file extension from a file name of the given provider."""
+    extension = smart_extension(provider, name)
+    if extension and name.lower().endswith(extension.lower()):
+        return name[: -len(extension)]
+    return name
+
+
+def filename_search_vector(provider: str, name: str) -> SearchVector:
+    """Build the tsFilename expression for a file name (extension removed)."""
+    return SearchVector(
+        Value(remove_extension_from_name(provider, name)),
+        weight="A",
+        config="simple",
+    )
+
+
+def clean_content_for_tsvector(content: str | None) -> str:
+    """Cap and sanitize extracted content before it is sent to PostgreSQL."""
     if not content:
-        cleaned_content = ""
-    else:
-        # hard cap at 20M chars
-        content = content[:20_000_000]
-        cleaned_content = sanitize_for_postgres(content)
-        cleaned_content = cleaned_content.encode("utf-8", "ignore").decode("utf-8", "ignore")
+        return ""
+    # hard cap at 20M chars
+    content = content[:MAX_CONTENT_CHARS]
+    cleaned_content = sanitize_for_postgres(content)
+    return cleaned_content.encode("utf-8", "ignore").decode("utf-8", "ignore")
 
-    File.objects.filter(pk=file.pk).update(
-        indexedAt=indexed_at,
-        tsContent=(
-            SearchVector(
-                Value(cleaned_content),
-                weight="B",
-                config="english"
-            )
+
+def bulk_update_tsvector_content(rows: list[tuple[int, str, datetime | None]]) -> None:
+    """
+    Build and store tsContent for many files in a single UPDATE ... FROM (VALUES ...).
+    The vectors are built by PostgreSQL and never read back, the number of words is
+    stored as the document length. Each file is indexed with the text search
+    configuration of its detected language, which is added to its owner's
+    contentLanguages. The passages used for search snippets are replaced in the same
+    transaction, the first one becomes the file's snippet, and the indexVersion of
+    the files' owners is bumped and stored as the files' contentVersion.
+
+    params:
+        rows: (file id, cleaned content, indexed_at) tuples.
+    """
+    if not rows:
+        return
+
+    snippet_field = File._meta.get_field("snippet")
+    values_sql = ", ".join(
+        ["(%s::bigint, %s::text, %s::timestamptz, %s::text, %s::integer, %s::text)"]
+        * len(rows)
+    )
+    file_table = connection.ops.quote_name(File._meta.db_table)
+    service_table = connection.ops.quote_name(Service._meta.db_table)
+    user_table = connection.ops.quote_name(User._meta.db_table)
+    sql = f"""
+        UPDATE {file_table} AS f
+        SET "tsContent" = setweight(to_tsvector(v.language::regconfig, v.content), 'B'),
+            "indexedAt" = v.indexed_at,
+            "indexedContentHash" = f."contentHash",
+            "snippet" = v.snippet,
+            "contentLength" = v.content_length,
+            "language" = v.language,
+            "contentVersion" = u."indexVersion"
+        FROM (VALUES {values_sql})
+            AS v(id, content, indexed_at, snippet, content_length, language),
+            {service_table} AS s, {user_table} AS u
+        WHERE f.id = v.id AND s.id = f."serviceId" AND u.id = s."userId"
+    """
+
+    file_ids = [row[0] for row in rows]
+    languages = {file_id: detect_language(content) for file_id, content, _ in rows}
+    with transaction.atomic():
+        # The content length and postings of the files change
+        remove_file_statistics(file_ids)
+        lead_passages = replace_file_passages(
+            [(file_id, content, languages[file_id]) for file_id, content, _ in rows]
         )
+        params = []
+        for file_id, content, indexed_at in rows:
+            params.extend(
+                [
+                    file_id,
+                    content,
+                    indexed_at,
+                    snippet_field.get_db_prep_save(lead_passages[file_id], connection),
+                    sum(1 for _ in _WORD.finditer(content)),
+                    languages[file_id],
+                ]
+            )
+
+        with connection.cursor() as cursor:
+            # Mark the owners' search index as changed, see bump_index_version, and
+            # add the languages of the files to the ones searched for them. The row
+            # lock is held until commit, so the version the files are stamped with
+            # below is higher than that of any content write committed before.
+            cursor.execute(
+                f"""
+                UPDATE {user_table} AS u
+                SET "indexVersion" = u."indexVersion" + 1,
+                    "contentLanguages" = ARRAY(
+                        SELECT DISTINCT unnest(u."contentLanguages" || o.languages)
+                        ORDER BY 1
+                    )
+                FROM (
+                    SELECT s."userId", array_agg(DISTINCT v.language) AS languages
+                    FROM unnest(%s::bigint[], %s::text[]) AS v(id, language)
+                    JOIN {file_table} AS f ON f.id = v.id
+                    JOIN {service_table} AS s ON s.id = f."serviceId"
+                    GROUP BY s."userId"
+                ) AS o
+                WHERE o."userId" = u.id
+                """,
+                [file_ids, [languages[file_id] for file_id in file_ids]],
+            )
+            cursor.execute(sql, params)
+        add_file_statistics(file_ids)
+
+
+def _is_rejected_content(error: Exception) -> bool:
+    """
+    Whether PostgreSQL rejected the content itself, with a data exception (class 22)
+    or an exceeded limit (class 54) such as "string is too long for tsvector",
+    rather than failing for a reason that writing file by file would not avoid.
+    """
+    sqlstate = getattr(error.__cause__, "sqlstate", None) or getattr(
+        error.__cause__, "pgcode", None
+    )
+    return bool(sqlstate) and sqlstate[:2] in ("22", "54")
+
+
+class ContentIndexWriter:
+    """
+    Buffers extracted file content and writes the tsContent of many files per statement.
+    A batch is flushed once it holds max_files files or max_chars characters,
+    and when the writer is used as a context manager the rest is flushed on exit.
+    A batch whose content PostgreSQL rejects, such as a vector over the 1MB tsvector
+    limit, is written file by file. The files it cannot index are stored without
+    content, and marked as indexed so they are not downloaded again until they change.
+
+        with ContentIndexWriter() as writer:
+            for file, content in downloaded:
+                writer.add(file, content, timezone.now())
+    """
+
+    def __init__(self, max_files: int = 100, max_chars: int = INDEX_BATCH_CHARS):
+        self.max_files = max_files
+        self.max_chars = max_chars
+        self._rows: list[tuple[int, str, datetime | None]] = []
+        self._providers: list[str] = []
+        self._chars = 0
+
+    def add(self, file: File, content: str | None, indexed_at: datetime | None) -> None:
+        """Queue the content of a file for indexing."""
+        cleaned_content = clean_content_for_tsvector(content)
+        self._rows.append((file.pk, cleaned_content, indexed_at))
+        self._providers.append(provider_label(file))
+        self._chars += len(cleaned_content)
+        if len(self._rows) >= self.max_files or self._chars >= self.max_chars:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write all queued content to the database."""
+        rows, self._rows, self._chars = self._rows, [], 0
+        providers, self._providers = self._providers, []
+        try:
+            bulk_update_tsvector_content(rows)
+            written = providers
+        except (DataError, OperationalError) as e:
+            if not _is_rejected_content(e):
+                raise
+            written = []
+            for row, provider in zip(rows, providers):
+                try:
+                    bulk_update_tsvector_content([row])
+                    written.append(provider)
+                except (DataError, OperationalError) as row_error:
+                    if not _is_rejected_content(row_error):
+                        raise
+                    print(f"Failed to index content of file {row[0]}: {row_error}")
+                    bulk_update_tsvector_content([(row[0], "", row[2])])
+        for provider in written:
+            FILES_INDEXED.labels(provider).inc()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+
+def update_tsvector_content(file, content: str | None, indexed_at: datetime | None) -> None:
+    """Update the tsContent field for full-text search on the given file instance."""
+    bulk_update_tsvector_content(
+        [(file.pk, clean_content_for_tsvector(content), indexed_at)]
     )
 
-    file.refresh_from_db(fields=["tsContent"])
 
-def update_tsvector_filename(file, indexed_at: datetime | None) -> None:
+def update_tsvector_filename(
+    file, indexed_at: datetime | None, service: Service | None = None
+) -> None:
     """Update the tsFilename field for full-text search on the given file instance."""
+    service = service or file.serviceId
     File.objects.filter(pk=file.pk).update(
         indexedAt=indexed_at,
-        tsFilename=(
-            SearchVector(
-                Value(remove_extension_from_ts_vector_smart(file)),
-                weight="A",
-                config="simple",
-            )
-        )
+        tsFilename=filename_search_vector(service.name, file.name),
     )
-
-    file.refresh_from_db(fields=["tsFilename"])
+    bump_index_version([service.userId_id])
 
 
 def query_files(
@@ -156,17 +431,59 @@ def query_files(
     modified_after_date=None,
     modified_before_date=None,
     extension=None,
+    ranking=None,
+    explain=False,
 ):
     """Query for files by name containing any of the given tokens and user id.
 
     params:
         name_query: List or tuple of substrings to search for in file names.
         user_id: User id to restrict results to. (applies as an AND).
+        ranking: Content ranking, "tfidf" or "bm25". Defaults to settings.SEARCH_RANKING.
+        explain: Attach a breakdown of the rank to the top results, see explain_rankings.
     returns:
         QuerySet of File objects matching the search criteria.
     """
+    phases = query_files_in_phases(
+        name_query,
+        user_id,
+        provider,
+        modified_after_date,
+        modified_before_date,
+        extension,
+        ranking,
+        explain,
+    )
+    if isinstance(phases, JsonResponse):
+        return phases
+
+    results = []
+    for _, results in phases:
+        pass  # Only the results of the last phase are returned
+    return results
+
+
+def query_files_in_phases(
+    name_query,
+    user_id,
+    provider=None,
+    modified_after_date=None,
+    modified_before_date=None,
+    extension=None,
+    ranking=None,
+    explain=False,
+):
+    """query_files, yielding the cheap file name ranking before the content ranking.
+
+    params:
+        Like query_files.
+    returns:
+        A generator of (phase, files) pairs: ("names", files ranked by name only),
+        then ("results", the files query_files returns). The content ranking runs
+        when the second pair is requested.
+    """
     try:
-        User.objects.get(pk=user_id)  # Ensure user exists
+        user = User.objects.get(pk=user_id)  # Ensure user exists
     except User.DoesNotExist:
         return JsonResponse(
             {"error": f"Service ({user_id}) not found for user"}, status=404
@@ -176,6 +493,60 @@ def query_files(
         name_query, (list, tuple)
     ), "name_query must be a list or tuple of tokens"
 
+    return _search_phases(
+        user,
+        " ".join(name_query),
+        provider,
+        modified_after_date,
+        modified_before_date,
+        extension,
+        ranking or settings.SEARCH_RANKING,
+        explain,
+    )
+
+
+def _search_phases(
+    user,
+    query_text,
+    provider,
+    modified_after_date,
+    modified_before_date,
+    extension,
+    ranking,
+    explain,
+):
+    """The generator returned by query_files_in_phases."""
+    # Content queries are analyzed in every language the user's files are indexed in
+    languages = tuple(user.contentLanguages)
+    plan = None
+    if settings.SEARCH_PLANNER["enabled"]:
+        with span("df_lookup"):
+            plan = plan_query(query_text, user, languages)
+
+    # Answer from the user's in-memory index when it is warm and current, and the
+    # query is expected to match enough files to be worth a pass over all of them
+    memory_index = None
+    if settings.MEMORY_INDEX["enabled"]:
+        memory_index = planned_user_index(plan, user.pk, user.indexVersion)
+    if memory_index is not None:
+        with span("candidate_fetch"):
+            file_ids = memory_index.filter_files(
+                provider, modified_after_date, modified_before_date, extension
+            )
+        with span("scoring"):
+            name_ranked_files = memory_index.ranking_based_on_file_name(query_text, file_ids)
+        yield "names", combine_rankings(name_ranked_files, [])[:200]
+        with span("scoring"):
+            content_ranked_files = memory_index.ranking_based_on_content(
+                query_text, file_ids, ranking, languages
+            )
+        with span("fusion"):
+            results = combine_rankings(name_ranked_files, content_ranked_files)[:200]
+        if explain:
+            explain_rankings(results, name_ranked_files, content_ranked_files, ranking)
+        yield "results", results
+        return
+
     # Q() object to combine queries
     q = Q()
     if provider:
@@ -189,21 +560,45 @@ def query_files(
         for ext in extension:
             q &= Q(extension__iexact=ext)
     # Always filter by user_id
-    q &= Q(serviceId__userId=user_id)
-
-    query_text = " ".join(name_query)
+    q &= Q(serviceId__userId=user.pk)
 
     # Rank files based on file name
-    name_ranked_files = File.objects.ranking_based_on_file_name(
-        query_text, base_filter=q
-    )
-
-    # Rank files based on file content
-    content_ranked_files = File.objects.ranking_based_on_content(
-        query_text, base_filter=q
-    )
+    with span("candidate_fetch"):
+        name_ranked_files = list(
+            File.objects.ranking_based_on_file_name(
+                query_text, base_filter=q, plan=plan and plan.name
+            )
+        )
+    yield "names", combine_rankings(name_ranked_files, [])[:200]
+
+    # Rank files based on file content, from the user's segments when unfiltered
+    content_ranked_files = None
+    filtered = provider or modified_after_date or modified_before_date or extension
+    if settings.SEARCH_SEGMENTS["enabled"] and not filtered:
+        with span("scoring"):
+            content_ranked_files = segment_index.ranking_based_on_content(
+                user.pk, query_text, ranking, languages
+            )
+    if content_ranked_files is None:
+        # The statistics cover the provider and extension filters, not date ranges
+        corpus = None
+        if not (modified_after_date or modified_before_date):
+            with span("df_lookup"):
+                corpus = user_corpus_statistics(user, provider, extension)
+        content_ranked_files = File.objects.ranking_based_on_content(
+            query_text,
+            base_filter=q,
+            ranking=ranking,
+            plan=plan and plan.content,
+            corpus=corpus,
+            languages=languages,
+        )
 
-    return combine_rankings(name_ranked_files, content_ranked_files)[:200]
+    with span("fusion"):
+        results = combine_rankings(name_ranked_files, content_ranked_files)[:200]
+    if explain:
+        explain_rankings(results, name_ranked_files, content_ranked_files, ranking)
+    yield "results", results
 
 
 def combine_rankings(
@@ -244,6 +639,44 @@ def combine_rankings(
     return result
 
 
+def explain_rankings(
+    results: list[File],
+    name_ranked_files: Iterable[File],
+    content_ranked_files: Iterable[File],
+    ranking: str,
+    top: int = EXPLAIN_TOP,
+) -> None:
+    """
+    Attach how the combined rank of the top results was computed, as file.explanation.
+    Only called for explain requests, so the normal path keeps no per-file breakdowns.
+
+    Params:
+        results: Files returned by combine_rankings.
+        name_ranked_files: The files ranked by name, with their rank components.
+        content_ranked_files: The files ranked by content.
+        ranking: The content ranking used, "tfidf" or "bm25".
+        top: Number of results explained.
+    """
+    name_files = {f.id: f for f in name_ranked_files}
+    content_files = {f.id: f for f in content_ranked_files}
+    for file in results[:top]:
+        name_file = name_files.get(file.id)
+        content_file = content_files.get(file.id)
+        name_rank = getattr(name_file, "rank", 0.0) or 0.0
+        content_rank = getattr(content_file, "rank", 0.0) or 0.0
+        file.explanation = {
+            "plain_rank": getattr(name_file, "plain_rank", 0.0),
+            "token_ratio": getattr(name_file, "token_ratio", 0.0),
+            "ordered_bonus": getattr(name_file, "ordered_bonus", 0.0),
+            "name_rank": name_rank,
+            "name_weight": NAME_RANK_WEIGHT,
+            "content_ranking": ranking,
+            "content_rank": content_rank,
+            "content_weight": CONTENT_RANK_WEIGHT,
+            "combined_rank": file.combined_rank,
+        }
+
+
 def accumulate_file_scores(
     files: Iterable[File], weight: float, scores: defaultdict, files_by_id: dict
 ) -> None:
@@ -279,3 +712,53 @@ def get_files_by_service(service):
     if isinstance(service, Service):
         return list(File.objects.filter(serviceId=service.id))
     return JsonResponse({"error": "Invalid service parameter"}, status=400)
+
+
+def get_files_missing_from_service(service: Service, service_file_ids: Iterable[str]):
+    """
+    Stored files of a service whose ids are not among the ones it listed, the files
+    deleted from the service since the last sync.
+
+    params:
+        service: The service whose files are reconciled.
+        service_file_ids: Ids of all files the service listed.
+
+    returns:
+        A list of File objects to delete.
+    """
+    hash_service_file_ids(service)
+    listed = {service_file_id_hash(i) for i in service_file_ids}
+    # Only ids and hashes are read, nothing is decrypted to compare the ids
+    missing = [
+        pk
+        for pk, hashed in File.objects.filter(serviceId=service).values_list(
+            "id", "serviceFileIdHash"
+        )
+        if bytes(hashed) not in listed
+    ]
+    return list(File.objects.filter(pk__in=missing))
+
+
+class Backlog(NamedTuple):
+    """Files waiting to be downloaded and indexed."""
+
+    files: int
+    # Users with at least one such file, and the most files one user waits for
+    users: int
+    max_user_files: int
+
+
+def count_backlog() -> Backlog:
+    """
+    Counts files waiting to be downloaded and indexed, those with indexedAt unset or
+    older than modifiedAt, in total and across users.
+    """
+    per_user = (
+        File.objects.filter(Q(indexedAt__isnull=True) | Q(modifiedAt__gt=F("indexedAt")))
+        .values_list("serviceId__userId")
+        .annotate(backlog=Count("id"))
+        .order_by()
+        .values_list("backlog", flat=True)
+    )
+    counts = list(per_user)
+    return Backlog(files=sum(counts), users=len(counts), max_user_files=max(counts, default=0))
@@ -1,6 +1,13 @@
 """Helper for working with ts_lexize() and ts_stat() from PostgreSQL"""
 
+import hashlib
+import hmac
 import re
+from functools import lru_cache
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from django.conf import settings
 from django.db import connection, models
 
 
@@ -15,6 +22,25 @@ def ts_tokenize(text, config):
         return [row[0] for row in cursor.fetchall()]
 
 
+def ts_tokenize_languages(text, configs):
+    """
+    Tokenizes a string with several text search configurations in one round trip,
+    returning the distinct lexemes of all of them in the order ts_tokenize uses
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT lexeme
+            FROM unnest(%s::regconfig[]) AS config,
+                unnest(tsvector_to_array(to_tsvector(config, %s))) AS lexeme
+            GROUP BY lexeme
+            ORDER BY lexeme
+            """,
+            [list(configs), text],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
 def ts_lexize(token):
     """
     Lexizes (stems) a token
@@ -57,20 +83,36 @@ def get_document_frequencies_matching_tokens(
         filtered_stats = [row for row in ts_stats if row[0] in terms]
     return filtered_stats
 
-def get_term_frequencies_for_file(file):
+def get_term_frequencies_for_files(query_set: models.QuerySet, terms=None):
     """
-    Retrieve term frequencies using ts_stat() for a single file instance.
-    Args:
-        file: A model instance with a tsContent field.
+    Term frequencies, as counted by ts_stat(), of the files in query_set.
+    One statement for all files instead of one ts_stat() per file.
+    params:
+        query_set: The files to count the terms of
+        terms: Only count these terms, all terms of the files when None
+    returns:
+        The frequency of each term per file id: dict[int, dict[str, int]]
     """
-    ts_sql = """
-        SELECT word, nentry
-        FROM ts_stat($$SELECT %s::tsvector$$)
+    sql, params = query_set.values("id", "tsContent").query.sql_with_params()
+    term_filter = ""
+    if terms is not None:
+        term_filter = "WHERE t.lexeme = ANY(%s)"
+        params = (*params, list(terms))
+
+    # Stripped lexemes have no positions and count once, like in ts_stat()
+    ts_sql = f"""
+        SELECT f.id, t.lexeme, coalesce(array_length(t.positions, 1), 1)
+        FROM ({sql}) AS f, unnest(f."tsContent") AS t
+        {term_filter}
     """
 
+    frequencies = {}
     with connection.cursor() as cursor:
-        cursor.execute(ts_sql, [file.tsContent])
-        return cursor.fetchall()
+        cursor.execute(ts_sql, params)
+        for file_id, term, tf in cursor.fetchall():
+            frequencies.setdefault(file_id, {})[term] = tf
+    return frequencies
+
 
 def sanitize_for_postgres(text: str) -> str:
     """
@@ -91,3 +133,39 @@ def sanitize_for_postgres(text: str) -> str:
     text = re.sub(r"[\x01-\x08\x0b-\x1f\x7f]", "", text)
 
     return text
+
+
+@lru_cache(maxsize=1)
+def _blind_index_key(key: str) -> bytes:
+    """The HMAC key of service_file_id_hash, derived from BLIND_INDEX_KEY with HKDF."""
+    return HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=None,
+        # A purpose of its own, so the key differs from any other use of the secret
+        info=b"p7 serviceFileId blind index",
+    ).derive(key.encode("utf-8"))
+
+
+def blind_index_key_id() -> str:
+    """
+    Fingerprint of the key service_file_id_hash uses, stored with the hashes so
+    that hashes made under another key are recognised and recomputed.
+    """
+    key = _blind_index_key(settings.BLIND_INDEX_KEY)
+    return hmac.new(key, b"key id", hashlib.sha256).hexdigest()[:16]
+
+
+def service_file_id_hash(service_file_id: str) -> bytes:
+    """
+    Blind index of a serviceFileId: its HMAC-SHA256 under a key derived from
+    BLIND_INDEX_KEY.
+
+    Lookups on the encrypted serviceFileId decrypt every row in SQL. The hash is
+    deterministic and can be looked up in a btree index.
+    """
+    return hmac.new(
+        _blind_index_key(settings.BLIND_INDEX_KEY),
+        str(service_file_id).encode("utf-8"),
+        hashlib.sha256,
+    ).digest()
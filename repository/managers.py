@@ -1,37 +1,65 @@
 """Manager for ranking files based on query matches."""
 
 from django.db import models
+from django.contrib.postgres.fields import ArrayField
 from django.contrib.postgres.search import SearchQuery, SearchRank
-from django.db.models import F, Value, FloatField
+from django.db.models import Avg, Count, F, Value, FloatField
 from repository.helpers import (
-    ts_tokenize,
+    ts_tokenize_languages,
     get_document_frequencies_matching_tokens,
-    get_term_frequencies_for_file,
+    get_term_frequencies_for_files,
 )
+from p7.profiling.spans import span
+from p7.search.languages import DEFAULT_LANGUAGE
 from p7.search.content_ranking import (
-    get_document_lnc,
-    get_query_ltc,
-    compute_score_for_files,
+    bm25_impact,
+    compute_score_from_norms,
+    get_document_lnc_norms,
+    get_query_bm25,
+    get_query_ltc_norms,
 )
 
 
+class MatchedLexemes(models.Func):  # pylint: disable=abstract-method
+    """
+    Number of lexemes, repeats counted, that occur in a tsvector.
+    The vector is converted to an array once per row and every lexeme is looked up in
+    it, instead of matching one tsquery per lexeme.
+    """
+
+    template = (
+        "(SELECT count(*) FROM unnest(%(lexemes)s) AS q(lexeme)"
+        " WHERE q.lexeme = ANY(tsvector_to_array(%(vector)s)))"
+    )
+    output_field = models.IntegerField()
+
+    def __init__(self, vector: F, lexemes: list[str]):
+        super().__init__(vector, Value(lexemes, output_field=ArrayField(models.TextField())))
+
+    def as_sql(
+        self, compiler, connection, function=None, template=None, arg_joiner=None,
+        **extra_context,
+    ):
+        vector, lexemes = self.get_source_expressions()
+        vector_sql, vector_params = compiler.compile(vector)
+        lexemes_sql, lexemes_params = compiler.compile(lexemes)
+        sql = (template or self.template) % {"lexemes": lexemes_sql, "vector": vector_sql}
+        return sql, (*lexemes_params, *vector_params)
+
+
 class FileQuerySet(models.QuerySet):
     """Custom QuerySet for File model with ranking capabilities."""
 
     def ranking_based_on_file_name(
-        self, query_text: str, base_filter: models.Q | None = None
+        self, query_text: str, base_filter: models.Q | None = None, plan=None
     ):
         """
         Apply ranking favoring phrase matches, and token coverage.
         - query_text: the original user query ("file name with spaces")
         - base_filter: optional Q object with prefilter logic
+        - plan: optional TokenPlan (p7/search/planner.py) choosing the tokens and
+          operator candidates are matched with, all tokens are scored either way
         """
-        # Search vector on the ts vector
-        query_text_search_vector = F("tsFilename")
-
-        # Search type plain favors individual token matches
-        plain_q = SearchQuery(query_text, search_type="plain", config="simple")
-
         # Apply base filter if provided
         query_set = self
         if base_filter is not None:
@@ -42,19 +70,37 @@ class FileQuerySet(models.QuerySet):
             # No tokens -> nothing to search
             return self.none()
 
+        if plan is not None and plan.require_all:
+            # All planned tokens first, any of them when that finds too few files
+            all_query = SearchQuery(plan.tsquery(True), search_type="raw", config="simple")
+            ranked = self._rank_file_names(
+                query_set.filter(tsFilename=all_query), query_text, tokens
+            )
+            if len(ranked) >= plan.min_results:
+                return ranked
+
         search_query = SearchQuery(
-            " | ".join(tokens), search_type="raw", config="simple"
+            plan.tsquery(False) if plan is not None else " | ".join(tokens),
+            search_type="raw",
+            config="simple",
         )
-        query_set = query_set.filter(tsFilename=search_query)
-
-        token_match_expr = sum(
-            models.Case(
-                models.When(tsFilename=SearchQuery(t, search_type="plain", config="simple"),
-                     then=models.Value(1)),
-                default=models.Value(0),
-                output_field=models.IntegerField(),
-            )
-            for t in tokens
+        return self._rank_file_names(
+            query_set.filter(tsFilename=search_query), query_text, tokens
+        )
+
+    @staticmethod
+    def _rank_file_names(query_set, query_text: str, tokens: list[str]):
+        """Annotate the rank of ranking_based_on_file_name on matching files."""
+        # Search vector on the ts vector
+        query_text_search_vector = F("tsFilename")
+
+        # Search type plain favors individual token matches
+        plain_q = SearchQuery(query_text, search_type="plain", config="simple")
+
+        # Tokens covered by the file name, counted in a single pass over the vector.
+        # The 'simple' configuration only lowercases, so a token is its own lexeme.
+        token_match_expr = MatchedLexemes(
+            query_text_search_vector, [t.lower() for t in tokens]
         )
 
         # Adds Final ranking composed of below and orders by it:
@@ -77,19 +123,36 @@ class FileQuerySet(models.QuerySet):
         )
 
     def ranking_based_on_content(
-        self, query_text: str, base_filter: models.Q | None = None
+        self,
+        query_text: str,
+        base_filter: models.Q | None = None,
+        ranking: str = "tfidf",
+        plan=None,
+        corpus=None,
+        languages=(DEFAULT_LANGUAGE,),
     ):
         """
         Apply ranking to file content using Term Frequency-Inverse Document Frequency (tf-idf)
         The following notation is used:(Term frequency)-(Document frequency)-(Normalization)
         For the query we use logarithm-idf-cosine (ltc)
         For the files we use logarithm-none-cosine (lnc)
+        With ranking="bm25" files are scored with BM25 instead, using the stored
+        contentLength of each file and the average over the user's files
+        Either way the term frequencies of all candidates are read in one statement
         - query_text: the original user query ("file name with spaces")
         - base_filter: always contains user filter (id) and possibly others
+        - ranking: "tfidf" or "bm25"
+        - plan: optional TokenPlan (p7/search/planner.py) choosing the lexemes and
+          operator candidates are matched with, all lexemes are scored either way
+        - corpus: optional CorpusSnapshot (repository/statistics.py) of the files
+          passing base_filter, read instead of counting them
+        - languages: text search configurations the query is analyzed with, the
+          user's contentLanguages, files are matched by the lexemes of any of them
         """
 
         # Retrieve tokens from query string (stemmed)
-        tokens = ts_tokenize(query_text, "english")
+        with span("tokenize"):
+            tokens = ts_tokenize_languages(query_text, languages)
         query_set = self
 
         # No tokens, we cannot query anything
@@ -99,38 +162,86 @@ class FileQuerySet(models.QuerySet):
         # Apply base filter (always includes user)
         all_user_files = query_set.filter(base_filter)
 
-        # Get totalt number of documents for user
-        # Important to do here before query_set is reduced
-        user_documents_count = all_user_files.count()
-
-        # Compute document frequencies for all terms included in the query over all user files
-        document_frequencies = get_document_frequencies_matching_tokens(
-            all_user_files, tokens
-        )
-
-        # Build SearchQuery by combining tokens with | operator
-        search_query = SearchQuery(
-            " | ".join(tokens), search_type="raw", config="english"
-        )
+        with span("df_lookup"):
+            # Get totalt number of documents for user
+            # Important to do here before query_set is reduced
+            if corpus is not None:
+                user_documents_count = corpus.documents
+                average_length = corpus.average_length
+            elif ranking == "bm25":
+                # The average length comes with the count, files without content ignored
+                aggregate = all_user_files.aggregate(
+                    documents=Count("id"), average_length=Avg("contentLength")
+                )
+                user_documents_count = aggregate["documents"]
+                average_length = aggregate["average_length"]
+            else:
+                user_documents_count = all_user_files.count()
+                average_length = None
+
+            # Compute document frequencies for all terms included in the query over all user files
+            document_frequencies = get_document_frequencies_matching_tokens(
+                all_user_files, tokens
+            )
 
-        # Use the GIN index to find files matching query
-        user_files_matching_query = all_user_files.filter(tsContent=search_query)
+        with span("candidate_fetch"):
+            user_files_matching_query = None
+            if plan is not None and plan.require_all:
+                # All planned lexemes first, any of them when that finds too few files
+                user_files_matching_query = all_user_files.filter(
+                    tsContent=SearchQuery(
+                        plan.tsquery(True), search_type="raw", config="simple"
+                    )
+                )
+                if len(user_files_matching_query) < plan.min_results:
+                    user_files_matching_query = None
+
+            if user_files_matching_query is None:
+                # Build SearchQuery by combining tokens with | operator
+                search_query = SearchQuery(
+                    plan.tsquery(False) if plan is not None else " | ".join(tokens),
+                    search_type="raw",
+                    # The tokens are lexemes already, possibly of several languages
+                    config="simple",
+                )
 
-        # Compute ltc stats for the query
-        query_ltc = get_query_ltc(user_documents_count, tokens, document_frequencies)
+                # Use the GIN index to find files matching query
+                user_files_matching_query = all_user_files.filter(tsContent=search_query)
+                # Evaluate once, the files are cached on the queryset
+                len(user_files_matching_query)
 
-        # Calculate document lnc for each file
-        file_stats_list = [
-            {
-                file.id: get_document_lnc(
-                    get_term_frequencies_for_file(file)
+        with span("scoring"):
+            candidates = self.model.objects.filter(
+                pk__in=[file.id for file in user_files_matching_query]
+            )
+            if ranking == "bm25":
+                # Sum of idf times the stored-length BM25 weight of each matched term
+                query_bm25 = get_query_bm25(user_documents_count, tokens, document_frequencies)
+                term_frequencies = get_term_frequencies_for_files(candidates, list(query_bm25))
+                scored_files = {
+                    file.id: sum(
+                        query_bm25[term]
+                        * bm25_impact(tf, file.contentLength, average_length)
+                        for term, tf in term_frequencies.get(file.id, {}).items()
+                    )
+                    for file in user_files_matching_query
+                }
+            else:
+                # Compute ltc weights for the query, only the norms are needed to score
+                query_ltc = get_query_ltc_norms(
+                    user_documents_count, tokens, document_frequencies
                 )
-            }
-            for file in user_files_matching_query
-        ]
 
-        # Compute a score for each file
-        scored_files = compute_score_for_files(query_ltc, file_stats_list)
+                # Calculate document lnc weights for each file, from all of its terms
+                file_norms = {
+                    file_id: get_document_lnc_norms(frequencies)
+                    for file_id, frequencies in get_term_frequencies_for_files(
+                        candidates
+                    ).items()
+                }
+
+                # Compute a score for each file
+                scored_files = compute_score_from_norms(query_ltc, file_norms)
 
         # Add rank attribute to the files
         for file in user_files_matching_query:
@@ -1,12 +1,19 @@
 """Defines the database models for users, services, files, terms, inverted index, and postings."""
 
 from django.db import models
+from django.contrib.postgres.fields import ArrayField
 from django.contrib.postgres.indexes import GinIndex
 from django.contrib.postgres.search import SearchVectorField
 import pgcrypto
+from repository.helpers import service_file_id_hash
 from repository.managers import FileManager
+from p7.search.languages import DEFAULT_LANGUAGE
 
 
+def default_content_languages() -> list[str]:
+    """Languages of users whose content was indexed before languages were detected."""
+    return [DEFAULT_LANGUAGE]
+
 
 class User(models.Model):
     """A class representing a user of the application.
@@ -16,6 +23,15 @@ class User(models.Model):
     """
 
     id = models.BigAutoField(primary_key=True)
+    # Bumped whenever the user's files or their search vectors change,
+    # in-memory search indexes built at an older version are stale
+    indexVersion = models.BigIntegerField(default=0)
+    # Set once the user's CorpusStatistics rows have been built from their files,
+    # they are kept current from then on
+    corpusStatisticsBuilt = models.BooleanField(default=False)
+    # Text search configurations the user's files are indexed with, searched together.
+    # Languages are added as content is indexed and never removed.
+    contentLanguages = ArrayField(models.TextField(), default=default_content_languages)
 
     class Meta:
         """Class defining metadata for the User model."""
@@ -48,6 +64,13 @@ class Service(models.Model):
     email = pgcrypto.EncryptedTextField()
     scopeName = pgcrypto.EncryptedTextField()
     indexedAt = pgcrypto.EncryptedDateTimeField(null=True, blank=True)
+    # Last file committed by the current download pass, None when no pass is in progress
+    downloadCursor = models.BigIntegerField(null=True, blank=True)
+    downloadCheckpointAt = models.DateTimeField(null=True, blank=True)
+    # Seconds between periodic syncs, adapted to how often the service changes
+    syncInterval = models.IntegerField(null=True, blank=True)
+    # blind_index_key_id of the key the serviceFileIdHash of the files was made with
+    fileIdHashKeyId = models.CharField(max_length=16, null=True, blank=True)
 
     class Meta:
         """Class defining metadata for the Service model."""
@@ -71,6 +94,9 @@ class File(models.Model):
         related_name="files",
     )
     serviceFileId = pgcrypto.EncryptedTextField()
+    # Blind index of serviceFileId, the encrypted id itself cannot be looked up.
+    # Null for files stored before it existed, until their service is backfilled.
+    serviceFileIdHash = models.BinaryField(max_length=32, null=True, editable=False)
     name = pgcrypto.EncryptedTextField()
     extension = models.TextField()
     downloadable = models.BooleanField()
@@ -81,6 +107,17 @@ class File(models.Model):
     modifiedAt = models.DateTimeField()
     indexedAt = models.DateTimeField(null=True, blank=True)
     snippet = pgcrypto.EncryptedTextField(null=True, blank=True)
+    # Provider content fingerprint (Dropbox content_hash, Drive md5Checksum,
+    # OneDrive quickXorHash, sha256 for local files) and the one last indexed
+    contentHash = models.TextField(null=True, blank=True)
+    indexedContentHash = models.TextField(null=True, blank=True)
+    # Words in the indexed content, the document length used by BM25
+    contentLength = models.IntegerField(null=True, blank=True)
+    # Text search configuration tsContent and the passages are built with
+    language = models.TextField(default=DEFAULT_LANGUAGE)
+    # The owner's indexVersion when tsContent was last written. Bumping it locks the
+    # owner's row, so per user the values increase in commit order, unlike indexedAt.
+    contentVersion = models.BigIntegerField(null=True, blank=True)
     tsFilename = SearchVectorField(null=True)
     tsContent = SearchVectorField(null=True)
 
@@ -91,8 +128,8 @@ class File(models.Model):
         db_table = '"file"'
         constraints = [
             models.UniqueConstraint(
-                fields=["serviceId", "serviceFileId"],
-                name="uq_service_file_id",
+                fields=["serviceId", "serviceFileIdHash"],
+                name="uq_service_file_id_hash",
             ),
         ]
         # GIN index over a weighted SearchVector expression
@@ -106,3 +143,145 @@ class File(models.Model):
                 fields=["tsFilename"],
             ),
         ]
+
+    def save(self, *args, **kwargs):
+        """Save the file, keeping serviceFileIdHash in step with serviceFileId."""
+        if "serviceFileId" not in self.get_deferred_fields():
+            self.serviceFileIdHash = service_file_id_hash(  # pylint: disable=invalid-name
+                self.serviceFileId
+            )
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "serviceFileId" in update_fields:
+            kwargs["update_fields"] = [*update_fields, "serviceFileIdHash"]
+        super().save(*args, **kwargs)
+
+
+
+class FilePassage(models.Model):
+    """A passage of a file's content, stored at index time for search snippets.
+
+    params:
+        models (django.db): Base class for all models in Django.
+    """
+    id = models.BigAutoField(primary_key=True)
+    fileId = models.ForeignKey(
+        File,
+        on_delete=models.CASCADE,
+        db_column="fileId",
+        related_name="passages",
+    )
+    position = models.IntegerField()
+    text = pgcrypto.EncryptedTextField()
+    tsPassage = SearchVectorField(null=True)
+
+    class Meta:
+        """Class defining metadata for the FilePassage model."""
+
+        app_label = "repository"
+        db_table = '"file_passage"'
+        indexes = [
+            models.Index(fields=["fileId", "position"], name="file_passage_file_idx"),
+        ]
+
+
+class CorpusStatistics(models.Model):
+    """Search statistics of the files of one service with one extension.
+
+    Kept current in the transactions changing files, see repository/statistics.py.
+    A user's rows are summed to get the statistics of their corpus under a filter.
+
+    params:
+        models (django.db): Base class for all models in Django.
+    """
+    id = models.BigAutoField(primary_key=True)
+    serviceId = models.ForeignKey(
+        Service,
+        on_delete=models.CASCADE,
+        db_column="serviceId",
+        related_name="corpusStatistics",
+    )
+    extension = models.TextField()
+    documentCount = models.BigIntegerField(default=0)
+    # Files with a contentLength, and the sum of it
+    contentDocumentCount = models.BigIntegerField(default=0)
+    totalLength = models.BigIntegerField(default=0)
+    # Distinct lexemes in tsContent, summed over the files
+    totalPostings = models.BigIntegerField(default=0)
+
+    class Meta:
+        """Class defining metadata for the CorpusStatistics model."""
+
+        app_label = "repository"
+        db_table = '"corpus_statistics"'
+        constraints = [
+            models.UniqueConstraint(
+                fields=["serviceId", "extension"],
+                name="uq_corpus_statistics_service_extension",
+            ),
+        ]
+
+
+class ScheduledJob(models.Model):
+    """A class representing a provider task waiting for, or holding, a django-q worker.
+
+    Jobs are handed to django-q by repository.queue.dispatch_tasks, which caps the
+    number of running jobs per user and orders the rest with weighted fair queuing.
+
+    params:
+        models (django.db): Base class for all models in Django.
+    """
+
+    PENDING = "pending"
+    RUNNING = "running"
+
+    id = models.BigAutoField(primary_key=True)
+    userId = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        db_column="userId",
+        related_name="scheduledJobs",
+    )
+    group = models.TextField()
+    func = models.TextField()
+    # "<func>:<group>", at most one pending job per operation and service
+    dedupeKey = models.TextField()
+    args = models.JSONField(default=list)
+    kwargs = models.JSONField(default=dict)
+    # Arguments of a duplicate submitted while running, the job runs again with them
+    rerunArgs = models.JSONField(null=True, blank=True)
+    rerunKwargs = models.JSONField(null=True, blank=True)
+    cluster = models.TextField(default="high")
+    cost = models.FloatField(default=1.0)
+    weight = models.FloatField(default=1.0)
+    status = models.TextField(default=PENDING)
+    # Start/finish tags in the fair queue's virtual time
+    virtualStart = models.FloatField(default=0.0)
+    virtualFinish = models.FloatField(default=0.0)
+    taskId = models.TextField(null=True, blank=True)
+    createdAt = models.DateTimeField(auto_now_add=True)
+    startedAt = models.DateTimeField(null=True, blank=True)
+    # Renewed while the job runs, a running job past it lost its worker
+    leaseExpiresAt = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        """Class defining metadata for the ScheduledJob model."""
+
+        app_label = "repository"
+        db_table = '"scheduled_job"'
+        indexes = [
+            models.Index(
+                name="scheduled_job_queue_idx",
+                fields=["cluster", "status", "virtualStart"],
+            ),
+            models.Index(
+                name="scheduled_job_dedupe_idx",
+                fields=["dedupeKey"],
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                name="scheduled_job_one_pending",
+                fields=["dedupeKey"],
+                condition=models.Q(status="pending"),
+            ),
+        ]
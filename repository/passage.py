@@ -0,0 +1,126 @@
+"""
+Repository helpers for the passages stored per file at index time.
+
+Passages are written together with tsContent (see bulk_update_tsvector_content)
+and read at query time to pick and highlight the passage best matching a query.
+"""
+
+from django.db import connection
+
+from repository.models import File, FilePassage
+from p7.search.passages import (
+    HIGHLIGHT_START,
+    HIGHLIGHT_STOP,
+    parse_highlights,
+    split_passages,
+)
+
+# ts_headline options, the passage is already short so it is trimmed only slightly
+HEADLINE_OPTIONS = (
+    f'StartSel="{HIGHLIGHT_START}", StopSel="{HIGHLIGHT_STOP}", '
+    "MaxWords=40, MinWords=20, ShortWord=2"
+)
+
+
+def replace_file_passages(rows: list[tuple[int, str, str]]) -> dict[int, str | None]:
+    """
+    Replace the stored passages of many files in two statements.
+
+    params:
+        rows: (file id, cleaned content, text search configuration) tuples.
+    returns:
+        The first passage of each file, or None for files without content.
+    """
+    text_field = FilePassage._meta.get_field("text")
+    passage_rows = []
+    lead_passages = {}
+    for file_id, content, language in rows:
+        passages = split_passages(content)
+        lead_passages[file_id] = passages[0] if passages else None
+        for position, passage in enumerate(passages):
+            passage_rows.append(
+                (
+                    file_id,
+                    position,
+                    text_field.get_db_prep_save(passage, connection),
+                    language,
+                    passage,
+                )
+            )
+
+    table = connection.ops.quote_name(FilePassage._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {table} WHERE "fileId" = ANY(%s)',
+            [[row[0] for row in rows]],
+        )
+        if passage_rows:
+            # The plain text is only used to build the vector, the stored text is encrypted
+            values_sql = ", ".join(
+                ["(%s, %s, %s, to_tsvector(%s::regconfig, %s::text))"] * len(passage_rows)
+            )
+            params = []
+            for file_id, position, text, language, plain in passage_rows:
+                params.extend([file_id, position, text, language, plain])
+            cursor.execute(
+                f'INSERT INTO {table} ("fileId", "position", "text", "tsPassage") '
+                f"VALUES {values_sql}",
+                params,
+            )
+
+    return lead_passages
+
+
+def highlight_best_passages(files: list[File], query_text: str) -> None:
+    """
+    Set the snippet of each file to its passage best matching the query, highlighted.
+
+    Files without a matching passage keep their stored snippet. Matched files also
+    get highlights, the (start, end) offsets of the query terms in the snippet.
+
+    params:
+        files: Search results.
+        query_text: The sanitized user query.
+    """
+    files_by_id = {file.id: file for file in files}
+    if not files_by_id or not query_text:
+        return
+
+    text_field = FilePassage._meta.get_field("text")
+    table = connection.ops.quote_name(FilePassage._meta.db_table)
+    file_table = connection.ops.quote_name(File._meta.db_table)
+    # Any of the query terms matches, like the content ranking, analyzed in every
+    # language of the files. A passage is highlighted in the language of its file.
+    sql = f"""
+        WITH q AS (
+            SELECT string_agg(DISTINCT quote_literal(lexeme), ' | ')::tsquery AS query
+            FROM (
+                SELECT DISTINCT "language" FROM {file_table} WHERE id = ANY(%s)
+            ) AS l,
+            unnest(tsvector_to_array(to_tsvector(l."language"::regconfig, %s))) AS lexeme
+        )
+        SELECT DISTINCT ON (p."fileId")
+            p."fileId",
+            ts_headline(
+                f."language"::regconfig,
+                convert_from(decrypt(dearmor(p."text"), %s, '{text_field.cipher_name}'), 'utf-8'),
+                q.query,
+                %s
+            )
+        FROM {table} AS p
+        JOIN {file_table} AS f ON f.id = p."fileId", q
+        WHERE p."fileId" = ANY(%s) AND p."tsPassage" @@ q.query
+        ORDER BY p."fileId", ts_rank(p."tsPassage", q.query) DESC, p."position"
+    """
+    params = [
+        list(files_by_id),
+        query_text,
+        text_field.cipher_key,
+        HEADLINE_OPTIONS,
+        list(files_by_id),
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        for file_id, headline in cursor.fetchall():
+            file = files_by_id[file_id]
+            file.snippet, file.highlights = parse_highlights(headline)
@@ -1,5 +1,35 @@
-"""Repository functions for managing queued tasks."""
-from django_q.models import Task
+"""Repository functions for managing queued tasks.
+
+Provider tasks (fetching, syncing and downloading files) are not handed to django-q
+directly. They are stored as ScheduledJob rows and dispatched by dispatch_tasks,
+which keeps every user below a concurrency cap and orders the remaining jobs with
+start-time fair queuing. A user with a huge drive therefore cannot occupy every
+worker of a cluster while newly onboarded users wait.
+"""
+
+import threading
+from collections import Counter
+from datetime import timedelta
+from time import monotonic
+from typing import Callable
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Count, Max, Min, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from django_q.models import OrmQ, Task
+from django_q.tasks import async_task
+
+from repository.file import fetch_downloadable_files
+from repository.models import ScheduledJob, Service
+from repository.service import clear_download_checkpoint, save_download_checkpoint
+
+# Maximum number of pending jobs looked at per dispatch
+DISPATCH_SCAN_LIMIT = 1000
+
+# Queued by dotted path, the segment index imports from the repository
+WRITE_SEGMENT_TASK = "p7.search.segment_index.write_user_segment"
 
 
 def delete_user_queued_tasks(user_id: int) -> None:
@@ -9,3 +39,360 @@ def delete_user_queued_tasks(user_id: int) -> None:
     Task.objects.filter(
         group__icontains=f"-{user_id}",
     ).delete()
+    ScheduledJob.objects.filter(userId_id=user_id).delete()
+
+
+def user_id_from_group(group: str) -> int:
+    """
+    Extract the user id from a task group such as "Dropbox-12" or "Google-Drive-12".
+    """
+    return int(group.rsplit("-", 1)[1])
+
+
+def _lock_scheduler() -> None:
+    """Serialize scheduler bookkeeping across workers for the current transaction."""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext('scheduled_job'))")
+
+
+def _cluster_workers(cluster: str) -> int:
+    """Number of jobs that may run at once in a cluster."""
+    cluster_settings = settings.Q_CLUSTER.get("ALT_CLUSTERS", {}).get(cluster, {})
+    workers = cluster_settings.get("workers", settings.Q_CLUSTER["workers"])
+    # A global cap keeps background load flat, e.g. syncs on the low cluster
+    cap = settings.TASK_SCHEDULER.get("max_running_per_cluster", {}).get(cluster, workers)
+    return max(1, min(workers, cap))
+
+
+def _cluster_names() -> list[str]:
+    """Names of all django-q clusters jobs can be dispatched to."""
+    return list(settings.Q_CLUSTER.get("ALT_CLUSTERS", {})) or [settings.Q_CLUSTER["name"]]
+
+
+def _lease_expiry():
+    """When the lease of a job started or renewed now runs out."""
+    return timezone.now() + timedelta(seconds=settings.TASK_SCHEDULER["job_lease_seconds"])
+
+
+def _release_stale_jobs() -> None:
+    """
+    Forget running jobs whose lease ran out.
+    Their worker was killed (timeout, recycle, deploy) before the job could finish,
+    so the heartbeat of run_scheduled_job stopped renewing the lease.
+    """
+    ScheduledJob.objects.filter(
+        status=ScheduledJob.RUNNING, leaseExpiresAt__lt=timezone.now()
+    ).delete()
+
+
+class _LeaseHeartbeat(threading.Thread):
+    """Renews the lease of a running job until stop() is called."""
+
+    def __init__(self, job_id: int):
+        super().__init__(daemon=True)
+        self.job_id = job_id
+        self._stopped = threading.Event()
+
+    def run(self):
+        interval = settings.TASK_SCHEDULER["job_lease_seconds"] / 3
+        try:
+            while not self._stopped.wait(interval):
+                try:
+                    ScheduledJob.objects.filter(
+                        pk=self.job_id, status=ScheduledJob.RUNNING
+                    ).update(leaseExpiresAt=_lease_expiry())
+                except DatabaseError:
+                    pass  # Renewed on the next beat, the lease outlasts two misses
+        finally:
+            connection.close()  # The connection of this thread
+
+    def stop(self) -> None:
+        """Stop renewing the lease."""
+        self._stopped.set()
+        self.join()
+
+
+def submit_task(
+    func: Callable | str,
+    *args,
+    group: str,
+    cluster: str = "high",
+    cost: float = 1.0,
+    weight: float = 1.0,
+    rerun_if_running: bool = True,
+    **kwargs,
+) -> str | None:
+    """
+    Queue a provider task for a user and dispatch it when the user has a free slot.
+    Drop-in replacement for django-q's async_task for per-user work.
+
+    Tasks are coalesced per (operation, service), i.e. per function and group.
+    A duplicate of a pending job is merged into it. A duplicate of a running job
+    marks that job to run once more after it finishes, instead of running alongside.
+    Running jobs whose lease ran out are released first, a duplicate of one is queued
+    as a new job instead of waiting on a job that will never finish.
+
+    params:
+        func: The task function or its dotted path.
+        args, kwargs: Arguments passed to the task function.
+        group: The django-q group, e.g. "Dropbox-{user_id}". The user is taken from it.
+        cluster: The django-q cluster to run the task on.
+        cost: Estimated amount of work, e.g. the number of files in a download batch.
+        weight: The user's share of the workers relative to other users.
+        rerun_if_running: False when a running job queues its own continuation.
+    returns:
+        The django-q task id if the job (or the job it was merged into) has started,
+        otherwise None.
+    """
+    func_path = func if isinstance(func, str) else f"{func.__module__}.{func.__qualname__}"
+    user_id = user_id_from_group(group)
+    dedupe_key = f"{func_path}:{group}"
+
+    with transaction.atomic():
+        _lock_scheduler()
+        _release_stale_jobs()
+        duplicate = ScheduledJob.objects.filter(dedupeKey=dedupe_key).order_by("status").first()
+        if duplicate and (duplicate.status == ScheduledJob.PENDING or rerun_if_running):
+            if duplicate.status == ScheduledJob.RUNNING:
+                duplicate.rerunArgs = list(args)
+                duplicate.rerunKwargs = kwargs
+                duplicate.save(update_fields=["rerunArgs", "rerunKwargs"])
+            return duplicate.taskId
+
+        queued = ScheduledJob.objects.filter(cluster=cluster)
+
+        # Virtual time is the start tag at the front of the queue (or in service)
+        virtual_time = (
+            queued.filter(status=ScheduledJob.PENDING).aggregate(v=Min("virtualStart"))["v"]
+            or queued.filter(status=ScheduledJob.RUNNING).aggregate(v=Max("virtualStart"))["v"]
+            or 0.0
+        )
+        # A user queues behind their own earlier jobs, but never gets credit for idle time
+        user_finish = queued.filter(userId_id=user_id).aggregate(
+            v=Max("virtualFinish")
+        )["v"] or 0.0
+
+        virtual_start = max(virtual_time, user_finish)
+        job = ScheduledJob.objects.create(
+            userId_id=user_id,
+            group=group,
+            func=func_path,
+            dedupeKey=dedupe_key,
+            args=list(args),
+            kwargs=kwargs,
+            cluster=cluster,
+            cost=cost,
+            weight=weight,
+            virtualStart=virtual_start,
+            virtualFinish=virtual_start + cost / weight,
+        )
+
+    started = dispatch_tasks(cluster)
+    return next((j.taskId for j in started if j.pk == job.pk), None)
+
+
+class DownloadBatch:
+    """
+    A bounded slice of a download pass, checkpointed on the service.
+
+    A pass walks a service's pending files in id order. Each task handles at most
+    download_batch_size files or download_batch_seconds, records the last handled
+    file in Service.downloadCursor and queues the rest as a new task. A task that
+    dies (timeout, recycle, deploy) is resumed from the checkpoint by the next run
+    instead of restarting the pass.
+
+    Usage:
+        batch = DownloadBatch(service, after_id)
+        for file in batch:
+            ...
+        index_writer.flush()
+        batch.finish(process_download_dropbox_files, group=f"Dropbox-{user_id}")
+    """
+
+    def __init__(self, service: Service, after_id: int | None = None):
+        self.service = service
+        batch_size = settings.TASK_SCHEDULER["download_batch_size"]
+        if after_id is None:
+            after_id = service.downloadCursor  # Resume an interrupted pass
+        self.processed_id = after_id
+        self.files = fetch_downloadable_files(service, after_id, batch_size)
+        self.exhausted = len(self.files) < batch_size
+        if not self.files:
+            # Nothing left, the pass is complete
+            if service.downloadCursor is not None:
+                clear_download_checkpoint(service)
+            self._schedule_segment_write()
+        self.deadline = monotonic() + settings.TASK_SCHEDULER["download_batch_seconds"]
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    def __iter__(self):
+        for position, file in enumerate(self.files):
+            # At least one file per task, so a pass always makes progress
+            if position and monotonic() > self.deadline:
+                self.exhausted = False
+                return
+            yield file
+            # Reached once the caller's loop body is done with the file
+            self.processed_id = file.pk
+
+    def _schedule_segment_write(self) -> None:
+        """Add the files of a completed pass to the user's postings segments."""
+        if settings.SEARCH_SEGMENTS["enabled"]:
+            user_id = self.service.userId_id
+            submit_task(WRITE_SEGMENT_TASK, user_id, group=f"Segments-{user_id}", cluster="low")
+
+    def finish(self, func: Callable | str, group: str, cluster: str = "high") -> str | None:
+        """
+        Checkpoint the batch and queue the remainder of the pass.
+        Call after the batch's content has been written.
+
+        params:
+            func: The task function or its dotted path, called as func(user_id, after_id=...).
+            group: The django-q group of the task.
+        returns:
+            The django-q task id of the next batch, or None when the pass is done.
+        """
+        if self.exhausted and (not self.files or self.processed_id == self.files[-1].pk):
+            clear_download_checkpoint(self.service)
+            self._schedule_segment_write()
+            return None
+
+        save_download_checkpoint(self.service, self.processed_id)
+        return submit_task(
+            func,
+            self.service.userId_id,
+            group=group,
+            cluster=cluster,
+            cost=settings.TASK_SCHEDULER["download_batch_size"],
+            rerun_if_running=False,
+            after_id=self.processed_id,
+        )
+
+
+def submit_scheduled_task(func: str, *args, group: str, priority: str = "low", **kwargs):
+    """
+    Entry point for django-q schedules, so periodic syncs go through submit_task
+    and coalesce with syncs triggered by the API.
+    """
+    return submit_task(func, *args, group=group, cluster=priority, priority=priority, **kwargs)
+
+
+def dispatch_tasks(cluster: str = "high") -> list[ScheduledJob]:
+    """
+    Hand pending jobs to django-q while the cluster has free workers.
+    Jobs are taken in virtual start order, skipping users at their concurrency cap.
+
+    returns:
+        The jobs that were started.
+    """
+    max_running_per_user = settings.TASK_SCHEDULER["max_running_per_user"]
+    to_start = []
+
+    with transaction.atomic():
+        _lock_scheduler()
+        _release_stale_jobs()
+
+        running = ScheduledJob.objects.filter(status=ScheduledJob.RUNNING)
+        free_workers = _cluster_workers(cluster) - running.filter(cluster=cluster).count()
+        # The per-user cap spans all clusters
+        running_per_user = Counter(running.values_list("userId_id", flat=True))
+
+        pending = ScheduledJob.objects.filter(
+            cluster=cluster, status=ScheduledJob.PENDING
+        ).order_by("virtualStart", "id")
+
+        for job in pending[:DISPATCH_SCAN_LIMIT]:
+            if free_workers <= 0:
+                break
+            if running_per_user[job.userId_id] >= max_running_per_user:
+                continue
+            running_per_user[job.userId_id] += 1
+            free_workers -= 1
+            to_start.append(job)
+
+        ScheduledJob.objects.filter(pk__in=[job.pk for job in to_start]).update(
+            status=ScheduledJob.RUNNING, startedAt=timezone.now(), leaseExpiresAt=_lease_expiry()
+        )
+
+    # Enqueue outside the transaction, in sync mode django-q runs the task right here
+    for job in to_start:
+        job.taskId = async_task(
+            run_scheduled_job, job.pk, cluster=job.cluster, group=job.group
+        )
+        ScheduledJob.objects.filter(pk=job.pk).update(taskId=job.taskId)
+
+    return to_start
+
+
+def dispatch_all_clusters() -> int:
+    """
+    Entry point of the dispatch schedule, see p7/sync_files/planner.py.
+    Starts pending jobs of every cluster when no submit or finishing job does, such
+    as once the lease of jobs left running by a killed worker has run out.
+
+    returns:
+        The number of jobs started.
+    """
+    return sum(len(dispatch_tasks(cluster)) for cluster in _cluster_names())
+
+
+def run_scheduled_job(job_id: int):
+    """
+    django-q entry point for a dispatched job.
+    Runs the task while renewing its lease, then frees the user's slot and
+    dispatches waiting jobs.
+    """
+    job = ScheduledJob.objects.filter(pk=job_id).first()
+    if job is None:
+        return None  # User was deleted, or the lease ran out, while the job was queued
+
+    heartbeat = _LeaseHeartbeat(job_id)
+    heartbeat.start()
+    try:
+        return import_string(job.func)(*job.args, **job.kwargs)
+    finally:
+        heartbeat.stop()
+        with transaction.atomic():
+            _lock_scheduler()
+            # Re-read, duplicates submitted while running set the rerun arguments
+            job = ScheduledJob.objects.filter(pk=job_id).first()
+            ScheduledJob.objects.filter(pk=job_id).delete()
+
+        if job is not None and job.rerunArgs is not None:
+            submit_task(
+                job.func,
+                *job.rerunArgs,
+                group=job.group,
+                cluster=job.cluster,
+                **job.rerunKwargs,
+            )
+        dispatch_all_clusters()
+
+
+def pending_jobs_for_user(user_id: int) -> int:
+    """Number of jobs a user has waiting or running."""
+    return ScheduledJob.objects.filter(
+        Q(status=ScheduledJob.PENDING) | Q(status=ScheduledJob.RUNNING),
+        userId_id=user_id,
+    ).count()
+
+
+def queue_depth_per_cluster() -> dict:
+    """
+    Counts tasks waiting in the django-q broker and jobs held by the scheduler.
+
+    returns:
+        {"queued": {cluster: count}, "scheduled": {(cluster, status): count}}
+    """
+    queued = OrmQ.objects.values_list("key").annotate(depth=Count("id")).order_by()
+    scheduled = (
+        ScheduledJob.objects.values_list("cluster", "status")
+        .annotate(depth=Count("id"))
+        .order_by()
+    )
+    return {
+        "queued": dict(queued),
+        "scheduled": {(cluster, status): depth for cluster, status, depth in scheduled},
+    }
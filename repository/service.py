@@ -3,6 +3,7 @@
 from typing import Any
 from django.http import JsonResponse
 from django.db import IntegrityError
+from django.utils import timezone
 from repository.models import Service
 
 
@@ -67,6 +68,30 @@ def get_all_user_services(user_id) -> list[Service]:
         )
 
 
+async def aget_user_service_names(user_id, service_ids=None) -> dict[int, str]:
+    """
+    Fetches the names of a user's services in one query, keyed by service id.
+    Limited to service_ids when given.
+    """
+    services = Service.objects.filter(userId_id=user_id)
+    if service_ids is not None:
+        services = services.filter(id__in=service_ids)
+    return {service_id: name async for service_id, name in services.values_list("id", "name")}
+
+
+async def aget_all_user_services(user_id) -> list[Service] | JsonResponse:
+    """
+    Gets all services for a given user, async version of get_all_user_services
+    """
+    try:
+        services = Service.objects.filter(userId_id=user_id).select_related("userId")
+        return [service async for service in services]
+    except (ValueError, TypeError, RuntimeError) as e:
+        return JsonResponse(
+            {"error": "Failed to retrieve service", "detail": str(e)}, status=500
+        )
+
+
 def get_user_service_related_to_email(email) -> Service:
     """
     Get a user based on email connected to service
@@ -151,3 +176,22 @@ def serialize_service(service: Service) -> dict[str, Any]:
         "email": service.email,
         "scopeName": service.scopeName,
     }
+
+
+def save_download_checkpoint(service: Service, file_id: int | None) -> None:
+    """
+    Records the last file of a service whose download has been committed.
+    """
+    service.downloadCursor = file_id
+    service.downloadCheckpointAt = timezone.now()
+    Service.objects.filter(pk=service.pk).update(
+        downloadCursor=file_id,
+        downloadCheckpointAt=service.downloadCheckpointAt,
+    )
+
+
+def clear_download_checkpoint(service: Service) -> None:
+    """
+    Clears the download checkpoint once a pass over the service's files is complete.
+    """
+    save_download_checkpoint(service, None)
@@ -0,0 +1,113 @@
+"""
+Repository helpers for the corpus statistics read by content ranking.
+
+Each CorpusStatistics row sums the files of one service with one extension. A change
+to a file's extension, contentLength or tsContent is applied to the rows in the
+transaction making it: the file's contribution is subtracted before the change and
+added back after it. A user's rows are built from their files on first use.
+"""
+
+from typing import NamedTuple
+
+from django.db import connection, transaction
+from django.db.models import Q, Sum
+
+from repository.models import CorpusStatistics, File, Service, User
+
+
+class CorpusSnapshot(NamedTuple):
+    """Statistics of the files a search ranks."""
+
+    documents: int
+    # Average contentLength of the files that have one, like Avg("contentLength")
+    average_length: float | None
+    total_postings: int
+
+
+def _add_contributions(cursor, where_sql: str, params: list, sign: int) -> None:
+    """Add the statistics of the files matching where_sql to their rows, times sign."""
+    statistics_table = connection.ops.quote_name(CorpusStatistics._meta.db_table)
+    file_table = connection.ops.quote_name(File._meta.db_table)
+    service_table = connection.ops.quote_name(Service._meta.db_table)
+    cursor.execute(
+        f"""
+        INSERT INTO {statistics_table} AS c ("serviceId", "extension", "documentCount",
+            "contentDocumentCount", "totalLength", "totalPostings")
+        SELECT f."serviceId", f."extension", %s * count(*), %s * count(f."contentLength"),
+            %s * coalesce(sum(f."contentLength"), 0),
+            %s * coalesce(sum(length(f."tsContent")), 0)
+        FROM {file_table} AS f
+        JOIN {service_table} AS s ON s.id = f."serviceId"
+        WHERE {where_sql}
+        GROUP BY f."serviceId", f."extension"
+        ON CONFLICT ("serviceId", "extension") DO UPDATE SET
+            "documentCount" = c."documentCount" + EXCLUDED."documentCount",
+            "contentDocumentCount" = c."contentDocumentCount" + EXCLUDED."contentDocumentCount",
+            "totalLength" = c."totalLength" + EXCLUDED."totalLength",
+            "totalPostings" = c."totalPostings" + EXCLUDED."totalPostings"
+        """,
+        [sign] * 4 + params,
+    )
+
+
+def add_file_statistics(file_ids: list[int]) -> None:
+    """Count files in the statistics, after they are created or changed."""
+    if file_ids:
+        with connection.cursor() as cursor:
+            _add_contributions(cursor, "f.id = ANY(%s)", [list(file_ids)], 1)
+
+
+def remove_file_statistics(file_ids: list[int]) -> None:
+    """Remove files from the statistics, before they are changed or deleted."""
+    if file_ids:
+        with connection.cursor() as cursor:
+            _add_contributions(cursor, "f.id = ANY(%s)", [list(file_ids)], -1)
+
+
+def rebuild_user_corpus_statistics(user_id: int) -> None:
+    """Replace a user's statistics with ones counted from their files."""
+    statistics_table = connection.ops.quote_name(CorpusStatistics._meta.db_table)
+    service_table = connection.ops.quote_name(Service._meta.db_table)
+    with transaction.atomic(), connection.cursor() as cursor:
+        # Changes committed after the delete are counted by the insert or added to it
+        cursor.execute(
+            f"""
+            DELETE FROM {statistics_table}
+            WHERE "serviceId" IN (SELECT id FROM {service_table} WHERE "userId" = %s)
+            """,
+            [user_id],
+        )
+        _add_contributions(cursor, 's."userId" = %s', [user_id], 1)
+        User.objects.filter(pk=user_id).update(corpusStatisticsBuilt=True)
+
+
+def user_corpus_statistics(user: User, provider=None, extension=None) -> CorpusSnapshot:
+    """
+    Statistics of the user's files passing the provider and extension filters of
+    query_files, summed over a few rows instead of counted over the files.
+    """
+    if not user.corpusStatisticsBuilt:
+        rebuild_user_corpus_statistics(user.pk)
+        user.corpusStatisticsBuilt = True
+
+    # Every provider and extension must match, like the filters of query_files
+    q = Q(serviceId__userId=user.pk)
+    for p in provider or ():
+        q &= Q(serviceId__name__iexact=p)
+    for ext in extension or ():
+        q &= Q(extension__iexact=ext)
+    totals = CorpusStatistics.objects.filter(q).aggregate(
+        documents=Sum("documentCount"),
+        content_documents=Sum("contentDocumentCount"),
+        total_length=Sum("totalLength"),
+        total_postings=Sum("totalPostings"),
+    )
+    return CorpusSnapshot(
+        documents=totals["documents"] or 0,
+        average_length=(
+            totals["total_length"] / totals["content_documents"]
+            if totals["content_documents"]
+            else None
+        ),
+        total_postings=totals["total_postings"] or 0,
+    )
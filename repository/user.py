@@ -12,6 +12,7 @@ from django.http import JsonResponse
 from repository.models import User
 from repository.queue import delete_user_queued_tasks
 from repository.schedule import delete_user_schedules
+from p7.search.segment_index import remove_user_segments
 
 def get_user(user_id: int) -> Union[User, JsonResponse]:
     """
@@ -31,6 +32,22 @@ def get_user(user_id: int) -> Union[User, JsonResponse]:
         )
 
 
+async def aget_user(user_id: int) -> Union[User, JsonResponse]:
+    """
+    Gets a user from the database, async version of get_user
+    """
+    try:
+        return await User.objects.aget(pk=user_id)
+    except (ValueError, TypeError) as e:
+        return JsonResponse({"error": "Invalid user id", "detail": str(e)}, status=400)
+    except User.DoesNotExist:
+        return JsonResponse({"error": "User not found"}, status=404)
+    except RuntimeError as e:
+        return JsonResponse(
+            {"error": "Failed to retrieve user", "detail": str(e)}, status=500
+        )
+
+
 def save_user() -> Union[User, JsonResponse]:
     """Create and persist a new User.
 
@@ -64,6 +81,7 @@ def delete_user(user_id: int) -> Union[User, JsonResponse]:
         delete_user_queued_tasks(user_id)
         delete_user_schedules(user_id)
         user.delete()
+        remove_user_segments(user_id)
         return {"status": 200}
     except User.DoesNotExist:
         return JsonResponse({"error": "User not found"}, status=404)
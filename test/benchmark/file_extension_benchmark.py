@@ -0,0 +1,62 @@
+"""
+Micro-benchmark for the per-file cost of extension classification.
+
+Measures smart_extension() and downloadable_file_extensions() as they are called
+for every synced file. Run from the backend directory:
+
+    python test/benchmark/file_extension_benchmark.py
+"""
+
+import sys
+import timeit
+from pathlib import Path
+
+# Make the local backend package importable so `from p7...` works
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from p7.helpers import smart_extension, downloadable_file_extensions
+
+# Representative file listing: (provider, name, mime)
+SAMPLE_FILES = [
+    ("dropbox", "Quarterly report.pdf", None),
+    ("dropbox", "notes.md", None),
+    ("google", "Budget", "application/vnd.google-apps.spreadsheet"),
+    ("google", "Meeting notes", "application/vnd.google-apps.document"),
+    ("onedrive", "backup.tar.gz", "application/gzip"),
+    ("onedrive", "photo.heic", "image/heic"),
+    ("local", ".gitignore", None),
+    ("local", "..docx", None),
+]
+
+
+def classify_listing(files):
+    """Classify a file listing the way the sync and download stages do."""
+    downloadable = downloadable_file_extensions()
+    for provider, name, mime in files:
+        _ = smart_extension(provider, name, mime) in downloadable
+
+
+def unique_listing(count):
+    """A listing of uniquely named files, so no classification can be reused."""
+    return [
+        (provider, f"{index}-{name}", mime)
+        for index in range(count // len(SAMPLE_FILES) + 1)
+        for provider, name, mime in SAMPLE_FILES
+    ][:count]
+
+
+def report(label, files, cold=False, repeat=5):
+    """Print the best per-file cost in microseconds over `repeat` runs.
+    With cold=True the classification cache is emptied before each run."""
+    best = min(timeit.repeat(
+        lambda: classify_listing(files),
+        setup=smart_extension.cache_clear if cold else "pass",
+        number=1,
+        repeat=repeat,
+    ))
+    print(f"{label:<28} {best / len(files) * 1_000_000:10.2f} us/file")
+
+
+if __name__ == "__main__":
+    report("repeated names (warm)", SAMPLE_FILES * 1250)
+    report("unique names (cold cache)", unique_listing(10_000), cold=True)
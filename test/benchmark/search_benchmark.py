@@ -0,0 +1,418 @@
+"""
+Benchmark for the search hot path on synthetic corpora.
+
+Generates one synthetic user per corpus size (by default 1k, 10k and 100k files)
+with realistic tsFilename/tsContent vectors, then times each stage of a search
+separately:
+
+    query_files                    the whole search as called by /api/search/
+    ranking_based_on_file_name     filename ranking queryset, evaluated
+    ranking_based_on_content       tf-idf content ranking, evaluated
+    ranking_based_on_content_bm25  BM25 content ranking, evaluated
+    combine_rankings               fusion of the two ranked lists (no database)
+
+For every stage the p50/p95/p99 latency and the number of SQL queries per search
+are reported. The two content rankings are also compared on every query: how many
+of their top 10 files agree, and the average length of the files each puts in its
+top 10, since ltc/lnc tends to pass over long files. Results can be stored as a
+baseline JSON and later runs compared against it, failing when a stage gets slower or
+issues more queries.
+
+The corpora are written to the database configured through the usual DATABASE_*
+environment variables, use a local, migrated database that can be thrown away.
+Corpora are kept between runs and reused, pass --fresh to regenerate them.
+Run from the backend directory:
+
+    python test/benchmark/search_benchmark.py --save-baseline
+    python test/benchmark/search_benchmark.py --check
+    python test/benchmark/search_benchmark.py --sizes 1000 --runs 3 --drop
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import timedelta
+from pathlib import Path
+
+# Make the local backend package importable so `from p7...` works
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "p7.settings")
+
+import django
+
+django.setup()
+
+from django.db import connection
+from django.db.models import Q
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from repository.file import bulk_update_tsvector_content, combine_rankings, query_files
+from repository.helpers import blind_index_key_id, service_file_id_hash
+from repository.models import File, Service, User
+from repository.passage import highlight_best_passages
+
+BASELINE_PATH = Path(__file__).with_name("search_baseline.json")
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+INSERT_BATCH_SIZE = 2_000
+VOCABULARY_SIZE = 20_000
+EXTENSIONS = [".pdf", ".docx", ".txt", ".md", ".xlsx", ".pptx", ".csv", ".odt"]
+SYLLABLES = [
+    "al", "ban", "cor", "da", "el", "fen", "gor", "hal", "in", "jor", "ka", "lin",
+    "mar", "nor", "os", "pel", "qua", "ris", "sen", "tor", "ul", "ven", "wes", "yor",
+]
+# Real words mixed into the vocabulary so stemming and stop words behave as in practice
+COMMON_WORDS = [
+    "report", "budget", "meeting", "notes", "project", "invoice", "contract", "plan",
+    "summary", "review", "design", "customer", "sales", "quarterly", "annual", "draft",
+    "final", "presentation", "analysis", "schedule", "team", "product", "research",
+    "proposal", "minutes", "policy", "training", "strategy", "marketing", "finance",
+]
+STAGES = [
+    "query_files",
+    "ranking_based_on_file_name",
+    "ranking_based_on_content",
+    "ranking_based_on_content_bm25",
+    "combine_rankings",
+    "highlight_best_passages",
+]
+
+
+def build_vocabulary(rng: random.Random) -> list[str]:
+    """Common words followed by pseudo words, most frequent first."""
+    words = list(COMMON_WORDS)
+    seen = set(words)
+    while len(words) < VOCABULARY_SIZE:
+        word = "".join(rng.choices(SYLLABLES, k=rng.randint(2, 4)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+
+class Corpus:
+    """Zipf distributed file names and contents over a fixed vocabulary."""
+
+    def __init__(self, seed: int):
+        self.rng = random.Random(seed)
+        self.vocabulary = build_vocabulary(self.rng)
+        self.weights = [1 / rank for rank in range(1, len(self.vocabulary) + 1)]
+
+    def words(self, count: int) -> list[str]:
+        """Draw words with Zipf frequencies."""
+        return self.rng.choices(self.vocabulary, weights=self.weights, k=count)
+
+    def file_name(self) -> tuple[str, str]:
+        """A name of two to five words and an extension."""
+        extension = self.rng.choice(EXTENSIONS)
+        separator = self.rng.choice([" ", "_", "-"])
+        return separator.join(self.words(self.rng.randint(2, 5))) + extension, extension
+
+    def content(self) -> str:
+        """Sentences of Zipf distributed words, document lengths vary widely."""
+        length = int(self.rng.lognormvariate(5.5, 1.0))
+        return " ".join(self.words(max(5, min(length, 20_000))))
+
+    def queries(self, count: int) -> list[str]:
+        """Queries with common, mid frequency, rare and multi term mixes."""
+        buckets = [
+            (0, 30),
+            (30, 500),
+            (500, 5_000),
+            (5_000, VOCABULARY_SIZE),
+        ]
+        queries = []
+        for index in range(count):
+            terms = []
+            for _ in range(1 + index % 3):
+                low, high = buckets[self.rng.randrange(len(buckets))]
+                terms.append(self.vocabulary[self.rng.randrange(low, high)])
+            queries.append(" ".join(terms))
+        return queries
+
+
+def benchmark_email(size: int) -> str:
+    """Email identifying the service of a benchmark corpus."""
+    return f"search-benchmark-{size}@example.invalid"
+
+
+def find_corpus(size: int) -> Service | None:
+    """The service holding an existing corpus of the given size, if complete."""
+    service = Service.objects.filter(email=benchmark_email(size)).first()
+    if service is not None and File.objects.filter(serviceId=service).count() == size:
+        return service
+    return None
+
+
+def drop_corpus(size: int) -> None:
+    """Delete the benchmark user of a corpus size, files cascade."""
+    user_ids = Service.objects.filter(email=benchmark_email(size)).values_list(
+        "userId_id", flat=True
+    )
+    User.objects.filter(pk__in=list(user_ids)).delete()
+
+
+def update_filename_vectors(rows: list[tuple[int, str]]) -> None:
+    """Build tsFilename for many files in one statement, like save_file does per file."""
+    values_sql = ", ".join(["(%s::bigint, %s::text)"] * len(rows))
+    sql = f"""
+        UPDATE {connection.ops.quote_name(File._meta.db_table)} AS f
+        SET "tsFilename" = setweight(to_tsvector('simple', v.name), 'A')
+        FROM (VALUES {values_sql}) AS v(id, name)
+        WHERE f.id = v.id
+    """
+    params = [value for row in rows for value in row]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def generate_corpus(size: int, corpus: Corpus) -> Service:
+    """Create a user with one service holding `size` indexed files."""
+    drop_corpus(size)
+    user = User.objects.create()
+    service = Service.objects.create(
+        userId=user,
+        oauthType="benchmark",
+        oauthToken="benchmark",
+        accessToken="benchmark",
+        accessTokenExpiration=timezone.now() + timedelta(days=3650),
+        refreshToken="benchmark",
+        name="dropbox",
+        accountId=f"benchmark-{size}",
+        email=benchmark_email(size),
+        scopeName="files.read",
+        fileIdHashKeyId=blind_index_key_id(),
+    )
+
+    now = timezone.now()
+    for start in range(0, size, INSERT_BATCH_SIZE):
+        batch = []
+        names = []
+        for index in range(start, min(start + INSERT_BATCH_SIZE, size)):
+            name, extension = corpus.file_name()
+            names.append(name)
+            batch.append(File(
+                serviceId=service,
+                serviceFileId=f"bench-{index}",
+                # bulk_create skips File.save, which sets the blind index
+                serviceFileIdHash=service_file_id_hash(f"bench-{index}"),
+                name=name,
+                extension=extension,
+                downloadable=True,
+                path=f"/benchmark/{name}",
+                link=f"https://example.invalid/{index}",
+                size=corpus.rng.randint(1_000, 5_000_000),
+                createdAt=now,
+                modifiedAt=now,
+            ))
+        files = File.objects.bulk_create(batch)
+
+        update_filename_vectors([
+            (file.pk, name.rsplit(".", 1)[0].replace("_", " ").replace("-", " "))
+            for file, name in zip(files, names)
+        ])
+        bulk_update_tsvector_content([(file.pk, corpus.content(), now) for file in files])
+        print(f"  {size}: {min(start + INSERT_BATCH_SIZE, size)} files", end="\r")
+
+    print()
+    return service
+
+
+def percentiles(samples: list[float]) -> dict:
+    """p50/p95/p99 in milliseconds."""
+    if len(samples) < 2:
+        samples = samples * 2
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return {
+        "p50_ms": round(cuts[49] * 1000, 3),
+        "p95_ms": round(cuts[94] * 1000, 3),
+        "p99_ms": round(cuts[98] * 1000, 3),
+    }
+
+
+def measure(func, runs: int) -> tuple[list[float], list[int]]:
+    """Time `func` `runs` times after one warm up run, counting SQL queries."""
+    func()
+    timings, query_counts = [], []
+    for _ in range(runs):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+        query_counts.append(len(queries))
+    return timings, query_counts
+
+
+def search_stages(user_id: int, query: str) -> dict:
+    """Callables for every measured stage of one search."""
+    base_filter = Q(serviceId__userId=user_id)
+    name_ranked = list(File.objects.ranking_based_on_file_name(query, base_filter=base_filter))
+    content_ranked = list(File.objects.ranking_based_on_content(query, base_filter=base_filter))
+    results = combine_rankings(name_ranked, content_ranked)[:200]
+
+    return {
+        "query_files": lambda: query_files(query.split(), user_id),
+        "ranking_based_on_file_name": lambda: list(
+            File.objects.ranking_based_on_file_name(query, base_filter=base_filter)
+        ),
+        "ranking_based_on_content": lambda: list(
+            File.objects.ranking_based_on_content(query, base_filter=base_filter)
+        ),
+        "ranking_based_on_content_bm25": lambda: list(
+            File.objects.ranking_based_on_content(
+                query, base_filter=base_filter, ranking="bm25"
+            )
+        ),
+        "combine_rankings": lambda: combine_rankings(name_ranked, content_ranked),
+        "highlight_best_passages": lambda: highlight_best_passages(results, query),
+    }
+
+
+def run_benchmark(size: int, service: Service, queries: list[str], runs: int) -> dict:
+    """Measure all stages for every query on one corpus."""
+    samples = {stage: ([], []) for stage in STAGES}
+    for query in queries:
+        for stage, func in search_stages(service.userId_id, query).items():
+            timings, query_counts = measure(func, runs)
+            samples[stage][0].extend(timings)
+            samples[stage][1].extend(query_counts)
+
+    results = {}
+    for stage, (timings, query_counts) in samples.items():
+        results[stage] = {
+            **percentiles(timings),
+            "queries_mean": round(statistics.fmean(query_counts), 2),
+            "queries_max": max(query_counts),
+            "samples": len(timings),
+        }
+        print(
+            f"{size:>8} {stage:<28} "
+            f"p50 {results[stage]['p50_ms']:9.2f} ms  "
+            f"p95 {results[stage]['p95_ms']:9.2f} ms  "
+            f"p99 {results[stage]['p99_ms']:9.2f} ms  "
+            f"queries {results[stage]['queries_mean']:7.1f}"
+        )
+    return results
+
+
+def top_files(user_id: int, query: str, ranking: str, count: int = 10) -> list[File]:
+    """The best content matches of a query under one ranking."""
+    ranked = File.objects.ranking_based_on_content(
+        query, base_filter=Q(serviceId__userId=user_id), ranking=ranking
+    )
+    return sorted(ranked, key=lambda file: (-file.rank, file.id))[:count]
+
+
+def compare_rankings(size: int, service: Service, queries: list[str]) -> dict:
+    """Agreement of the tf-idf and BM25 top 10, and the length of the files they pick."""
+    overlaps, lengths = [], {"tfidf": [], "bm25": []}
+    for query in queries:
+        tops = {ranking: top_files(service.userId_id, query, ranking) for ranking in lengths}
+        if not tops["tfidf"]:
+            continue
+        shared = {f.id for f in tops["tfidf"]} & {f.id for f in tops["bm25"]}
+        overlaps.append(len(shared) / len(tops["tfidf"]))
+        for ranking, files in tops.items():
+            lengths[ranking].extend(f.contentLength or 0 for f in files)
+
+    result = {
+        "top10_overlap": round(statistics.fmean(overlaps), 3) if overlaps else None,
+        **{
+            f"{ranking}_top10_mean_length": round(statistics.fmean(values), 1)
+            for ranking, values in lengths.items()
+            if values
+        },
+    }
+    print(f"{size:>8} rankings {json.dumps(result)}")
+    return result
+
+
+def compare_to_baseline(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Stages that got slower at p95 beyond the tolerance or issue more queries."""
+    regressions = []
+    for size, stages in report["results"].items():
+        for stage, result in stages.items():
+            before = baseline.get("results", {}).get(size, {}).get(stage)
+            if before is None:
+                continue
+            if result["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+                regressions.append(
+                    f"{size} {stage}: p95 {before['p95_ms']} -> {result['p95_ms']} ms"
+                )
+            if result["queries_max"] > before["queries_max"]:
+                regressions.append(
+                    f"{size} {stage}: queries {before['queries_max']} -> {result['queries_max']}"
+                )
+    return regressions
+
+
+def parse_args():
+    """Command line options."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--queries", type=int, default=30, help="queries per corpus")
+    parser.add_argument("--runs", type=int, default=5, help="timed runs per query and stage")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--fresh", action="store_true", help="regenerate the corpora")
+    parser.add_argument("--drop", action="store_true", help="delete the corpora afterwards")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--check", action="store_true", help="fail on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 slowdown")
+    parser.add_argument("--output", type=Path, help="also write this run's report here")
+    return parser.parse_args()
+
+
+def main() -> int:
+    """Generate or reuse the corpora, measure, report and compare."""
+    args = parse_args()
+    corpus = Corpus(args.seed)
+    queries = corpus.queries(args.queries)
+
+    report = {
+        "meta": {
+            "seed": args.seed,
+            "queries": args.queries,
+            "runs": args.runs,
+            "postgres": connection.cursor().connection.info.server_version,
+            "created": timezone.now().isoformat(),
+        },
+        "results": {},
+    }
+    for size in args.sizes:
+        service = None if args.fresh else find_corpus(size)
+        if service is None:
+            print(f"Generating corpus of {size} files")
+            service = generate_corpus(size, Corpus(args.seed + size))
+        with connection.cursor() as cursor:
+            cursor.execute(f"ANALYZE {connection.ops.quote_name(File._meta.db_table)}")
+        report["results"][str(size)] = run_benchmark(size, service, queries, args.runs)
+        report.setdefault("rankings", {})[str(size)] = compare_rankings(size, service, queries)
+        if args.drop:
+            drop_corpus(size)
+
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2) + "\n", encoding="utf-8")
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(report, indent=2) + "\n", encoding="utf-8")
+        print(f"Baseline written to {args.baseline}")
+
+    if args.check:
+        if not args.baseline.exists():
+            print(f"No baseline at {args.baseline}, run with --save-baseline first")
+            return 1
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+        regressions = compare_to_baseline(report, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
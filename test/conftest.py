@@ -4,8 +4,8 @@ from django.db import connections
 from django.core.management import call_command
 from django.conf import settings
 
-import psycopg2
-from psycopg2 import sql as psql
+import psycopg
+from psycopg import sql as psql
 
 
 def _admin_conn_kwargs():
@@ -41,10 +41,10 @@ def run_sql(sql_statement):
     """Execute a SQL statement against the admin DB using Django settings.
 
     Example: run_sql("DROP DATABASE IF EXISTS my_test_db")
-    Accepts either a string or a psycopg2.sql.Composed object.
+    Accepts either a string or a psycopg.sql.Composed object.
     """
     kwargs = _admin_conn_kwargs()
-    conn = psycopg2.connect(**kwargs)
+    conn = psycopg.connect(**kwargs)
     try:
         conn.autocommit = True
         with conn.cursor() as cursor:
@@ -56,7 +56,7 @@ def run_sql(sql_statement):
 def terminate_db_connections(dbname):
     """Terminate all other connections to `dbname` (except our own)."""
     kwargs = _admin_conn_kwargs()
-    conn = psycopg2.connect(**kwargs)
+    conn = psycopg.connect(**kwargs)
     try:
         conn.autocommit = True
         with conn.cursor() as cur:
@@ -87,7 +87,7 @@ def django_db_setup():
     # create pg_trgm extension in the newly created test database
     kwargs = _admin_conn_kwargs()
     kwargs['dbname'] = test_db_name
-    conn = psycopg2.connect(**kwargs)
+    conn = psycopg.connect(**kwargs)
     try:
         conn.autocommit = True
         with conn.cursor() as cur:
@@ -211,7 +211,7 @@ def check_tokens_against_ts_vector(file: File, content: str):
     # Tokenize & lexize content (if any)
     content_lexemes = []
     if content:
-        content_tokens = ts_tokenize(content, "english")
+        content_tokens = ts_tokenize(content, obj.language)
         content_lexemes = list(content_tokens)
 
     # Combine and dedupe lexemes from name and content
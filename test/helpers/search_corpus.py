@@ -0,0 +1,61 @@
+"""Helper functions seeding a user with indexed files for the search index tests."""
+
+from datetime import timedelta
+
+from django.utils import timezone
+
+from repository.file import save_file, update_tsvector_content
+from repository.models import Service, User
+
+DOCUMENTS = {
+    "Quarterly report 2024.pdf": "revenue grew and the quarterly budget was approved",
+    "Budget plan.docx": "the budget plan lists revenue targets for every quarter",
+    "Holiday photos.jpg": "",
+    "Report on reports.txt": "a report about writing reports, with no budget at all",
+    "Meeting notes.txt": "notes from the meeting about the holiday schedule",
+}
+
+
+def create_user_with_documents(documents=None):
+    """Create a user with one Dropbox service holding the documents, indexed.
+
+    params:
+        documents (dict): File names mapped to their content, DOCUMENTS by default.
+    returns:
+        The created User.
+    """
+    user = User.objects.create()
+    service = Service.objects.create(
+        userId=user,
+        oauthType="type1",
+        oauthToken="token1",
+        accessToken="access1",
+        accessTokenExpiration=timezone.now() + timedelta(days=365),
+        refreshToken="refresh1",
+        name="dropbox",
+        accountId="account1",
+        email="user1@example.com",
+        scopeName="files.read",
+    )
+    for i, (name, content) in enumerate((documents or DOCUMENTS).items()):
+        file = save_file(
+            service_id=service,
+            service_file_id=f"file_{i}",
+            name=name,
+            extension="." + name.rsplit(".", 1)[1],
+            downloadable=True,
+            path=f"/{name}",
+            link=f"http://dropbox/{i}",
+            size=1024,
+            created_at=timezone.now(),
+            modified_at=timezone.now(),
+            indexed_at=None,
+            snippet=None,
+        )
+        update_tsvector_content(file, content, timezone.now())
+    return user
+
+
+def ranked(results):
+    """File ids and rounded ranks of query_files results."""
+    return [(file.id, round(file.combined_rank, 5)) for file in results]
@@ -1,5 +1,7 @@
 """Helper functions for testing search_files_by_name function."""
 
+import json
+
 import pytest_check as check
 from p7.search.api import (
     sanitize_user_search,
@@ -211,3 +213,13 @@ def assert_tokenize_hypothesis(input_str):
     """
     tokens = tokenize(input_str)
     assert all(isinstance(token, str) for token in tokens)
+
+def parse_server_sent_events(content: bytes) -> list[tuple[str, dict]]:
+    """Event names and JSON data of a text/event-stream response body."""
+    events = []
+    for block in content.decode().split("\n\n"):
+        if not block:
+            continue
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
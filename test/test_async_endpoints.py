@@ -0,0 +1,166 @@
+"""Tests for the async versions of the search, find_service and sync_files endpoints."""
+
+import os
+import sys
+from datetime import timedelta
+from pathlib import Path
+
+# Make the local backend package importable so `from p7...` works under pytest
+repo_backend = Path(__file__).resolve().parents[1]  # backend/
+sys.path.insert(0, str(repo_backend))
+# Make the backend/test dir importable so you can use test_settings.py directly
+sys.path.insert(0, str(repo_backend / "test"))
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "test_settings")
+
+import django
+
+django.setup()
+
+from asgiref.sync import async_to_sync
+from django.contrib.postgres.search import SearchVector, Value
+from django.utils import timezone
+import pytest
+import pytest_check as check
+from ninja.testing import TestAsyncClient
+
+from helpers.search_filename import parse_server_sent_events
+from p7.find_services.api import async_find_services_router
+from p7.search.api import async_search_router
+from p7.sync_files import api as sync_files_api
+from repository.models import File, Service, User
+
+pytestmark = pytest.mark.django_db
+
+AUTH = {"x-internal-auth": os.getenv("INTERNAL_API_KEY")}
+
+
+@pytest.fixture(name="service")
+def service_fixture():
+    """Fixture to create a user with a google service."""
+    user = User.objects.create()
+    return Service.objects.create(
+        userId=user,
+        oauthType="GOOGLE",
+        oauthToken="token1",
+        accessToken="access1",
+        accessTokenExpiration=timezone.now() + timedelta(days=365),
+        refreshToken="refresh1",
+        name="google",
+        accountId="account1",
+        email="async@example.com",
+        scopeName="files.read",
+    )
+
+
+def get(router, path, headers=None):
+    """Call an async router from a sync test."""
+    return async_to_sync(TestAsyncClient(router).get)(path, headers=headers or AUTH)
+
+
+def test_async_search_returns_files_with_service_name(service):
+    """The async search matches the sync endpoint's response."""
+    file = File.objects.create(
+        serviceId=service,
+        serviceFileId="file-1",
+        name="report-async.docx",
+        extension="docx",
+        downloadable=True,
+        path="/report-async.docx",
+        link="http://google/link1",
+        size=1024,
+        createdAt=timezone.now(),
+        modifiedAt=timezone.now(),
+        tsFilename=SearchVector(Value("report-async"), weight="A", config="simple"),
+        tsContent=SearchVector(Value(""), weight="B", config="english"),
+    )
+
+    response = get(async_search_router, f"/?user_id={service.userId_id}&search_string=report")
+
+    check.equal(response.status_code, 200)
+    files = response.json()["files"]
+    check.equal([f["id"] for f in files], [file.id])
+    check.equal(files[0]["serviceName"], "google")
+
+
+def test_async_search_stream_sends_both_phases(service):
+    """The async stream sends the name ranked files, then the fused results."""
+    file = File.objects.create(
+        serviceId=service,
+        serviceFileId="file-1",
+        name="report-async.docx",
+        extension="docx",
+        downloadable=True,
+        path="/report-async.docx",
+        link="http://google/link1",
+        size=1024,
+        createdAt=timezone.now(),
+        modifiedAt=timezone.now(),
+        tsFilename=SearchVector(Value("report-async"), weight="A", config="simple"),
+        tsContent=SearchVector(Value(""), weight="B", config="english"),
+    )
+
+    response = get(
+        async_search_router, f"/stream?user_id={service.userId_id}&search_string=report"
+    )
+
+    check.equal(response.status_code, 200)
+    events = parse_server_sent_events(response.content)
+    check.equal([event for event, _ in events], ["names", "results"])
+    for _, data in events:
+        check.equal([f["id"] for f in data["files"]], [file.id])
+        check.equal(data["files"][0]["serviceName"], "google")
+
+
+def test_async_search_rejects_invalid_auth(service):
+    """Auth is validated before touching the database."""
+    response = get(
+        async_search_router,
+        f"/?user_id={service.userId_id}&search_string=report",
+        headers={"x-internal-auth": "invalid_token"},
+    )
+
+    check.equal(response.status_code, 401)
+
+
+def test_async_find_services(service):
+    """The async find_service lists the user's services."""
+    response = get(async_find_services_router, f"/?user_id={service.userId_id}")
+
+    check.equal(response.status_code, 200)
+    check.equal(
+        response.json(),
+        [
+            {
+                "id": service.id,
+                "userId": service.userId_id,
+                "name": "google",
+                "email": "async@example.com",
+            }
+        ],
+    )
+
+
+def test_async_find_services_unknown_user():
+    """An unknown user is reported like in the sync endpoint."""
+    response = get(async_find_services_router, "/?user_id=999999")
+
+    check.equal(response.status_code, 404)
+
+
+def test_async_sync_files_queues_existing_services(service, monkeypatch):
+    """Only providers the user has connected are queued."""
+    submitted = []
+    monkeypatch.setattr(
+        sync_files_api,
+        "submit_task",
+        lambda func, *args, **kwargs: submitted.append((func, kwargs["group"])),
+    )
+
+    response = get(sync_files_api.async_sync_files_router, f"/?user_id={service.userId_id}")
+
+    check.equal(response.status_code, 202)
+    check.equal(
+        submitted,
+        [(sync_files_api.sync_google_drive_files, f"Google-Drive-{service.userId_id}")],
+    )
@@ -0,0 +1,94 @@
+"""Tests for skipping downloads of files whose content hash is unchanged."""
+
+import os
+import sys
+from pathlib import Path
+from datetime import timedelta
+
+# Make the local backend package importable so `from p7...` works under pytest
+repo_backend = Path(__file__).resolve().parents[1]  # backend/
+sys.path.insert(0, str(repo_backend))
+# Make the backend/test dir importable so you can use test_settings.py directly
+sys.path.insert(0, str(repo_backend / "test"))
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "test_settings")
+
+import django
+from django.utils import timezone
+
+django.setup()
+
+import pytest
+import pytest_check as check
+
+from repository.file import fetch_downloadable_files, update_tsvector_content
+from repository.models import File, Service, User
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture(name="service")
+def service_fixture():
+    """Fixture to create a user with a single service."""
+    user = User.objects.create()
+    return Service.objects.create(
+        userId=user,
+        oauthType="type1",
+        oauthToken="token1",
+        accessToken="access1",
+        accessTokenExpiration=timezone.now() + timedelta(days=365),
+        refreshToken="refresh1",
+        name="dropbox",
+        accountId="account1",
+        email="user1@example.com",
+        scopeName="files.read",
+    )
+
+
+def create_file(service, service_file_id, content_hash):
+    """Create a downloadable, not yet indexed file with the given content hash."""
+    return File.objects.create(
+        serviceId=service,
+        serviceFileId=service_file_id,
+        name=f"{service_file_id}.txt",
+        extension=".txt",
+        downloadable=True,
+        path=f"/{service_file_id}.txt",
+        link=f"http://dropbox/{service_file_id}.txt",
+        size=1024,
+        createdAt=timezone.now(),
+        modifiedAt=timezone.now() - timedelta(minutes=1),
+        contentHash=content_hash,
+    )
+
+
+def test_unchanged_content_hash_is_skipped(service):
+    """A file renamed after indexing keeps its hash and is not downloaded again."""
+    file = create_file(service, "renamed", "hash-1")
+    update_tsvector_content(file, "some content", timezone.now())
+
+    # Simulate a metadata only change (rename) reported by the provider
+    File.objects.filter(pk=file.pk).update(indexedAt=None, modifiedAt=timezone.now())
+
+    check.equal(fetch_downloadable_files(service), [])
+    file.refresh_from_db(fields=["indexedAt"])
+    check.is_not_none(file.indexedAt)
+
+
+def test_changed_content_hash_is_downloaded(service):
+    """A file whose content hash changed since indexing is downloaded again."""
+    file = create_file(service, "edited", "hash-1")
+    update_tsvector_content(file, "some content", timezone.now())
+
+    File.objects.filter(pk=file.pk).update(
+        indexedAt=None, modifiedAt=timezone.now(), contentHash="hash-2"
+    )
+
+    check.equal([f.pk for f in fetch_downloadable_files(service)], [file.pk])
+
+
+def test_missing_content_hash_is_downloaded(service):
+    """Files without a provider fingerprint are always downloaded."""
+    file = create_file(service, "no_hash", None)
+
+    check.equal([f.pk for f in fetch_downloadable_files(service)], [file.pk])
@@ -0,0 +1,168 @@
+"""Tests for the per-user corpus statistics kept for content ranking."""
+
+import os
+import sys
+from datetime import timedelta
+from pathlib import Path
+
+# Make the local backend package importable so `from p7...` works under pytest
+repo_backend = Path(__file__).resolve().parents[1]  # backend/
+sys.path.insert(0, str(repo_backend))
+# Make the backend/test dir importable so you can use test_settings.py directly
+sys.path.insert(0, str(repo_backend / "test"))
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "test_settings")
+
+import django
+from django.db.models import Avg, Q
+from django.utils import timezone
+
+django.setup()
+
+import pytest
+import pytest_check as check
+
+from repository.file import delete_file, save_file, update_tsvector_content
+from repository.models import File, Service, User
+from repository.statistics import CorpusSnapshot, user_corpus_statistics
+
+pytestmark = pytest.mark.django_db
+
+DOCUMENTS = {
+    "Quarterly report 2024.pdf": "revenue grew and the quarterly budget was approved",
+    "Budget plan.docx": "the budget plan lists revenue targets for every quarter",
+    "Holiday photos.jpg": None,
+    "Meeting notes.pdf": "notes from the meeting about the holiday schedule",
+}
+
+
+def make_service(user, name):
+    """A service of the user."""
+    return Service.objects.create(
+        userId=user,
+        oauthType="type1",
+        oauthToken="token1",
+        accessToken="access1",
+        accessTokenExpiration=timezone.now() + timedelta(days=365),
+        refreshToken="refresh1",
+        name=name,
+        accountId=f"{name}-account",
+        email=f"{name}@example.com",
+        scopeName="files.read",
+    )
+
+
+def store(service, i, name, content=None):
+    """Save a file, and index its content when it has any."""
+    file = save_file(
+        service_id=service,
+        service_file_id=f"file_{i}",
+        name=name,
+        extension="." + name.rsplit(".", 1)[1],
+        downloadable=True,
+        path=f"/{name}",
+        link=f"http://{service.name}/{i}",
+        size=1024,
+        created_at=timezone.now(),
+        modified_at=timezone.now(),
+        indexed_at=None,
+        snippet=None,
+    )
+    if content is not None:
+        update_tsvector_content(file, content, timezone.now())
+    return file
+
+
+def counted(user, q=Q()):
+    """File count and average length counted over the user's files, like searches did."""
+    files = File.objects.filter(q, serviceId__userId=user.pk)
+    # The average is computed by PostgreSQL here, it may differ in the last digits
+    return pytest.approx(
+        (files.count(), files.aggregate(average=Avg("contentLength"))["average"])
+    )
+
+
+@pytest.fixture(name="user")
+def user_fixture():
+    """A user with files in two services, and statistics built before any file."""
+    user = User.objects.create()
+    user_corpus_statistics(user)
+    dropbox = make_service(user, "dropbox")
+    for i, (name, content) in enumerate(DOCUMENTS.items()):
+        store(dropbox, i, name, content)
+    store(make_service(user, "google"), 0, "Budget review.pdf", "the budget was reviewed")
+    return user
+
+
+def test_statistics_follow_file_changes(user):
+    """Upserts, renames, reindexing and deletes keep the rows equal to a recount."""
+    dropbox = user.services.get(name="dropbox")
+    snapshot = user_corpus_statistics(user)
+    check.equal(snapshot[:2], counted(user))
+    check.greater(snapshot.total_postings, 0)
+
+    store(dropbox, 1, "Budget plan.pdf")  # Renamed, so moved to the pdf row
+    store(dropbox, 9, "Zebra.txt", "a zebra crossed the meeting room")
+    update_tsvector_content(
+        dropbox.files.get(name="Meeting notes.pdf"), "shorter notes", timezone.now()
+    )
+    delete_file(dropbox.files.get(name="Holiday photos.jpg"))
+
+    snapshot = user_corpus_statistics(user)
+    check.equal(snapshot[:2], counted(user))
+    check.equal(
+        user_corpus_statistics(user, extension=[".pdf"])[:2],
+        counted(user, Q(extension__iexact=".pdf")),
+    )
+
+
+def test_statistics_cover_provider_and_extension_filters(user):
+    """Filtered statistics match a recount under the same filters."""
+    check.equal(
+        user_corpus_statistics(user, provider=["Google"])[:2],
+        counted(user, Q(serviceId__name__iexact="google")),
+    )
+    check.equal(
+        user_corpus_statistics(user, provider=["dropbox"], extension=[".PDF"])[:2],
+        counted(user, Q(serviceId__name__iexact="dropbox", extension__iexact=".pdf")),
+    )
+    check.equal(
+        user_corpus_statistics(user, extension=[".txt"]),
+        CorpusSnapshot(documents=0, average_length=None, total_postings=0),
+    )
+
+
+def test_statistics_are_built_on_first_use():
+    """Files stored before the statistics existed are counted when first read."""
+    user = User.objects.create()
+    service = make_service(user, "dropbox")
+    for i, (name, content) in enumerate(DOCUMENTS.items()):
+        store(service, i, name, content)
+    User.objects.filter(pk=user.pk).update(corpusStatisticsBuilt=False)
+    service.corpusStatistics.all().delete()
+    user.refresh_from_db()
+
+    snapshot = user_corpus_statistics(user)
+
+    check.equal(snapshot[:2], counted(user))
+    user.refresh_from_db()
+    check.is_true(user.corpusStatisticsBuilt)
+
+
+@pytest.mark.parametrize("ranking", ["tfidf", "bm25"])
+def test_ranking_from_statistics_matches_counting(user, ranking):
+    """Content ranks computed from the statistics equal the ones from counting."""
+    base_filter = Q(serviceId__userId=user.pk)
+    snapshot = user_corpus_statistics(user)
+
+    counting = File.objects.ranking_based_on_content(
+        "budget revenue", base_filter=base_filter, ranking=ranking
+    )
+    from_statistics = File.objects.ranking_based_on_content(
+        "budget revenue", base_filter=base_filter, ranking=ranking, corpus=snapshot
+    )
+
+    check.equal(
+        {file.id: round(file.rank, 9) for file in from_statistics},
+        {file.id: round(file.rank, 9) for file in counting},
+    )
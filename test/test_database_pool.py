@@ -0,0 +1,63 @@
+"""Tests for the connection reuse settings per pooling mode and process role."""
+
+import sys
+from pathlib import Path
+
+# Make the local backend package importable so `from p7...` works under pytest
+repo_backend = Path(__file__).resolve().parents[1]  # backend/
+sys.path.insert(0, str(repo_backend))
+# Make the backend/test dir importable so you can use test_settings.py directly
+sys.path.insert(0, str(repo_backend / "test"))
+
+import pytest
+import pytest_check as check
+
+from p7.database.pool import connection_settings, process_role
+
+
+def test_process_role_from_command_and_environment():
+    """qclusters are workers, the ASGI profile is asgi, PROCESS_ROLE wins."""
+    check.equal(process_role({}, ["manage.py", "qcluster"]), "worker")
+    check.equal(process_role({"ASYNC_ENDPOINTS": "True"}, ["gunicorn"]), "asgi")
+    check.equal(process_role({}, ["gunicorn"]), "web")
+    check.equal(process_role({"PROCESS_ROLE": "worker"}, ["gunicorn"]), "worker")
+
+
+def test_web_defaults_to_persistent_connections_with_health_checks():
+    """Web threads keep their connection and check it before reuse."""
+    conn = connection_settings("web", {"DATABASE_CONN_MAX_AGE": "120"})
+
+    check.equal(conn["CONN_MAX_AGE"], 120)
+    check.is_true(conn["CONN_HEALTH_CHECKS"])
+    check.equal(conn["OPTIONS"], {})
+
+
+def test_pool_sized_per_role():
+    """Pool mode disables persistent connections and sizes the pool per role."""
+    environ = {"DATABASE_POOL_MODE": "pool", "DATABASE_POOL_MAX_SIZE_WORKER": "3"}
+
+    worker = connection_settings("worker", environ)
+    asgi = connection_settings("asgi", {})
+
+    check.equal(worker["CONN_MAX_AGE"], 0)
+    check.equal(worker["OPTIONS"]["pool"]["min_size"], 1)
+    check.equal(worker["OPTIONS"]["pool"]["max_size"], 3)
+    check.is_not_none(worker["OPTIONS"]["pool"]["check"])
+    check.equal(asgi["OPTIONS"]["pool"]["max_size"], 20)
+
+
+def test_pgbouncer_disables_server_side_state():
+    """Transaction pooling gets no server-side cursors or prepared statements."""
+    conn = connection_settings("web", {"DATABASE_POOL_MODE": "pgbouncer"})
+
+    check.is_true(conn["DISABLE_SERVER_SIDE_CURSORS"])
+    check.is_none(conn["OPTIONS"]["prepare_threshold"])
+    check.greater(conn["CONN_MAX_AGE"], 0)
+
+
+def test_none_and_invalid_modes():
+    """Mode none reconnects per request, unknown modes are rejected."""
+    check.equal(connection_settings("web", {"DATABASE_POOL_MODE": "none"})["CONN_MAX_AGE"], 0)
+
+    with pytest.raises(ValueError):
+        connection_settings("web", {"DATABASE_POOL_MODE": "bouncy"})
@@ -0,0 +1,126 @@
+"""Tests for checkpointed, bounded download batches."""
+
+import os
+import sys
+from pathlib import Path
+from datetime import timedelta
+
+# Make the local backend package importable so `from p7...` works under pytest
+repo_backend = Path(__file__).resolve().parents[1]  # backend/
+sys.path.insert(0, str(repo_backend))
+# Make the backend/test dir importable so you can use test_settings.py directly
+sys.path.insert(0, str(repo_backend / "test"))
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "test_settings")
+
+import django
+from django.utils import timezone
+
+django.setup()
+
+import pytest
+import pytest_check as check
+
+from repository import queue
+from repository.file import save_file
+from repository.models import Service, User
+from repository.queue import DownloadBatch
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture(name="service")
+def service_fixture(settings):
+    """Fixture to create a service with five pending files and a batch size of two."""
+    settings.TASK_SCHEDULER = {**settings.TASK_SCHEDULER, "download_batch_size": 2}
+    user = User.objects.create()
+    service = Service.objects.create(
+        userId=user,
+        oauthType="type1",
+        oauthToken="token1",
+        accessToken="access1",
+        accessTokenExpiration=timezone.now() + timedelta(days=365),
+        refreshToken="refresh1",
+        name="dropbox",
+        accountId="account1",
+        email="user1@example.com",
+        scopeName="files.read",
+    )
+    for i in range(5):
+        save_file(
+            service_id=service,
+            service_file_id=f"file_{i}",
+            name=f"report {i}.pdf",
+            extension=".pdf",
+            downloadable=True,
+            path=f"/report {i}.pdf",
+            link=f"http://dropbox/{i}",
+            size=1024,
+            created_at=timezone.now(),
+            modified_at=timezone.now(),
+            indexed_at=None,
+            snippet=None,
+        )
+    return service
+
+
+@pytest.fixture(name="submitted")
+def submitted_fixture(monkeypatch):
+    """Record continuation tasks instead of queueing them."""
+    submitted = []
+
+    def fake_submit_task(func, user_id, **kwargs):
+        submitted.append(kwargs["after_id"])
+        return "task"
+
+    monkeypatch.setattr(queue, "submit_task", fake_submit_task)
+    return submitted
+
+
+def run_batch(service, after_id=None):
+    """Handle every file of a batch and finish it."""
+    batch = DownloadBatch(service, after_id)
+    handled = [file.pk for file in batch]
+    batch.finish("tasks.download", group=f"Dropbox-{service.userId_id}")
+    service.refresh_from_db()
+    return handled
+
+
+def test_full_batch_checkpoints_and_queues_rest(service, submitted):
+    """A full batch records its last file and queues the remainder after it."""
+    handled = run_batch(service)
+
+    check.equal(len(handled), 2)
+    check.equal(service.downloadCursor, handled[-1])
+    check.equal(submitted, [handled[-1]])
+
+
+def test_interrupted_pass_resumes_from_checkpoint(service, submitted):
+    """A new run without a cursor continues after the checkpoint."""
+    first = run_batch(service)
+    # The continuation task died, a later sync starts the downloader again
+    second = run_batch(service)
+
+    check.is_true(min(second) > max(first))
+    check.equal(submitted, [first[-1], second[-1]])
+
+
+def test_last_batch_clears_checkpoint(service, submitted):
+    """The pass ends, and the checkpoint is cleared, once the files run out."""
+    run_batch(service)
+    run_batch(service, submitted[-1])
+    last = run_batch(service, submitted[-1])
+
+    check.equal(len(last), 1)
+    check.is_none(service.downloadCursor)
+    check.equal(len(submitted), 2)
+
+
+def test_time_budget_stops_batch_early(service, submitted, settings):
+    """A batch out of time queues the rest after the last handled file."""
+    settings.TASK_SCHEDULER = {**settings.TASK_SCHEDULER, "download_batch_seconds": -1}
+
+    handled = run_batch(service)
+
+    check.equal(len(handled), 1)
+    check.equal(submitted, handled)
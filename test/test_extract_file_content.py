@@ -0,0 +1,98 @@
+"""Tests for the extractor registry and the isolated extraction pool."""
+
+import os
+import sys
+import zipfile
+from io import BytesIO
+from pathlib import Path
+
+# Make the local backend package importable so `from p7...` works under pytest
+repo_backend = Path(__file__).resolve().parents[1]  # backend/
+sys.path.insert(0, str(repo_backend))
+# Make the backend/test dir importable so you can use test_settings.py directly
+sys.path.insert(0, str(repo_backend / "test"))
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "test_settings")
+
+import django
+
+django.setup()
+
+import pytest
+import pytest_check as check
+
+from p7.extract_file_content.extractors import (
+    extract_text,
+    get_extractor,
+    registered_extensions,
+)
+from p7.extract_file_content.pool import ExtractionError, ExtractionPool
+from p7.helpers import downloadable_file_extensions
+
+
+def test_registered_formats_are_downloadable():
+    """Every format with an extractor is picked up by the download stage."""
+    check.is_true({".pdf", ".docx", ".odt", ".rtf", ".epub"} <= registered_extensions())
+    check.is_true(registered_extensions() <= downloadable_file_extensions())
+
+
+def test_unknown_extension_falls_back_to_mime_then_text():
+    """Extractors are found by extension, then MIME type, then plain text."""
+    check.equal(get_extractor(".PDF")["name"], "extract_pdf")
+    check.equal(get_extractor(".bin", "application/pdf")["name"], "extract_pdf")
+    check.equal(get_extractor(".unknown")["name"], "extract_plain_text")
+
+
+def test_extract_rtf_strips_control_words():
+    """RTF control words and metadata groups are dropped."""
+    rtf = (
+        rb"{\rtf1\ansi{\fonttbl\f0\fswiss Helvetica;}"
+        rb"\f0\pard Hello {\b bold} caf\'e9\par World\u8364?\par}"
+    )
+
+    check.equal(extract_text(BytesIO(rtf), ".rtf"), "Hello bold caf\xe9\nWorld€")
+
+
+def test_extract_odt_paragraphs():
+    """OpenDocument paragraphs and headings are extracted in order."""
+    content = (
+        '<office:document-content '
+        'xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0" '
+        'xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0">'
+        "<office:body><office:text>"
+        "<text:h>Title</text:h><text:p>First <text:span>line</text:span></text:p>"
+        "</office:text></office:body></office:document-content>"
+    )
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("content.xml", content)
+    buffer.seek(0)
+
+    check.equal(extract_text(buffer, ".odt"), "Title\nFirst line")
+
+
+@pytest.fixture(name="pool")
+def pool_fixture():
+    """Fixture for an extraction pool that is stopped after the test."""
+    pool = ExtractionPool(max_tasks_per_worker=2)
+    yield pool
+    pool.recycle()
+
+
+def test_pool_extracts_and_recycles_worker(pool):
+    """The worker is reused and replaced after max_tasks_per_worker files."""
+    check.equal(pool.extract(BytesIO(b"first"), ".txt"), "first")
+    first_worker = pool._process  # pylint: disable=protected-access
+    check.equal(pool.extract(BytesIO(b"second"), ".txt", max_chars=3), "sec")
+    check.equal(pool._process, first_worker)  # pylint: disable=protected-access
+
+    check.equal(pool.extract(BytesIO(b"third"), ".txt"), "third")
+    check.not_equal(pool._process, first_worker)  # pylint: disable=protected-access
+
+
+def test_pool_reports_parser_errors(pool):
+    """A malformed file raises ExtractionError and the worker stays usable."""
+    with pytest.raises(ExtractionError):
+        pool.extract(BytesIO(b"not a zip archive"), ".docx")
+
+    check.equal(pool.extract(BytesIO(b"still alive"), ".txt"), "still alive")
@@ -0,0 +1,152 @@
+"""Tests for batched tsvector indexing of file content."""
+
+import os
+import sys
+from pathlib import Path
+from datetime import timedelta
+
+# Make the local backend package importable so `from p7...` works under pytest
+repo_backend = Path(__file__).resolve().parents[1]  # backend/
+sys.path.insert(0, str(repo_backend))
+# Make the backend/test dir importable so you can use test_settings.py directly
+sys.path.insert(0, str(repo_backend / "test"))
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "test_settings")
+
+import django
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+django.setup()
+
+import pytest
+import pytest_check as check
+
+from repository.file import ContentIndexWriter, fetch_downloadable_files, save_file
+from repository.models import File, Service, User
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture(name="service")
+def service_fixture():
+    """Fixture to create a user with a single service."""
+    user = User.objects.create()
+    return Service.objects.create(
+        userId=user,
+        oauthType="type1",
+        oauthToken="token1",
+        accessToken="access1",
+        accessTokenExpiration=timezone.now() + timedelta(days=365),
+        refreshToken="refresh1",
+        name="dropbox",
+        accountId="account1",
+        email="user1@example.com",
+        scopeName="files.read",
+    )
+
+
+def create_files(service, count):
+    """Save `count` files through save_file."""
+    return [
+        save_file(
+            service_id=service,
+            service_file_id=f"file_{i}",
+            name=f"Quarterly report {i}.pdf",
+            extension=".pdf",
+            downloadable=True,
+            path=f"/Quarterly report {i}.pdf",
+            link=f"http://dropbox/{i}",
+            size=1024,
+            created_at=timezone.now(),
+            modified_at=timezone.now(),
+            indexed_at=None,
+            snippet=None,
+        )
+        for i in range(count)
+    ]
+
+
+def test_save_file_builds_filename_vector_without_extension(service):
+    """tsFilename is written together with the file row, without the extension."""
+    file = create_files(service, 1)[0]
+
+    ts_filename = File.objects.get(pk=file.pk).tsFilename
+    check.is_in("'quarterly'", ts_filename)
+    check.is_not_in("pdf", ts_filename)
+
+
+def test_writer_batches_content_updates(service):
+    """Content for a whole batch is written in one statement and never read back."""
+    files = create_files(service, 3)
+    indexed_at = timezone.now()
+
+    with CaptureQueriesContext(connection) as queries:
+        with ContentIndexWriter(max_files=10) as writer:
+            for file in files:
+                writer.add(file, "Revenue grew strongly", indexed_at)
+
+    # The corpus statistics are moved around the write (2), passages are replaced
+    # (delete + insert), the owner's index version is bumped and the files are updated
+    statements = [q["sql"] for q in queries if "SAVEPOINT" not in q["sql"]]
+    check.equal(len(statements), 6)
+    check.is_false(any(sql.lstrip().startswith("SELECT") for sql in statements))
+    for file in File.objects.filter(pk__in=[f.pk for f in files]):
+        check.is_in("'revenu'", file.tsContent)
+        check.equal(file.indexedAt, indexed_at)
+
+
+def test_writer_flushes_when_batch_is_full(service):
+    """A full batch is flushed immediately."""
+    files = create_files(service, 2)
+
+    writer = ContentIndexWriter(max_files=1)
+    writer.add(files[0], "first", timezone.now())
+
+    check.is_not_none(File.objects.get(pk=files[0].pk).tsContent)
+    check.is_none(File.objects.get(pk=files[1].pk).tsContent)
+
+
+def test_writer_skips_content_postgres_rejects(service):
+    """A file over the tsvector size limit does not keep the rest of its batch out."""
+    files = create_files(service, 3)
+    # Over 1MB of distinct lexemes, more than a tsvector can hold
+    oversized = " ".join(f"lexeme{i:07d}" for i in range(100_000))
+
+    with ContentIndexWriter(max_files=10) as writer:
+        writer.add(files[0], "Revenue grew strongly", timezone.now())
+        writer.add(files[1], oversized, timezone.now())
+        writer.add(files[2], "Budget approved", timezone.now())
+
+    check.is_in("'revenu'", File.objects.get(pk=files[0].pk).tsContent)
+    check.equal(File.objects.get(pk=files[1].pk).tsContent, "")
+    check.is_in("'budget'", File.objects.get(pk=files[2].pk).tsContent)
+
+
+def test_rejected_file_is_not_downloaded_again(service):
+    """A file whose content PostgreSQL rejects is marked indexed, not retried every sync."""
+    file = save_file(
+        service_id=service,
+        service_file_id="file_0",
+        name="Lexicon.pdf",
+        extension=".pdf",
+        downloadable=True,
+        path="/Lexicon.pdf",
+        link="http://dropbox/0",
+        size=1024,
+        created_at=timezone.now(),
+        modified_at=timezone.now(),
+        indexed_at=None,
+        snippet=None,
+        content_hash="hash_0",
+    )
+    oversized = " ".join(f"lexeme{i:07d}" for i in range(100_000))
+
+    check.equal([f.pk for f in fetch_downloadable_files(service)], [file.pk])
+    with ContentIndexWriter() as writer:
+        writer.add(file, oversized, timezone.now())
+    # A rename bumps modifiedAt, the unchanged content hash still skips the download
+    File.objects.filter(pk=file.pk).update(modifiedAt=timezone.now() + timedelta(minutes=1))
+
+    check.equal(fetch_downloadable_files(service), [])
@@ -0,0 +1,85 @@
+"""Tests for detecting the language content is indexed in."""
+
+import os
+import sys
+from datetime import timedelta
+from pathlib import Path
+
+# Make the local backend package importable so `from p7...` works under pytest
+repo_backend = Path(__file__).resolve().parents[1]  # backend/
+sys.path.insert(0, str(repo_backend))
+# Make the backend/test dir importable so you can use test_settings.py directly
+sys.path.insert(0, str(repo_backend / "test"))
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "test_settings")
+
+import django
+from django.utils import timezone
+
+django.setup()
+
+import pytest
+import pytest_check as check
+
+from p7.search.languages import DEFAULT_LANGUAGE, FALLBACK_LANGUAGE, detect_language
+from repository.file import query_files, save_file, update_tsvector_content
+from repository.models import Service, User
+
+DANISH = "Referatet fra mødet er vedhæftet, og vi har aftalt at budgettet skal godkendes i maj."
+ENGLISH = "The minutes of the meeting are attached, and we agreed that the budget is approved."
+
+
+def test_detect_language_from_function_words():
+    """Running text is recognised by the function words of its language."""
+    check.equal(detect_language(DANISH), "danish")
+    check.equal(detect_language(ENGLISH), "english")
+
+
+def test_detect_language_without_function_words():
+    """Long text without function words is not stemmed, short text is left unchanged."""
+    spreadsheet = " ".join(f"item{i} price total quantity" for i in range(10))
+
+    check.equal(detect_language(spreadsheet), FALLBACK_LANGUAGE)
+    check.equal(detect_language("Budget 2024"), DEFAULT_LANGUAGE)
+    check.equal(detect_language(None), DEFAULT_LANGUAGE)
+
+
+@pytest.mark.django_db
+def test_content_is_indexed_and_searched_in_its_language():
+    """Danish content is stemmed as Danish, and found by another form of a word."""
+    user = User.objects.create()
+    service = Service.objects.create(
+        userId=user,
+        oauthType="type1",
+        oauthToken="token1",
+        accessToken="access1",
+        accessTokenExpiration=timezone.now() + timedelta(days=365),
+        refreshToken="refresh1",
+        name="dropbox",
+        accountId="account1",
+        email="user1@example.com",
+        scopeName="files.read",
+    )
+    file = save_file(
+        service_id=service,
+        service_file_id="file_0",
+        name="Referat.docx",
+        extension=".docx",
+        downloadable=True,
+        path="/Referat.docx",
+        link="http://dropbox/0",
+        size=1024,
+        created_at=timezone.now(),
+        modified_at=timezone.now(),
+        indexed_at=None,
+        snippet=None,
+    )
+
+    update_tsvector_content(file, DANISH, timezone.now())
+
+    file.refresh_from_db()
+    user.refresh_from_db()
+    check.equal(file.language, "danish")
+    check.equal(user.contentLanguages, ["danish", "english"])
+    # "budgetter" and "budgettet" share the Danish stem
+    check.equal([f.id for f in query_files(["budgetter"], user.id)], [file.id])
@@ -0,0 +1,110 @@
+"""Tests for the in-process per-user search index."""
+
+import os
+import sys
+from math import log2
+from pathlib import Path
+
+# Make the local backend package importable so `from p7...` works under pytest
+repo_backend = Path(__file__).resolve().parents[1]  # backend/
+sys.path.insert(0, str(repo_backend))
+# Make the backend/test dir importable so you can use test_settings.py directly
+sys.path.insert(0, str(repo_backend / "test"))
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "test_settings")
+
+import django
+from django.utils import timezone
+
+django.setup()
+
+import pytest
+import pytest_check as check
+
+from helpers.search_corpus import create_user_with_documents, ranked
+from p7.search import memory_index
+from p7.search.memory_index import MemoryIndexCache, UserIndex, ts_rank_simple
+from repository.file import query_files, update_tsvector_content
+
+
+def make_index(user_id, version, estimated_bytes):
+    """An empty index with a given size."""
+    index = UserIndex(user_id, version)
+    index.estimated_bytes = estimated_bytes
+    return index
+
+
+def test_cache_evicts_least_recently_used_within_budget():
+    """Indexes are evicted in LRU order once the budget is exceeded."""
+    cache = MemoryIndexCache(budget_bytes=100)
+    cache.put(make_index(1, 0, 40))
+    cache.put(make_index(2, 0, 40))
+    cache.get(1, 0)  # 1 is now more recently used than 2
+
+    cache.put(make_index(3, 0, 40))
+
+    check.is_not_none(cache.get(1, 0))
+    check.is_none(cache.get(2, 0))
+    check.is_not_none(cache.get(3, 0))
+    check.equal(cache.used_bytes, 80)
+    check.is_false(cache.put(make_index(4, 0, 101)))
+
+
+def test_cache_drops_stale_index():
+    """An index built at an older indexVersion is never returned."""
+    cache = MemoryIndexCache(budget_bytes=100)
+    cache.put(make_index(1, 3, 10))
+
+    check.is_none(cache.get(1, 4))
+    check.equal(cache.used_bytes, 0)
+
+
+def test_ts_rank_single_word():
+    """A single word at one position ranks 1/1.6449, normalized by unique lexemes."""
+    rank = ts_rank_simple({"report": [1], "2024": [2]}, ["report"])
+
+    check.almost_equal(rank, (1 / 1.64493406685) / log2(3), rel=1e-6)
+
+
+def test_ts_rank_prefers_adjacent_words():
+    """For several query words closer positions rank higher."""
+    near = ts_rank_simple({"budget": [1], "plan": [2], "x": [3]}, ["budget", "plan"])
+    far = ts_rank_simple({"budget": [1], "x": [2], "plan": [9]}, ["budget", "plan"])
+
+    check.greater(near, far)
+
+
+@pytest.fixture(name="user")
+def user_fixture():
+    """A user with a few indexed files, and an empty index cache."""
+    memory_index.get_memory_index_cache.cache_clear()
+    return create_user_with_documents()
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("ranking", ["tfidf", "bm25"])
+@pytest.mark.parametrize("query", ["report", "budget report", "quarterly revenue", "holiday"])
+def test_memory_index_matches_sql(user, settings, query, ranking):
+    """Results from memory are the ones SQL returns, in the same order."""
+    settings.MEMORY_INDEX = {**settings.MEMORY_INDEX, "enabled": False}
+    from_sql = ranked(query_files(query.split(), user.id, ranking=ranking))
+
+    settings.MEMORY_INDEX = {**settings.MEMORY_INDEX, "enabled": True}
+    from_memory = ranked(query_files(query.split(), user.id, ranking=ranking))
+
+    check.is_true(from_sql)
+    check.equal([file_id for file_id, _ in from_memory], [file_id for file_id, _ in from_sql])
+    for (_, memory_rank), (_, sql_rank) in zip(from_memory, from_sql):
+        check.almost_equal(memory_rank, sql_rank, rel=1e-4)
+
+
+@pytest.mark.django_db
+def test_memory_index_rebuilt_when_stale(user, settings):
+    """Indexing new content bumps the user's version and the index is rebuilt."""
+    settings.MEMORY_INDEX = {**settings.MEMORY_INDEX, "enabled": True}
+    check.equal(query_files(["zebra"], user.id), [])
+
+    file = user.services.get().files.get(name="Meeting notes.txt")
+    update_tsvector_content(file, "a zebra crossed the meeting room", timezone.now())
+
+    check.equal([f.id for f in query_files(["zebra"], user.id)], [file.id])
@@ -0,0 +1,123 @@
+"""Tests for the Prometheus metrics of the indexing pipeline."""
+
+import os
+import sys
+from io import BytesIO
+from pathlib import Path
+from types import SimpleNamespace
+
+# Make the local backend package importable so `from p7...` works under pytest
+repo_backend = Path(__file__).resolve().parents[1]  # backend/
+sys.path.insert(0, str(repo_backend))
+# Make the backend/test dir importable so you can use test_settings.py directly
+sys.path.insert(0, str(repo_backend / "test"))
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "test_settings")
+
+import django
+
+django.setup()
+
+from django.utils import timezone
+import pytest
+import pytest_check as check
+from ninja.testing import TestClient
+from prometheus_client import REGISTRY
+
+from p7.helpers import parse_file_content
+from p7.metrics.api import _cached_backlog, metrics_router
+from p7.metrics.helpers import observe_download, provider_label
+from repository.file import count_backlog
+from repository.models import File, Service, User
+
+
+def sample(name: str, **labels) -> float:
+    """Current value of a metric sample, 0 when it has not been recorded yet."""
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def test_observe_download_counts_bytes_and_keeps_position():
+    """The size is taken from the stream without moving its position."""
+    files_before = sample("p7_files_downloaded_total", provider="dropbox")
+    bytes_before = sample("p7_bytes_downloaded_total", provider="dropbox")
+    stream = BytesIO(b"x" * 1234)
+    stream.seek(10)
+
+    observe_download("dropbox", stream)
+
+    check.equal(stream.tell(), 10)
+    check.equal(sample("p7_files_downloaded_total", provider="dropbox") - files_before, 1)
+    check.equal(sample("p7_bytes_downloaded_total", provider="dropbox") - bytes_before, 1234)
+
+
+def test_provider_label_needs_loaded_service():
+    """The provider is only read from an already loaded service."""
+    service = Service(name="onedrive")
+    loaded = File(serviceId=service)
+
+    check.equal(provider_label(loaded), "onedrive")
+    check.equal(provider_label(File(serviceId_id=1)), "unknown")
+    check.equal(provider_label(SimpleNamespace(extension=".txt")), "unknown")
+
+
+def test_parse_file_content_records_outcome_and_duration():
+    """Parsing counts the outcome and observes the extraction time per extension."""
+    file = SimpleNamespace(extension=".txt")
+    ok_before = sample("p7_files_parsed_total", provider="unknown", outcome="ok")
+    empty_before = sample("p7_files_parsed_total", provider="unknown", outcome="empty")
+    timed_before = sample("p7_parse_seconds_count", extension=".txt")
+
+    parse_file_content(b"hello", file)
+    parse_file_content(b"", file)
+
+    check.equal(sample("p7_files_parsed_total", provider="unknown", outcome="ok") - ok_before, 1)
+    check.equal(
+        sample("p7_files_parsed_total", provider="unknown", outcome="empty") - empty_before, 1
+    )
+    check.equal(sample("p7_parse_seconds_count", extension=".txt") - timed_before, 1)
+
+
+@pytest.mark.django_db
+def test_metrics_endpoint_reports_backlog():
+    """The endpoint serves the text format including the download backlog."""
+    user = User.objects.create()
+    service = Service.objects.create(
+        userId=user,
+        oauthType="DROPBOX",
+        oauthToken="token",
+        accessToken="access",
+        accessTokenExpiration=timezone.now(),
+        refreshToken="refresh",
+        name="dropbox",
+        accountId="account",
+        email="metrics@example.com",
+        scopeName="scope",
+    )
+    File.objects.create(
+        serviceId=service,
+        serviceFileId="file-1",
+        name="notes.txt",
+        extension=".txt",
+        downloadable=True,
+        path="/notes.txt",
+        link="https://example.com/notes.txt",
+        size=5,
+        createdAt=timezone.now(),
+        modifiedAt=timezone.now(),
+    )
+    client = TestClient(metrics_router)
+    _cached_backlog.cache_clear()
+
+    unauthorized = client.get("/", headers={"x-internal-auth": "invalid_token"})
+    response = client.get("/", headers={"x-internal-auth": os.getenv("INTERNAL_API_KEY")})
+
+    check.equal(unauthorized.status_code, 401)
+    check.equal(response.status_code, 200)
+    body = response.content.decode()
+    # Other tests may leave files of their own behind
+    backlog = count_backlog()
+    check.greater_equal(backlog.files, 1)
+    check.is_in(f"p7_backlog_files {float(backlog.files)}", body)
+    check.is_in(f"p7_backlog_users {float(backlog.users)}", body)
+    check.is_in(f"p7_backlog_max_user_files {float(backlog.max_user_files)}", body)
+    check.is_in("p7_files_downloaded_total", body)
@@ -0,0 +1,68 @@
+"""Tests for streaming text extraction of downloaded file content."""
+
+import os
+import sys
+from io import BytesIO
+from pathlib import Path
+from types import SimpleNamespace
+
+# Make the local backend package importable so `from p7...` works under pytest
+repo_backend = Path(__file__).resolve().parents[1]  # backend/
+sys.path.insert(0, str(repo_backend))
+# Make the backend/test dir importable so you can use test_settings.py directly
+sys.path.insert(0, str(repo_backend / "test"))
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "test_settings")
+
+import django
+
+django.setup()
+
+import pytest_check as check
+from openpyxl import Workbook
+
+from p7 import helpers
+from p7.extract_file_content import extractors
+from p7.extract_file_content.extractors import get_extractor
+from p7.helpers import parse_file_content, spool_content
+
+
+def test_parse_text_from_bytes_and_stream():
+    """Plain text is decoded the same way from bytes and from a stream."""
+    file = SimpleNamespace(extension=".txt")
+    content = "\ufeffHello wørld".encode("utf-8")
+
+    check.equal(parse_file_content(content, file), "Hello wørld")
+    check.equal(parse_file_content(BytesIO(content), file), "Hello wørld")
+
+
+def test_parse_empty_content_returns_none():
+    """Empty downloads yield no content."""
+    check.is_none(parse_file_content(b"", SimpleNamespace(extension=".txt")))
+
+
+def test_parse_stops_at_character_cap(monkeypatch):
+    """Extraction stops once the character cap is reached."""
+    monkeypatch.setattr(helpers, "MAX_CONTENT_CHARS", 10)
+    monkeypatch.setattr(extractors, "TEXT_CHUNK_SIZE", 4)
+
+    content = parse_file_content(b"a" * 100, SimpleNamespace(extension=".txt"))
+
+    check.equal(content, "a" * 10)
+
+
+def test_iter_xlsx_yields_rows_per_sheet():
+    """Spreadsheets are streamed row by row, skipping empty rows."""
+    wb = Workbook()
+    ws = wb.active
+    ws.append(["name", "amount"])
+    ws.append([None, None])
+    ws.append(["apples", 3])
+    wb.create_sheet("second").append(["pears"])
+    buffer = BytesIO()
+    wb.save(buffer)
+
+    with spool_content([buffer.getvalue()]) as stream:
+        chunks = list(get_extractor(".xlsx")["extract"](stream))
+
+    check.equal(chunks, ["", "name\tamount", "apples\t3", "", "pears"])
@@ -0,0 +1,133 @@
+"""Tests for the index-time passage store and query-time highlighting."""
+
+import os
+import sys
+from datetime import timedelta
+from pathlib import Path
+
+# Make the local backend package importable so `from p7...` works under pytest
+repo_backend = Path(__file__).resolve().parents[1]  # backend/
+sys.path.insert(0, str(repo_backend))
+# Make the backend/test dir importable so you can use test_settings.py directly
+sys.path.insert(0, str(repo_backend / "test"))
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "test_settings")
+
+import django
+from django.utils import timezone
+
+django.setup()
+
+import pytest
+import pytest_check as check
+
+from p7.search.passages import (
+    HIGHLIGHT_START,
+    HIGHLIGHT_STOP,
+    parse_highlights,
+    split_passages,
+)
+from repository.file import update_tsvector_content
+from repository.models import File, FilePassage, Service, User
+from repository.passage import highlight_best_passages
+
+
+def test_split_short_content_covers_everything():
+    """Short content is split into consecutive passages on word boundaries."""
+    content = " ".join(f"word{i}" for i in range(40))
+
+    passages = split_passages(content, passage_chars=50, max_passages=32)
+
+    check.equal(passages[0].split()[0], "word0")
+    check.is_true(all(len(p) <= 50 for p in passages))
+    check.is_true(all(not p.startswith("ord") for p in passages))
+    check.is_in("word39", passages[-1])
+
+
+def test_split_long_content_is_bounded_and_spread():
+    """Long content yields at most max_passages, sampled across the whole document."""
+    content = "alpha " * 10_000 + "omega " * 10_000
+
+    passages = split_passages(content, passage_chars=60, max_passages=8)
+
+    check.equal(len(passages), 8)
+    check.is_in("alpha", passages[0])
+    check.is_in("omega", passages[-1])
+
+
+def test_split_empty_content():
+    """Files without content have no passages."""
+    check.equal(split_passages(""), [])
+
+
+def test_parse_highlights_returns_offsets():
+    """Marks are removed and replaced by offsets into the plain text."""
+    start, stop = HIGHLIGHT_START, HIGHLIGHT_STOP
+    headline = f"the {start}budget{stop} for {start}2024{stop}"
+
+    text, highlights = parse_highlights(headline)
+
+    check.equal(text, "the budget for 2024")
+    check.equal([text[start:end] for start, end in highlights], ["budget", "2024"])
+
+
+@pytest.fixture(name="file")
+def file_fixture():
+    """Fixture to create a file of a user's service."""
+    user = User.objects.create()
+    service = Service.objects.create(
+        userId=user,
+        oauthType="type1",
+        oauthToken="token1",
+        accessToken="access1",
+        accessTokenExpiration=timezone.now() + timedelta(days=365),
+        refreshToken="refresh1",
+        name="dropbox",
+        accountId="account1",
+        email="user1@example.com",
+        scopeName="files.read",
+    )
+    return File.objects.create(
+        serviceId=service,
+        serviceFileId="file-1",
+        name="minutes.txt",
+        extension=".txt",
+        downloadable=True,
+        path="/minutes.txt",
+        link="http://dropbox/minutes.txt",
+        size=1024,
+        createdAt=timezone.now(),
+        modifiedAt=timezone.now(),
+    )
+
+
+@pytest.mark.django_db
+def test_indexing_stores_passages_and_lead_snippet(file):
+    """Indexing replaces the passages and stores the first one as the snippet."""
+    content = "Meeting opened at noon. " * 20 + "The budget was approved by the board."
+
+    update_tsvector_content(file, "old content", timezone.now())
+    update_tsvector_content(file, content, timezone.now())
+
+    passages = list(FilePassage.objects.filter(fileId=file).order_by("position"))
+    check.greater(len(passages), 1)
+    check.is_false(any("old content" in p.text for p in passages))
+    file.refresh_from_db()
+    check.equal(file.snippet, passages[0].text)
+
+
+@pytest.mark.django_db
+def test_highlight_picks_best_matching_passage(file):
+    """The passage containing the query terms is highlighted, not the lead passage."""
+    content = "Meeting opened at noon. " * 20 + "The budgets were approved by the board."
+    update_tsvector_content(file, content, timezone.now())
+    results = [File.objects.get(pk=file.pk)]
+
+    highlight_best_passages(results, "budget approval")
+
+    snippet = results[0].snippet
+    check.is_in("budgets were approved", snippet)
+    check.equal(
+        [snippet[start:end] for start, end in results[0].highlights],
+        ["budgets", "approved"],
+    )
@@ -0,0 +1,113 @@
+"""Tests for request profiling spans and middleware."""
+
+import json
+import os
+import sys
+from pathlib import Path
+
+# Make the local backend package importable so `from p7...` works under pytest
+repo_backend = Path(__file__).resolve().parents[1]  # backend/
+sys.path.insert(0, str(repo_backend))
+# Make the backend/test dir importable so you can use test_settings.py directly
+sys.path.insert(0, str(repo_backend / "test"))
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "test_settings")
+
+import django
+from asgiref.sync import async_to_sync
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse
+from django.test import RequestFactory
+
+django.setup()
+
+import pytest
+import pytest_check as check
+
+from p7.profiling.middleware import ProfilingMiddleware
+from p7.profiling.spans import RequestProfile, current_profile, profile_request, span
+
+
+def test_span_without_profile_is_noop():
+    """Outside a profiled request spans record nothing."""
+    with span("scoring"):
+        pass
+
+    check.is_none(current_profile())
+
+
+def test_profile_counts_sql_and_orders_stages():
+    """SQL is counted through the execute wrapper and stages are reported in order."""
+    profile = RequestProfile()
+    profile.execute_wrapper(lambda *args: None, "SELECT 1", None, False, {})
+    profile.record_span("fusion", 0.002)
+    profile.record_span("tokenize", 0.001)
+    profile.record_span("tokenize", 0.001)
+
+    header = profile.server_timing()
+
+    check.equal(profile.query_count, 1)
+    check.is_in('sql;dur=', header)
+    check.is_in('desc="1 queries"', header)
+    check.less(header.index("tokenize;dur=2.000"), header.index("fusion;dur=2.000"))
+    check.equal(profile.summary()["spans_ms"]["tokenize"], 2.0)
+
+
+def test_profile_request_activates_profile():
+    """Spans inside profile_request are recorded on the active profile."""
+    with profile_request() as profile:
+        with span("df_lookup"):
+            pass
+
+    check.is_in("df_lookup", profile.spans)
+    check.is_none(current_profile())
+
+
+def test_middleware_disabled_by_default(settings):
+    """The middleware removes itself unless enabled."""
+    settings.PROFILING = {**settings.PROFILING, "enabled": False}
+
+    with pytest.raises(MiddlewareNotUsed):
+        ProfilingMiddleware(lambda request: HttpResponse())
+
+
+def test_middleware_adds_server_timing_and_log(settings, caplog):
+    """Profiled paths get a Server-Timing header and a JSON log line."""
+    settings.PROFILING = {
+        **settings.PROFILING,
+        "enabled": True,
+        "cprofile_sample_rate": 1.0,
+        "cprofile_dir": None,
+    }
+
+    def view(request):
+        with span("scoring"):
+            return HttpResponse("ok")
+
+    middleware = ProfilingMiddleware(view)
+    with caplog.at_level("INFO", logger="p7.profiling"):
+        response = middleware(RequestFactory().get("/api/search/"))
+        other = middleware(RequestFactory().get("/api/create_user/"))
+
+    check.is_in("scoring;dur=", response["Server-Timing"])
+    check.is_false(other.has_header("Server-Timing"))
+    log_line = json.loads(caplog.records[-1].getMessage())
+    check.equal(log_line["path"], "/api/search/")
+    check.is_in("scoring", log_line["spans_ms"])
+    check.is_in("cumulative", log_line["cprofile"])
+
+
+def test_middleware_profiles_async_views_natively(settings):
+    """Async views are awaited directly, without a thread adapter."""
+    settings.PROFILING = {**settings.PROFILING, "enabled": True, "cprofile_sample_rate": 0.0}
+
+    async def view(request):
+        with span("scoring"):
+            return HttpResponse("ok")
+
+    middleware = ProfilingMiddleware(view)
+    response = async_to_sync(middleware)(RequestFactory().get("/api/search/"))
+
+    check.is_true(ProfilingMiddleware.async_capable)
+    check.is_true(middleware.async_mode)
+    check.is_in("scoring;dur=", response["Server-Timing"])
@@ -0,0 +1,125 @@
+"""Tests for the query planner choosing how search candidates are matched."""
+
+import os
+import sys
+from pathlib import Path
+
+# Make the local backend package importable so `from p7...` works under pytest
+repo_backend = Path(__file__).resolve().parents[1]  # backend/
+sys.path.insert(0, str(repo_backend))
+# Make the backend/test dir importable so you can use test_settings.py directly
+sys.path.insert(0, str(repo_backend / "test"))
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "test_settings")
+
+import django
+
+django.setup()
+
+import pytest
+import pytest_check as check
+
+from helpers.search_corpus import DOCUMENTS, create_user_with_documents
+from p7.search.planner import (
+    QueryPlan,
+    combined_selectivity,
+    plan_query,
+    plan_tokens,
+    planned_user_index,
+)
+from repository.file import query_files
+
+
+@pytest.fixture(name="planner")
+def planner_fixture(settings):
+    """Planner settings dropping tokens in more than half of at least 10 files."""
+    settings.SEARCH_PLANNER = {
+        **settings.SEARCH_PLANNER,
+        "drop_selectivity": 0.5,
+        "min_documents": 10,
+        "min_results": 3,
+    }
+    return settings.SEARCH_PLANNER
+
+
+def test_common_tokens_do_not_match_candidates(planner):
+    """Tokens in most files are dropped, the others must all match first."""
+    plan = plan_tokens(
+        ["the", "budget", "report", "budget"], {"the": 0.9, "budget": 0.01, "report": 0.2}, 100
+    )
+
+    check.equal(plan.match, ("budget", "report"))
+    check.equal(plan.dropped, ("the",))
+    check.is_true(plan.require_all)
+    check.equal(plan.min_results, planner["min_results"])
+    check.equal(plan.tsquery(True), "budget & report")
+    check.equal(plan.tsquery(False), "budget | report")
+
+
+def test_least_common_token_is_kept(planner):
+    """When every token is common the rarest one still matches candidates."""
+    plan = plan_tokens(["the", "report"], {"the": 0.9, "report": 0.6}, 100)
+
+    check.equal(plan.match, ("report",))
+    check.is_false(plan.require_all)
+
+
+def test_small_corpora_and_unknown_tokens_keep_all_tokens(planner):
+    """Nothing is dropped below min_documents, or without a selectivity."""
+    small = plan_tokens(["the", "report"], {"the": 0.9, "report": 0.6}, 5)
+    unknown = plan_tokens(["the", "report"], {"the": None, "report": None}, 100)
+
+    check.equal(small.match, ("the", "report"))
+    check.equal(unknown.match, ("the", "report"))
+
+
+def test_combined_selectivity():
+    """Tokens are taken to occur independently, unknown ones make it unknown."""
+    check.almost_equal(combined_selectivity([0.5, 0.5]), 0.75)
+    check.equal(combined_selectivity([]), 0.0)
+    check.is_none(combined_selectivity([0.5, None]))
+
+
+@pytest.fixture(name="user")
+def user_fixture():
+    """A user with a few indexed files."""
+    return create_user_with_documents()
+
+
+@pytest.mark.django_db
+def test_all_tokens_match_first(user, settings):
+    """Files matching every token are enough once there are min_results of them."""
+    settings.SEARCH_PLANNER = {**settings.SEARCH_PLANNER, "min_results": 1}
+    matching_all = query_files(["revenue", "approved"], user.id)
+
+    settings.SEARCH_PLANNER = {**settings.SEARCH_PLANNER, "min_results": 10}
+    matching_any = query_files(["revenue", "approved"], user.id)
+
+    check.equal([file.name for file in matching_all], ["Quarterly report 2024.pdf"])
+    check.equal(
+        {file.name for file in matching_any}, {"Quarterly report 2024.pdf", "Budget plan.docx"}
+    )
+
+
+@pytest.mark.django_db
+def test_selective_queries_skip_the_memory_index(user, settings):
+    """The in-memory index is neither built nor used for few expected candidates."""
+    settings.MEMORY_INDEX = {**settings.MEMORY_INDEX, "enabled": True}
+    settings.SEARCH_PLANNER = {**settings.SEARCH_PLANNER, "memory_min_candidates": 2}
+    plan = plan_tokens(["budget"], {"budget": 0.25}, len(DOCUMENTS))
+
+    selective = QueryPlan(name=plan, content=plan, selectivity=0.25, documents=len(DOCUMENTS))
+    broad = QueryPlan(name=plan, content=plan, selectivity=0.75, documents=len(DOCUMENTS))
+    unknown = QueryPlan(name=plan, content=plan, selectivity=None, documents=len(DOCUMENTS))
+
+    check.is_none(planned_user_index(selective, user.id, user.indexVersion))
+    check.is_not_none(planned_user_index(broad, user.id, user.indexVersion))
+    check.is_not_none(planned_user_index(unknown, user.id, user.indexVersion))
+
+
+@pytest.mark.django_db
+def test_plan_counts_only_the_users_files(user):
+    """Selectivities apply to the user's files, not to every file in the table."""
+    create_user_with_documents({"Other notes.txt": "someone else's budget"})
+
+    check.equal(plan_query("budget", user).documents, len(DOCUMENTS))
@@ -14,6 +14,8 @@ sys.path.insert(0, str(repo_backend / "test"))
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "test_settings")
 
 import django
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from django.contrib.postgres.search import SearchVector, Value
 from django.db.models import Q
@@ -185,3 +187,45 @@ def test_user_search_for_equally_ranked_files(test_data):
     assert_files_have_same_rank(
         query="big", base_filter=Q(serviceId=test_data["service"])
     )
+
+
+def test_bm25_prefers_shorter_files(test_data):
+    """
+    Test user searches for 'burgers' with BM25, every file contains it once
+    The ranking should follow the stored content lengths:
+    1) Doc 3 (Mega burgers) - 2 Words
+    2) Doc 4 (Like burgers big) - 3 Words
+    3) Doc 1 (I like big burgers) - 4 Words
+    params:
+        test_data: Fixture containing test users and files.
+    """
+    for name, length in (("doc1", 4), ("doc2", 4), ("doc3", 2), ("doc4", 3)):
+        File.objects.filter(pk=test_data[name].pk).update(contentLength=length)
+
+    results = File.objects.ranking_based_on_content(
+        "burgers", base_filter=Q(serviceId=test_data["service"]), ranking="bm25"
+    )
+    ranks = {file.pk: file.rank for file in results}
+
+    assert ranks[test_data["doc3"].pk] > ranks[test_data["doc4"].pk] > ranks[test_data["doc1"].pk]
+    assert ranks[test_data["doc1"].pk] == ranks[test_data["doc2"].pk]
+
+
+@pytest.mark.parametrize("ranking", ["tfidf", "bm25"])
+def test_term_frequencies_are_read_in_one_statement(test_data, ranking):
+    """
+    Scoring reads the term frequencies of all candidates at once,
+    not with a ts_stat() per file.
+    params:
+        test_data: Fixture containing test users and files.
+        ranking: The content ranking used.
+    """
+    with CaptureQueriesContext(connection) as queries:
+        results = File.objects.ranking_based_on_content(
+            "burgers", base_filter=Q(serviceId=test_data["service"]), ranking=ranking
+        )
+
+    assert len(results) == 4
+    term_queries = [q for q in queries.captured_queries if 'unnest(f."tsContent")' in q["sql"]]
+    assert len(term_queries) == 1
+    assert not any("::tsvector$$" in q["sql"] for q in queries.captured_queries)
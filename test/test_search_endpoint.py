@@ -27,6 +27,7 @@ from helpers.search_filename import (
     assert_search_filename_missing_header,
     assert_search_filename_missing_search_string,
     assert_search_filename_missing_userid,
+    parse_server_sent_events,
 )
 from helpers.general_helper_functions import create_x_users
 from repository.models import File, Service, User
@@ -89,6 +90,19 @@ def test_search_filename_missing_search_string(test_client):
     for user_number in range(1, 3 + 1):  # 3 users
         assert_search_filename_missing_search_string(test_client, user_number)
 
+def test_search_filename_unknown_ranking(test_client):
+    """Test searching files with a ranking that does not exist.
+    params:
+        client: Test client to make requests.
+    """
+    response = test_client.get(
+        "/?user_id=1&search_string=report&ranking=pagerank",
+        headers={"x-internal-auth": "p7"},
+    )
+
+    check.equal(response.status_code, 400)
+    check.equal(response.json(), {"error": "ranking must be one of tfidf, bm25"})
+
 def test_search_filename_end_to_end(search_file):
     """Test searching files by filename end-to-end.
     params:
@@ -166,6 +180,82 @@ def test_search_filename_end_to_end(search_file):
     check.equal(
         file["serviceName"], service1.name
     )  # Check service provider is sent with the file
+    check.is_not_in("explanation", file)  # Only sent to explain requests
+
+    response = search_file.get(
+        f"/?user_id={user1.id}&search_string=report&explain=true",
+        headers={"x-internal-auth": "p7"},
+    )
+
+    check.equal(response.status_code, 200)
+    explanation = response.json()["files"][0]["explanation"]
+    check.equal(explanation["token_ratio"], 1.0)
+    check.equal(explanation["content_rank"], 0.0)
+    check.equal(explanation["content_ranking"], "tfidf")
+    check.almost_equal(
+        explanation["combined_rank"],
+        explanation["name_rank"] * explanation["name_weight"],
+    )
+    check.almost_equal(
+        explanation["name_rank"],
+        explanation["plain_rank"] * explanation["token_ratio"] + explanation["ordered_bonus"],
+    )
+
+def test_search_filename_stream(search_file):
+    """The stream sends the name ranked files first, then the fused results."""
+    user = User.objects.create()
+    service = Service.objects.create(
+        userId=user,
+        oauthType="GOOGLE",
+        oauthToken="fake-token-1",
+        accessToken="fake-access-1",
+        accessTokenExpiration=timezone.now() + timedelta(days=365),
+        refreshToken="fake-refresh-1",
+        name="google",
+        accountId="acc1",
+        email="stream@example.com",
+        scopeName="files.read",
+    )
+    by_name = File.objects.create(
+        serviceId=service,
+        serviceFileId="file-1",
+        name="report-stream.docx",
+        extension="docx",
+        downloadable=True,
+        path="/report-stream.docx",
+        link="http://google/link1",
+        size=1024,
+        createdAt=timezone.now(),
+        modifiedAt=timezone.now(),
+        tsFilename=SearchVector(Value("report-stream"), weight="A", config="simple"),
+        tsContent=SearchVector(Value(""), weight="B", config="english"),
+    )
+    by_content = File.objects.create(
+        serviceId=service,
+        serviceFileId="file-2",
+        name="minutes.docx",
+        extension="docx",
+        downloadable=True,
+        path="/minutes.docx",
+        link="http://google/link2",
+        size=1024,
+        createdAt=timezone.now(),
+        modifiedAt=timezone.now(),
+        tsFilename=SearchVector(Value("minutes"), weight="A", config="simple"),
+        tsContent=SearchVector(Value("the yearly report"), weight="B", config="english"),
+    )
+
+    response = search_file.get(
+        f"/stream?user_id={user.id}&search_string=report", headers={"x-internal-auth": "p7"}
+    )
+
+    check.equal(response.status_code, 200)
+    check.equal(response["Content-Type"], "text/event-stream")
+    events = parse_server_sent_events(response.content)
+    check.equal([event for event, _ in events], ["names", "results"])
+    check.equal([f["id"] for f in events[0][1]["files"]], [by_name.id])
+    check.equal({f["id"] for f in events[1][1]["files"]}, {by_name.id, by_content.id})
+    check.equal(events[1][1]["files"][0]["serviceName"], service.name)
 
 def _parse_iso_with_z(s: str) -> datetime:
     """
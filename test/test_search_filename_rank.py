@@ -118,3 +118,11 @@ def test_overfitting_token_count(test_data):
 def test_partial_token_match(test_data):
     """Test that partial token matches rank lower than full token matches."""
     assert_partial_token_match("Token1", "Token1 Token2", test_data["file1"].name)
+
+def test_token_coverage_counts_each_query_token(test_data):
+    """Test that coverage counts repeated and differently cased tokens like separate matches."""
+    results = File.objects.ranking_based_on_file_name("token1 TOKEN1 Token5 missing")
+    coverage = {file.name: (file.matched_tokens, file.token_ratio) for file in results}
+
+    assert coverage[test_data["file1"].name] == (3, 0.75)
+    assert coverage[test_data["file2"].name] == (2, 0.5)
@@ -0,0 +1,201 @@
+"""Tests for the on-disk postings segments and the content search reading them."""
+
+import os
+import sys
+from datetime import timedelta
+from pathlib import Path
+
+# Make the local backend package importable so `from p7...` works under pytest
+repo_backend = Path(__file__).resolve().parents[1]  # backend/
+sys.path.insert(0, str(repo_backend))
+# Make the backend/test dir importable so you can use test_settings.py directly
+sys.path.insert(0, str(repo_backend / "test"))
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "test_settings")
+
+import django
+from django.utils import timezone
+
+django.setup()
+
+import pytest
+import pytest_check as check
+
+from helpers.search_corpus import DOCUMENTS, create_user_with_documents, ranked
+from p7.search import segment_index
+from p7.search.segments import (
+    Segment,
+    decode_ids,
+    encode_ids,
+    live_doc_ids,
+    live_postings,
+    merge_segments,
+    quantized_postings,
+    segment_path,
+    segment_paths,
+    write_segment,
+)
+from repository.file import query_files, update_tsvector_content
+
+
+def open_segments(directory):
+    """All segments of a directory, newest first."""
+    return [Segment(path) for path in segment_paths(directory)]
+
+
+def test_ids_round_trip_as_varint_deltas():
+    """Ids come back sorted, small gaps take a byte and large ids still fit."""
+    ids = [5, 1, 130, 2**40, 131]
+
+    encoded = encode_ids(ids)
+
+    check.equal(list(decode_ids(memoryview(encoded))), sorted(ids))
+    check.equal(len(encode_ids([1, 2, 3])), 3)
+
+
+def test_segment_lookup_reads_postings(tmp_path):
+    """Terms are found by binary search and postings decode to ids and weights."""
+    postings = quantized_postings(
+        {1: {"budget": 3, "plan": 1}, 7: {"budget": 1}, 9: {"zebra": 2}}
+    )
+    write_segment(segment_path(tmp_path, 1), postings, [1, 7, 9, 12], file_count=20)
+
+    segment = open_segments(tmp_path)[0]
+
+    check.equal(list(segment.terms()), ["budget", "plan", "zebra"])
+    check.equal([file_id for file_id, _ in segment.postings("budget")], [1, 7])
+    check.equal(list(segment.postings("missing")), [])
+    check.equal(segment.document_frequency("budget"), 2)
+    check.equal(segment.file_count, 20)
+    check.equal(list(segment.doc_ids()), [1, 7, 9, 12])
+    # A single term file has unit weight, stored as the top level
+    check.equal(dict(segment.postings("zebra"))[9][0], 255)
+
+
+def test_newer_segments_shadow_older_ones(tmp_path):
+    """Reindexed and deleted files are described by the newest segment only."""
+    write_segment(
+        segment_path(tmp_path, 1),
+        quantized_postings({1: {"budget": 1}, 2: {"budget": 1}, 3: {"budget": 1}}),
+        [1, 2, 3],
+    )
+    write_segment(segment_path(tmp_path, 2), quantized_postings({2: {"zebra": 1}}), [2], [3])
+
+    segments = open_segments(tmp_path)
+
+    check.equal([segment.generation for segment in segments], [2, 1])
+    check.equal(live_doc_ids(segments), {1, 2})
+    postings = live_postings(segments, ["budget", "zebra"])
+    check.equal(set(postings["budget"]), {1})
+    check.equal(set(postings["zebra"]), {2})
+
+
+def test_merge_keeps_only_live_postings(tmp_path):
+    """A merged segment answers like its inputs did, without the shadowed entries."""
+    write_segment(
+        segment_path(tmp_path, 1),
+        quantized_postings({1: {"budget": 2, "plan": 1}, 2: {"budget": 1}}),
+        [1, 2],
+    )
+    write_segment(
+        segment_path(tmp_path, 2), quantized_postings({1: {"zebra": 1}}), [1], file_count=5,
+        watermark=42.0,
+    )
+    segments = open_segments(tmp_path)
+    before = live_postings(segments, ["budget", "plan", "zebra"])
+
+    merge_segments(segments, tmp_path / "merged.seg")
+    merged = Segment(tmp_path / "merged.seg")
+
+    check.equal(live_postings([merged], ["budget", "plan", "zebra"]), before)
+    check.equal(list(merged.terms()), ["budget", "zebra"])
+    check.equal(list(merged.deleted_ids()), [])
+    check.equal((merged.file_count, merged.watermark), (5, 42.0))
+
+
+def test_bm25_impacts_favour_short_files(tmp_path):
+    """The same term frequency weighs more in a file shorter than average."""
+    postings = quantized_postings(
+        {1: {"budget": 2}, 2: {"budget": 2}}, {1: 50, 2: 500}, average_length=100
+    )
+    write_segment(segment_path(tmp_path, 1), postings, [1, 2])
+
+    segment = open_segments(tmp_path)[0]
+    impacts = {file_id: levels[1] for file_id, levels in segment.postings("budget")}
+
+    check.greater(impacts[1], impacts[2])
+
+
+def test_rejects_files_that_are_not_segments(tmp_path):
+    """A foreign file is not mapped as a segment."""
+    path = tmp_path / "0000000001.seg"
+    path.write_bytes(b"not a segment" * 10)
+
+    with pytest.raises(ValueError):
+        Segment(path)
+
+
+@pytest.fixture(name="user")
+def user_fixture(settings, tmp_path):
+    """A user with indexed files, and segments stored in a temporary directory."""
+    settings.SEARCH_SEGMENTS = {**settings.SEARCH_SEGMENTS, "directory": str(tmp_path)}
+    segment_index.get_segment_cache.cache_clear()
+    return create_user_with_documents()
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("ranking", ["tfidf", "bm25"])
+@pytest.mark.parametrize("query", ["budget", "quarterly revenue", "holiday schedule"])
+def test_segment_search_matches_sql(user, settings, query, ranking):
+    """Content ranked from segments orders files like SQL, within quantization error."""
+    from_sql = ranked(query_files(query.split(), user.id, ranking=ranking))
+
+    check.equal(segment_index.write_user_segment(user.id), len(DOCUMENTS))
+    settings.SEARCH_SEGMENTS = {**settings.SEARCH_SEGMENTS, "enabled": True}
+    from_segments = ranked(query_files(query.split(), user.id, ranking=ranking))
+
+    check.is_true(from_sql)
+    check.equal([file_id for file_id, _ in from_segments], [file_id for file_id, _ in from_sql])
+    for (_, segment_rank), (_, sql_rank) in zip(from_segments, from_sql):
+        check.almost_equal(segment_rank, sql_rank, rel=1e-2)
+
+
+@pytest.mark.django_db
+def test_segments_follow_reindexing_and_deletes(user, settings):
+    """New segments cover changed and deleted files, and are merged past the limit."""
+    settings.SEARCH_SEGMENTS = {**settings.SEARCH_SEGMENTS, "max_segments": 2}
+    segment_index.write_user_segment(user.id)
+    check.equal(segment_index.write_user_segment(user.id), 0)  # Nothing changed
+
+    files = user.services.get().files
+    notes = files.get(name="Meeting notes.txt")
+    update_tsvector_content(notes, "a zebra crossed the meeting room", timezone.now())
+    files.filter(name="Budget plan.docx").delete()
+    check.equal(segment_index.write_user_segment(user.id), 2)
+
+    directory = segment_index.user_segment_directory(user.id)
+    segments = segment_index.get_segment_cache().open_user_segments(user.id)
+    check.equal(len(segments), 2)
+    check.equal(set(live_postings(segments, ["zebra"])["zebra"]), {notes.id})
+    check.equal(len(live_doc_ids(segments)), len(DOCUMENTS) - 1)
+
+    update_tsvector_content(notes, "the zebra left", timezone.now())
+    segment_index.write_user_segment(user.id)
+
+    check.equal(len(segment_paths(directory)), 1)
+    settings.SEARCH_SEGMENTS = {**settings.SEARCH_SEGMENTS, "enabled": True}
+    check.equal([file.id for file in query_files(["zebra"], user.id)], [notes.id])
+
+
+@pytest.mark.django_db
+def test_segments_pick_up_content_committed_late(user):
+    """Content downloaded before a segment was written but committed after is not lost."""
+    downloaded_at = timezone.now() - timedelta(minutes=10)
+    segment_index.write_user_segment(user.id)
+
+    notes = user.services.get().files.get(name="Meeting notes.txt")
+    update_tsvector_content(notes, "a zebra crossed the meeting room", downloaded_at)
+
+    check.equal(segment_index.write_user_segment(user.id), 1)
+    segments = segment_index.get_segment_cache().open_user_segments(user.id)
+    check.equal(set(live_postings(segments, ["zebra"])["zebra"]), {notes.id})
@@ -0,0 +1,164 @@
+"""Tests for the blind index serviceFileIds are looked up with."""
+
+import os
+import sys
+from datetime import timedelta
+from pathlib import Path
+
+# Make the local backend package importable so `from p7...` works under pytest
+repo_backend = Path(__file__).resolve().parents[1]  # backend/
+sys.path.insert(0, str(repo_backend))
+# Make the backend/test dir importable so you can use test_settings.py directly
+sys.path.insert(0, str(repo_backend / "test"))
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "test_settings")
+
+import django
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+django.setup()
+
+import pytest
+import pytest_check as check
+
+from repository.file import get_files_missing_from_service, save_file
+from repository.helpers import blind_index_key_id, service_file_id_hash
+from repository.models import File, Service, User
+
+
+def test_hash_is_deterministic_and_keyed(settings):
+    """Equal ids hash equally, a different key gives a different hash."""
+    first = service_file_id_hash("id:abc")
+
+    check.equal(service_file_id_hash("id:abc"), first)
+    check.not_equal(service_file_id_hash("id:abd"), first)
+    check.equal(len(first), 32)
+
+    key_id = blind_index_key_id()
+    settings.BLIND_INDEX_KEY = "another key"
+    check.not_equal(service_file_id_hash("id:abc"), first)
+    check.not_equal(blind_index_key_id(), key_id)
+
+
+@pytest.fixture(name="service")
+def service_fixture():
+    """A service of a new user."""
+    return Service.objects.create(
+        userId=User.objects.create(),
+        oauthType="type1",
+        oauthToken="token1",
+        accessToken="access1",
+        accessTokenExpiration=timezone.now() + timedelta(days=365),
+        refreshToken="refresh1",
+        name="dropbox",
+        accountId="account1",
+        email="user1@example.com",
+        scopeName="files.read",
+    )
+
+
+def store(service, service_file_id, name):
+    """Save a file of the service."""
+    return save_file(
+        service_id=service,
+        service_file_id=service_file_id,
+        name=name,
+        extension=".pdf",
+        downloadable=True,
+        path=f"/{name}",
+        link=f"http://dropbox/{service_file_id}",
+        size=1024,
+        created_at=timezone.now(),
+        modified_at=timezone.now(),
+        indexed_at=None,
+        snippet=None,
+    )
+
+
+def forget_hashes(service, files):
+    """Make files look stored before the hash existed, in a service never backfilled."""
+    File.objects.filter(pk__in=[file.pk for file in files]).update(serviceFileIdHash=None)
+    Service.objects.filter(pk=service.pk).update(fileIdHashKeyId=None)
+    service.fileIdHashKeyId = None
+
+
+@pytest.mark.django_db
+def test_save_file_upserts_by_hash(service):
+    """Saving a file again updates the row found through its hash."""
+    first = store(service, "file_0", "Report.pdf")
+    second = store(service, "file_0", "Renamed report.pdf")
+
+    check.equal(second.pk, first.pk)
+    check.equal(File.objects.filter(serviceId=service).count(), 1)
+    check.equal(
+        bytes(File.objects.get(pk=first.pk).serviceFileIdHash), service_file_id_hash("file_0")
+    )
+
+
+@pytest.mark.django_db
+def test_files_stored_before_the_hash_are_backfilled(service):
+    """A file without a hash is hashed on the next upsert instead of duplicated."""
+    legacy = store(service, "file_0", "Report.pdf")
+    forget_hashes(service, [legacy])
+
+    saved = store(service, "file_0", "Report.pdf")
+
+    check.equal(saved.pk, legacy.pk)
+    check.equal(File.objects.filter(serviceId=service).count(), 1)
+
+
+@pytest.mark.django_db
+def test_files_missing_from_service(service):
+    """Only stored files the service no longer lists are missing, hashed or not."""
+    kept = store(service, "file_0", "Report.pdf")
+    deleted = store(service, "file_1", "Old notes.pdf")
+    legacy = store(service, "file_2", "Budget.pdf")
+    forget_hashes(service, [legacy])
+
+    missing = get_files_missing_from_service(service, ["file_0", "file_2", "file_3"])
+
+    check.equal([file.pk for file in missing], [deleted.pk])
+    check.is_not_none(File.objects.get(pk=legacy.pk).serviceFileIdHash)
+    check.is_true(File.objects.filter(pk=kept.pk).exists())
+
+
+@pytest.mark.django_db
+def test_key_change_rehashes_instead_of_deleting(service, settings):
+    """Files hashed under an old key are neither missing from the service nor stored twice."""
+    report = store(service, "file_0", "Report.pdf")
+    notes = store(service, "file_1", "Notes.pdf")
+    settings.BLIND_INDEX_KEY = "rotated key"
+
+    check.equal(get_files_missing_from_service(service, ["file_0", "file_1"]), [])
+    check.equal(store(service, "file_0", "Report.pdf").pk, report.pk)
+    check.equal(File.objects.filter(serviceId=service).count(), 2)
+    check.equal(
+        bytes(File.objects.get(pk=notes.pk).serviceFileIdHash), service_file_id_hash("file_1")
+    )
+    check.equal(Service.objects.get(pk=service.pk).fileIdHashKeyId, blind_index_key_id())
+
+
+@pytest.mark.django_db
+def test_upsert_after_key_change_finds_the_file(service, settings):
+    """The first upsert under a new key rehashes the service before giving up on a file."""
+    report = store(service, "file_0", "Report.pdf")
+    settings.BLIND_INDEX_KEY = "rotated key"
+
+    check.equal(store(service, "file_0", "Renamed report.pdf").pk, report.pk)
+    check.equal(File.objects.filter(serviceId=service).count(), 1)
+
+
+@pytest.mark.django_db
+def test_new_files_of_a_backfilled_service_skip_the_backfill(service):
+    """Once a service is hashed under the current key, new files do not look for old rows."""
+    store(service, "file_0", "Report.pdf")
+
+    with CaptureQueriesContext(connection) as queries:
+        store(service, "file_1", "Notes.pdf")
+
+    check.is_false(
+        any('"serviceFileIdHash" IS NULL' in q["sql"] for q in queries.captured_queries)
+    )
+    check.equal(File.objects.filter(serviceId=service).count(), 2)
@@ -4,6 +4,7 @@ import os
 from p7 import settings as p7_settings
 
 SECRET_KEY = "bogus"
+BLIND_INDEX_KEY = "bogus"
 
 INSTALLED_APPS = [
     "repository",
@@ -23,4 +24,17 @@ DATABASES = {
 }
 Q_CLUSTER = p7_settings.Q_CLUSTER.copy()
 Q_CLUSTER['sync'] = True
+FILE_EXTRACTION = p7_settings.FILE_EXTRACTION.copy()
+FILE_EXTRACTION['isolated'] = False
+TASK_SCHEDULER = p7_settings.TASK_SCHEDULER.copy()
+SYNC_PLANNER = p7_settings.SYNC_PLANNER.copy()
+PROFILING = p7_settings.PROFILING.copy()
+ASYNC_ENDPOINTS = p7_settings.ASYNC_ENDPOINTS
+SEARCH_RANKING = p7_settings.SEARCH_RANKING
+MEMORY_INDEX = p7_settings.MEMORY_INDEX.copy()
+MEMORY_INDEX['build_in_background'] = False
+SEARCH_SEGMENTS = p7_settings.SEARCH_SEGMENTS.copy()
+SEARCH_PLANNER = p7_settings.SEARCH_PLANNER.copy()
+# The test corpora are small, the in-memory index is always worth scoring from
+SEARCH_PLANNER['memory_min_candidates'] = 0
 # DJANGO_Q database config. Docs: https://django-q2.readthedocs.io/en/master/configure.html
@@ -0,0 +1,89 @@
+"""Tests for staggered, change-rate aware sync planning."""
+
+import os
+import sys
+from pathlib import Path
+from datetime import datetime, timedelta, timezone
+
+# Make the local backend package importable so `from p7...` works under pytest
+repo_backend = Path(__file__).resolve().parents[1]  # backend/
+sys.path.insert(0, str(repo_backend))
+# Make the backend/test dir importable so you can use test_settings.py directly
+sys.path.insert(0, str(repo_backend / "test"))
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "test_settings")
+
+import django
+
+django.setup()
+
+import pytest
+import pytest_check as check
+from django_q.models import Schedule
+
+from p7.sync_files.planner import (
+    adapt_sync_interval,
+    next_sync_time,
+    plan_next_sync,
+    schedule_service_sync,
+)
+from repository.models import Service, User
+
+DAY = 24 * 60 * 60
+NOW = datetime(2025, 11, 3, 9, 0, tzinfo=timezone.utc)
+
+
+def test_burst_of_services_is_spread_over_the_day():
+    """Services created in the same minute get next runs spread over the interval."""
+    runs = [next_sync_time(f"Dropbox-{user_id}", DAY, NOW) for user_id in range(200)]
+    hours = {run.hour for run in runs}
+
+    check.is_true(all(run >= NOW + timedelta(seconds=DAY // 2) for run in runs))
+    check.is_true(all(run < NOW + timedelta(seconds=DAY * 3 // 2) for run in runs))
+    check.greater(len(hours), 20)
+
+
+def test_service_keeps_its_slot():
+    """A service's runs are a whole interval apart."""
+    first = next_sync_time("Onedrive-7", DAY, NOW)
+    second = next_sync_time("Onedrive-7", DAY, first)
+
+    check.equal(second - first, timedelta(seconds=DAY))
+
+
+def test_interval_adapts_to_changes_within_bounds(settings):
+    """The interval halves with changes and doubles without, clamped to the bounds."""
+    settings.SYNC_PLANNER = {"min_interval": 3600, "default_interval": DAY, "max_interval": 4 * DAY}
+
+    check.equal(adapt_sync_interval(DAY, 12), DAY // 2)
+    check.equal(adapt_sync_interval(DAY, 0), 2 * DAY)
+    check.equal(adapt_sync_interval(3600, 5), 3600)
+    check.equal(adapt_sync_interval(4 * DAY, 0), 4 * DAY)
+
+
+@pytest.mark.django_db
+def test_plan_next_sync_updates_schedule(settings):
+    """A sync that finds changes moves the service's schedule closer."""
+    settings.SYNC_PLANNER = {"min_interval": 3600, "default_interval": DAY, "max_interval": 4 * DAY}
+    user = User.objects.create()
+    service = Service.objects.create(
+        userId=user,
+        oauthType="type1",
+        oauthToken="token1",
+        accessToken="access1",
+        accessTokenExpiration=datetime.now(timezone.utc) + timedelta(days=365),
+        refreshToken="refresh1",
+        name="dropbox",
+        accountId="account1",
+        email="user1@example.com",
+        scopeName="files.read",
+    )
+    group = f"Dropbox-{user.pk}"
+    schedule_service_sync("p7.sync_files.service_sync_functions.sync_dropbox_files", user.pk, group)
+
+    plan_next_sync(service, 3, group)
+
+    planned = Schedule.objects.get(name=group)
+    check.equal(planned.minutes, DAY // 2 // 60)
+    check.equal(planned.func, "repository.queue.submit_scheduled_task")
+    check.equal(Service.objects.get(pk=service.pk).syncInterval, DAY // 2)
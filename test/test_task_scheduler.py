@@ -0,0 +1,198 @@
+"""Tests for fair-share scheduling of provider tasks."""
+
+import os
+import sys
+from pathlib import Path
+
+# Make the local backend package importable so `from p7...` works under pytest
+repo_backend = Path(__file__).resolve().parents[1]  # backend/
+sys.path.insert(0, str(repo_backend))
+# Make the backend/test dir importable so you can use test_settings.py directly
+sys.path.insert(0, str(repo_backend / "test"))
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "test_settings")
+
+import django
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+django.setup()
+
+import pytest
+import pytest_check as check
+
+from p7.sync_files.planner import schedule_task_dispatch
+from repository import queue
+from repository.models import ScheduledJob, User
+from repository.queue import (
+    delete_user_queued_tasks,
+    dispatch_tasks,
+    run_scheduled_job,
+    submit_task,
+    user_id_from_group,
+)
+
+pytestmark = pytest.mark.django_db
+
+# Jobs of one user on different services, so they are not coalesced
+PROVIDERS = ["Dropbox", "Google-Drive", "Onedrive", "Local"]
+
+
+def echo(value):
+    """Task used by the tests."""
+    return value
+
+
+@pytest.fixture(name="started")
+def started_fixture(monkeypatch, settings):
+    """Record dispatched jobs instead of running them, on a 2 worker cluster."""
+    settings.Q_CLUSTER = {**settings.Q_CLUSTER, "ALT_CLUSTERS": {"high": {"workers": 2}}}
+    settings.TASK_SCHEDULER = {**settings.TASK_SCHEDULER, "max_running_per_user": 1}
+    started = []
+
+    def fake_async_task(func, job_id, **kwargs):
+        started.append(ScheduledJob.objects.get(pk=job_id))
+        return f"task-{job_id}"
+
+    monkeypatch.setattr(queue, "async_task", fake_async_task)
+    return started
+
+
+def test_user_id_from_group():
+    """The user is taken from the end of the task group."""
+    check.equal(user_id_from_group("Dropbox-12"), 12)
+    check.equal(user_id_from_group("Google-Drive-7"), 7)
+
+
+def test_user_is_capped_and_others_are_interleaved(started):
+    """A user with many jobs cannot starve a user who submits later."""
+    heavy, light = User.objects.create(), User.objects.create()
+
+    task_ids = [
+        submit_task(echo, i, group=f"{provider}-{heavy.pk}")
+        for i, provider in enumerate(PROVIDERS[:3])
+    ]
+    submit_task(echo, "light", group=f"Dropbox-{light.pk}")
+
+    check.equal(task_ids[0], f"task-{started[0].pk}")
+    check.equal(task_ids[1:], [None, None])
+    check.equal([job.userId_id for job in started], [heavy.pk, light.pk])
+
+    # When the heavy user's job finishes, their next job takes the free worker
+    ScheduledJob.objects.filter(pk=started[0].pk).delete()
+    dispatch_tasks("high")
+
+    check.equal(started[2].args, [1])
+
+
+def test_new_user_is_not_queued_behind_backlog(started, settings):
+    """A later user's job is interleaved with another user's backlog."""
+    settings.TASK_SCHEDULER = {**settings.TASK_SCHEDULER, "max_running_per_user": 2}
+    heavy, light = User.objects.create(), User.objects.create()
+
+    for i, provider in enumerate(PROVIDERS):
+        submit_task(echo, i, group=f"{provider}-{heavy.pk}")
+    submit_task(echo, "light", group=f"Dropbox-{light.pk}")
+
+    pending = ScheduledJob.objects.filter(status=ScheduledJob.PENDING)
+    order = list(pending.order_by("virtualStart", "id").values_list("userId_id", flat=True))
+    check.equal(order, [heavy.pk, light.pk, heavy.pk])
+
+
+def test_run_scheduled_job_returns_result_and_frees_slot(started):
+    """The job's result is the task result and the job row is removed."""
+    user = User.objects.create()
+    submit_task(echo, "done", group=f"Local-{user.pk}")
+
+    check.equal(run_scheduled_job(started[0].pk), "done")
+    check.is_false(ScheduledJob.objects.filter(pk=started[0].pk).exists())
+
+
+def test_delete_user_queued_tasks_removes_scheduled_jobs(started):
+    """Deleting a user's queue also drops their scheduled jobs."""
+    user = User.objects.create()
+    submit_task(echo, 1, group=f"Dropbox-{user.pk}")
+    submit_task(echo, 2, group=f"Onedrive-{user.pk}")
+
+    delete_user_queued_tasks(user.pk)
+
+    check.is_false(ScheduledJob.objects.filter(userId=user).exists())
+
+
+def test_duplicate_of_pending_job_is_merged(started):
+    """A second identical submission while the first is queued adds no job."""
+    user = User.objects.create()
+    submit_task(echo, "running", group=f"Dropbox-{user.pk}")
+    submit_task(echo, "first", group=f"Onedrive-{user.pk}")
+    submit_task(echo, "second", group=f"Onedrive-{user.pk}")
+
+    jobs = ScheduledJob.objects.filter(group=f"Onedrive-{user.pk}")
+    check.equal(jobs.count(), 1)
+    check.equal(jobs.get().args, ["first"])
+
+
+def test_duplicate_of_running_job_reruns_after_finish(started):
+    """A duplicate of a running job runs once it finishes, not alongside it."""
+    user = User.objects.create()
+    task_id = submit_task(echo, "first", group=f"Dropbox-{user.pk}")
+    check.equal(submit_task(echo, "again", group=f"Dropbox-{user.pk}"), task_id)
+    check.equal(len(started), 1)
+
+    run_scheduled_job(started[0].pk)
+
+    check.equal(len(started), 2)
+    check.equal(started[1].args, ["again"])
+    check.is_none(started[1].rerunArgs)
+
+
+def test_continuation_of_running_job_is_queued(started):
+    """A running job can queue its own continuation."""
+    user = User.objects.create()
+    submit_task(echo, "first", group=f"Dropbox-{user.pk}")
+    submit_task(echo, "next", group=f"Dropbox-{user.pk}", rerun_if_running=False)
+
+    check.equal(ScheduledJob.objects.filter(group=f"Dropbox-{user.pk}").count(), 2)
+    check.is_none(ScheduledJob.objects.get(pk=started[0].pk).rerunArgs)
+
+
+def test_running_job_with_expired_lease_frees_its_slot(started):
+    """A running job whose worker died stops counting once its lease runs out."""
+    user = User.objects.create()
+    submit_task(echo, "dead", group=f"Dropbox-{user.pk}")
+    submit_task(echo, "waiting", group=f"Onedrive-{user.pk}")
+    check.equal(len(started), 1)
+
+    ScheduledJob.objects.filter(pk=started[0].pk).update(leaseExpiresAt=timezone.now())
+    dispatch_tasks("high")
+
+    check.equal([job.args for job in started], [["dead"], ["waiting"]])
+    check.is_false(ScheduledJob.objects.filter(pk=started[0].pk).exists())
+    check.is_not_none(ScheduledJob.objects.get(pk=started[1].pk).leaseExpiresAt)
+
+
+def test_duplicate_of_running_job_with_expired_lease_is_queued(started):
+    """A duplicate of a dead running job runs as a new job instead of merging into it."""
+    user = User.objects.create()
+    dead_task_id = submit_task(echo, "dead", group=f"Dropbox-{user.pk}")
+    ScheduledJob.objects.filter(pk=started[0].pk).update(leaseExpiresAt=timezone.now())
+
+    task_id = submit_task(echo, "again", group=f"Dropbox-{user.pk}")
+
+    check.not_equal(task_id, dead_task_id)
+    check.equal(task_id, f"task-{started[1].pk}")
+    check.equal(started[1].args, ["again"])
+    check.equal(ScheduledJob.objects.filter(group=f"Dropbox-{user.pk}").count(), 1)
+
+
+def test_scheduled_dispatch_starts_jobs_behind_an_expired_lease(started):
+    """Without another submit, the dispatch schedule starts jobs a dead job held back."""
+    user = User.objects.create()
+    submit_task(echo, "dead", group=f"Dropbox-{user.pk}")
+    submit_task(echo, "waiting", group=f"Onedrive-{user.pk}")
+    ScheduledJob.objects.filter(pk=started[0].pk).update(leaseExpiresAt=timezone.now())
+
+    dispatch = schedule_task_dispatch()
+    import_string(dispatch.func)()
+
+    check.equal(dispatch.schedule_type, dispatch.MINUTES)
+    check.equal([job.args for job in started], [["dead"], ["waiting"]])